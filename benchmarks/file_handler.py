@@ -0,0 +1,736 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the File protocol handler.
+
+Each case reads synthetic files of a size with a number of variables of a
+kind of command, over a protocol and in a read mode, for a few cycles of
+connect, read of each variable and disconnect, like the worker does. The
+kinds of commands are :
+
+ - awk : $1=="sN"{print $2; exit}, merged by the awk batch and evaluated
+   natively,
+ - line : the sed line address N!d, read from the line index or the head
+   of the remote file,
+ - range : the awk command on the last 16 kB of the file, a ranged read,
+ - end : $1=="sN"{v=$2} END{print v}, which none of these paths accept,
+   as a control.
+
+The remote protocols The remote protocols
+are served on localhost by stand-in servers : paramiko for ssh commands and
+sftp, pyftpdlib for ftp.
+
+For each case are measured :
+
+ - the latency of a cycle, in seconds,
+ - the throughput, bytes of the file read and variables per second,
+ - the processes spawned by the handler per cycle, and the commands run by
+   the ssh server,
+ - the bytes transferred by the servers per cycle,
+ - the peak resident memory of the process running the case, in kB.
+
+Lines are appended to the file before each cycle, so that the unchanged
+file detections of the handler do not skip the reads, unless
+--append-lines is 0.
+
+The optimizations of the handler, off by default in the models, are
+switched on unless --set switches them off, like --set batch_read=0.
+
+The results are written as JSON, and two results files can be compared :
+
+    python benchmarks/file_handler.py -o new.json
+    python benchmarks/file_handler.py --compare old.json new.json
+
+The default cases use files of 1K and 1M with 1 and 100 variables. Larger
+ones are run on demand, like --sizes 100M,1G --variables 1000.
+
+The handler and its models come from the installed pyscada-file, with the
+Django settings of DJANGO_SETTINGS_MODULE if set, or minimal settings. The
+model instances are not saved, no database is used. The servers need the
+optional paramiko and pyftpdlib packages.
+"""
+
+from __future__ import unicode_literals
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import warnings
+from datetime import datetime, timezone
+from time import perf_counter
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROTOCOLS = ("local", "ssh", "sftp", "ftp")
+READ_MODES = {"whole": 0, "appended": 1}
+SENSORS = 1000
+COMMANDS = ("awk", "line", "range", "end")
+# bytes at the end of the file read by the range commands
+RANGE_LENGTH = 16384
+# the optimizations off by default in the models, measured unless --set off
+OPTIMIZATIONS = {
+    "batch_read": True,
+    "native_extraction": True,
+    "ftp_conditional_download": True,
+    "skip_unchanged_file": True,
+    "connection_pooling": True,
+    "ranged_download": True,
+}
+USERNAME = "bench"
+PASSWORD = "bench"
+UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+# spawns of the servers, not counted as spawns of the handler
+_server_popen = subprocess.Popen
+
+
+def parse_size(text):
+    """
+    return the number of bytes of a size like 512, 1K, 10M or 1G
+    """
+    text = text.strip().upper()
+    if text[-1:] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit in ("G", "M", "K"):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f"{size // UNITS[unit]}{unit}"
+    return str(size)
+
+
+def sensor_lines(first, count):
+    return "".join(f"s{i % SENSORS} {i}\n" for i in range(first, first + count))
+
+
+def write_file(file_path, size):
+    """
+    write a file of lines "s<sensor> <value>" of the size
+    """
+    block = sensor_lines(0, SENSORS)
+    with open(file_path, "w") as f:
+        written = 0
+        while written + len(block) <= size:
+            f.write(block)
+            written += len(block)
+        rest = block[: size - written]
+        f.write(rest[: rest.rfind("\n") + 1])
+
+
+def peak_rss():
+    """
+    return the peak resident memory of the process in kB, from its own
+    address space as ru_maxrss is kept across the exec of a spawned process
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def parse_setting(text):
+    """
+    return the (field, value) of a FileDevice field=value setting
+    """
+    field, separator, value = text.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"{text} is not field=value")
+    return field.strip(), value.strip()
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def add(self, count):
+        with self.lock:
+            self.value += count
+
+
+class Relay:
+    """
+    A localhost TCP relay to a server port counting the bytes in both
+    directions
+    """
+
+    def __init__(self, port, counter):
+        self.target = port
+        self.counter = counter
+        self.socket = socket.create_server(("127.0.0.1", 0))
+        self.port = self.socket.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                client, _ = self.socket.accept()
+            except OSError:
+                return
+            server = socket.create_connection(("127.0.0.1", self.target))
+            for source, target in ((client, server), (server, client)):
+                threading.Thread(
+                    target=self.pump, args=(source, target), daemon=True
+                ).start()
+
+    def pump(self, source, target):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                self.counter.add(len(data))
+                target.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for s in (source, target):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def start_ssh_server(counter, commands):
+    """
+    start a paramiko server running the exec requests in a shell and serving
+    sftp on the local files, return its port
+    """
+    import paramiko
+
+    host_key = paramiko.RSAKey.generate(2048)
+
+    class Server(paramiko.ServerInterface):
+        def get_allowed_auths(self, username):
+            return "password"
+
+        def check_auth_password(self, username, password):
+            if username == USERNAME and password == PASSWORD:
+                return paramiko.AUTH_SUCCESSFUL
+            return paramiko.AUTH_FAILED
+
+        def check_channel_request(self, kind, chanid):
+            if kind == "session":
+                return paramiko.OPEN_SUCCEEDED
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_exec_request(self, channel, command):
+            commands.add(1)
+            threading.Thread(
+                target=run_command, args=(channel, command), daemon=True
+            ).start()
+            return True
+
+    def run_command(channel, command):
+        try:
+            process = _server_popen(
+                command.decode(),
+                shell=True,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            stdout, stderr = process.communicate()
+            channel.sendall(stdout)
+            channel.sendall_stderr(stderr)
+            channel.send_exit_status(process.returncode)
+        except OSError:
+            # the client stopped waiting
+            pass
+        except Exception:
+            logger.warning("ssh command failed", exc_info=True)
+        finally:
+            channel.close()
+
+    class Handle(paramiko.SFTPHandle):
+        def stat(self):
+            try:
+                return paramiko.SFTPAttributes.from_stat(
+                    os.fstat(self.readfile.fileno())
+                )
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+    class SFTPServer(paramiko.SFTPServerInterface):
+        def stat(self, path):
+            try:
+                return paramiko.SFTPAttributes.from_stat(os.stat(path))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        lstat = stat
+
+        def open(self, path, flags, attr):
+            try:
+                fd = os.open(path, flags, 0o644)
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            if flags & os.O_WRONLY:
+                mode = "ab" if flags & os.O_APPEND else "wb"
+            elif flags & os.O_RDWR:
+                mode = "a+b" if flags & os.O_APPEND else "r+b"
+            else:
+                mode = "rb"
+            handle = Handle(flags)
+            handle.filename = path
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+        def remove(self, path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        def posix_rename(self, oldpath, newpath):
+            try:
+                os.replace(oldpath, newpath)
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        rename = posix_rename
+
+    def serve(connection):
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(host_key)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, SFTPServer)
+        try:
+            transport.start_server(server=Server())
+        except Exception:
+            transport.close()
+
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def accept():
+        while True:
+            connection, _ = listener.accept()
+            threading.Thread(target=serve, args=(connection,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return Relay(listener.getsockname()[1], counter).port
+
+
+def start_ftp_server(counter):
+    """
+    start a pyftpdlib server on the local files, return its port
+    """
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import DTPHandler, FTPHandler
+    from pyftpdlib.servers import FTPServer
+
+    logging.getLogger("pyftpdlib").setLevel(logging.WARNING)
+
+    class CountingDTPHandler(DTPHandler):
+        def close(self):
+            if not self._closed:
+                counter.add(self.tot_bytes_sent + self.tot_bytes_received)
+            super().close()
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_user(USERNAME, PASSWORD, "/", perm="elradfmwMT")
+
+    class Handler(FTPHandler):
+        dtp_handler = CountingDTPHandler
+
+    Handler.authorizer = authorizer
+    server = FTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return Relay(server.address[1], counter).port
+
+
+def setup_django():
+    if not os.environ.get("DJANGO_SETTINGS_MODULE"):
+        from django.conf import settings
+
+        settings.configure(
+            INSTALLED_APPS=[
+                "django.contrib.admin",
+                "django.contrib.auth",
+                "django.contrib.contenttypes",
+                "django.contrib.messages",
+                "django.contrib.sessions",
+                "pyscada",
+                "pyscada.file",
+            ],
+            DATABASES={
+                "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+            },
+            USE_TZ=True,
+        )
+    import django
+
+    django.setup()
+
+
+def build_handler(case, work_dir, ports):
+    """
+    return the handler of an unsaved device reading the case file, and its
+    variables
+    """
+    from pyscada.models import Device, DeviceProtocol, Variable
+    from pyscada.file import PROTOCOL_ID
+    from pyscada.file.models import FileDevice, FileVariable
+    from pyscada.file.devices import GenericDevice
+    from pyscada.file.devices.aio import AsyncDevice
+
+    device = Device(
+        id=1, short_name="benchmark", protocol=DeviceProtocol(id=PROTOCOL_ID)
+    )
+    filedevice = FileDevice(
+        file_device=device,
+        file_path=case["file_path"],
+        read_mode=READ_MODES[case["read_mode"]],
+        local_temporary_file_copy_path=os.path.join(work_dir, "copy"),
+    )
+    if case["protocol"] in ("ssh", "sftp"):
+        filedevice.protocol = 1
+        filedevice.ssh_transfer_mode = 1 if case["protocol"] == "sftp" else 0
+        filedevice.port = ports["ssh"]
+    elif case["protocol"] == "ftp":
+        filedevice.protocol = 2
+        filedevice.port = ports["ftp"]
+    else:
+        filedevice.protocol = 0
+    if filedevice.protocol != 0:
+        filedevice.host = "127.0.0.1"
+        filedevice.username = USERNAME
+        filedevice.password = PASSWORD
+    for field, value in {**OPTIMIZATIONS, **case["settings"]}.items():
+        setattr(filedevice, field, FileDevice._meta.get_field(field).to_python(value))
+
+    variables = {}
+    for pk in range(1, case["variables"] + 1):
+        variable = Variable(id=pk, name=f"s{pk - 1}", device=device)
+        sensor = (pk - 1) % SENSORS
+        filevariable = FileVariable(file_variable=variable, program="awk")
+        if case["commands"] == "line":
+            filevariable.program = "sed"
+            filevariable.command = f"{sensor + 1}!d"
+        elif case["commands"] == "end":
+            filevariable.command = f'$1=="s{sensor}"{{v=$2}} END{{print v}}'
+        else:
+            filevariable.command = f'$1=="s{sensor}"{{print $2; exit}}'
+        if case["commands"] == "range":
+            filevariable.range_start = -RANGE_LENGTH
+        variables[pk] = variable
+
+    handler_class = AsyncDevice if filedevice.concurrent_reads else GenericDevice
+    return handler_class(device, variables), variables
+
+
+def run_case(case, work_dir, ports, connection):
+    """
+    measure the cycles of a case in a spawned process, send the results
+    through the connection
+    """
+    try:
+        setup_django()
+        # the host key of the stand-in server is unknown
+        warnings.filterwarnings("ignore", module="paramiko")
+        handler, variables = build_handler(case, work_dir, ports)
+        spawns = Counter()
+
+        class CountingPopen(subprocess.Popen):
+            def __init__(self, *args, **kwargs):
+                spawns.add(1)
+                super().__init__(*args, **kwargs)
+
+        subprocess.Popen = CountingPopen
+
+        appended = sensor_lines(0, case["append_lines"]).encode()
+        latencies = []
+        failed = 0
+        spawned = 0
+        for cycle in range(case["warmup"] + case["cycles"]):
+            if cycle == case["warmup"]:
+                # the servers count from the first measured cycle
+                connection.send({"warm": True})
+                connection.recv()
+            if appended:
+                with open(case["file_path"], "ab") as f:
+                    f.write(appended)
+            spawns.value = 0
+            start = perf_counter()
+            values = []
+            if handler.before_read():
+                for variable in variables.values():
+                    values.append(handler.read_data_and_time(variable)[0])
+            handler.after_read()
+            latency = perf_counter() - start
+            if cycle < case["warmup"]:
+                continue
+            latencies.append(latency)
+            spawned += spawns.value
+            failed += len(variables) - len(
+                [value for value in values if value is not None]
+            )
+        connection.send(
+            {
+                "latencies": latencies,
+                "spawns": spawned,
+                "failed_reads": failed,
+                "peak_rss_kb": peak_rss(),
+            }
+        )
+    except Exception as e:
+        logger.warning("case failed", exc_info=True)
+        connection.send({"error": repr(e)})
+    finally:
+        connection.close()
+
+
+def measure(case, work_dir, ports, counters, context):
+    """
+    run a case in a new process, return its result
+    """
+    size = os.path.getsize(case["file_path"])
+    connection, child_connection = context.Pipe()
+    process = context.Process(
+        target=run_case, args=(case, work_dir, ports, child_connection)
+    )
+    process.start()
+    child_connection.close()
+    transferred = commands = 0
+    try:
+        measured = connection.recv()
+        if "warm" in measured:
+            transferred = counters["bytes"].value
+            commands = counters["commands"].value
+            connection.send(True)
+            measured = connection.recv()
+    except EOFError:
+        measured = {"error": f"exit code {process.exitcode}"}
+    process.join()
+    # the next cases read the file of the size
+    os.truncate(case["file_path"], size)
+
+    result = {
+        key: case[key]
+        for key in (
+            "protocol",
+            "read_mode",
+            "commands",
+            "size",
+            "file_size",
+            "variables",
+            "settings",
+        )
+    }
+    result["cycles"] = case["cycles"]
+    if "error" in measured:
+        result["error"] = measured["error"]
+        return result
+    cycles = len(measured["latencies"])
+    latencies = sorted(measured["latencies"])
+    median = statistics.median(latencies)
+    if case["read_mode"] == "appended":
+        bytes_read = len(sensor_lines(0, case["append_lines"]))
+    else:
+        bytes_read = case["file_size"]
+    if case["commands"] == "range":
+        bytes_read = min(bytes_read, RANGE_LENGTH)
+    result.update(
+        {
+            "latency": {
+                "mean": statistics.fmean(latencies),
+                "median": median,
+                "p95": latencies[min(cycles - 1, int(0.95 * cycles))],
+                "min": latencies[0],
+                "max": latencies[-1],
+            },
+            "bytes_per_second": bytes_read / median if median > 0 else None,
+            "variables_per_second": case["variables"] / median if median > 0 else None,
+            "spawns_per_cycle": measured["spawns"] / cycles,
+            "remote_commands_per_cycle": (counters["commands"].value - commands)
+            / cycles,
+            "bytes_transferred_per_cycle": (counters["bytes"].value - transferred)
+            / cycles,
+            "failed_reads": measured["failed_reads"],
+            "peak_rss_kb": measured["peak_rss_kb"],
+        }
+    )
+    return result
+
+
+def case_key(result):
+    return (
+        result["protocol"],
+        result["read_mode"],
+        result.get("commands", "end"),
+        result["size"],
+        result["variables"],
+        json.dumps(result.get("settings", {}), sort_keys=True),
+    )
+
+
+def compare(base_path, new_path):
+    """
+    print the ratio of the median latency of the cases of two results files
+    """
+    with open(base_path) as f:
+        base = {case_key(r): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(
+        f"{'protocol':<9}{'mode':<10}{'commands':<9}{'size':>6}{'vars':>6}"
+        f"{'base (s)':>12}{'new (s)':>12}{'ratio':>8}"
+    )
+    for result in new:
+        previous = base.get(case_key(result))
+        if previous is None or "latency" not in previous or "latency" not in result:
+            continue
+        old_median = previous["latency"]["median"]
+        new_median = result["latency"]["median"]
+        print(
+            f"{result['protocol']:<9}{result['read_mode']:<10}"
+            f"{result.get('commands', 'end'):<9}"
+            f"{result['size']:>6}{result['variables']:>6}"
+            f"{old_median:>12.4f}{new_median:>12.4f}"
+            f"{new_median / old_median if old_median else float('nan'):>8.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--protocols", default=",".join(PROTOCOLS))
+    parser.add_argument("--read-modes", default=",".join(READ_MODES))
+    parser.add_argument("--commands", default=",".join(COMMANDS))
+    parser.add_argument("--sizes", default="1K,1M")
+    parser.add_argument("--variables", default="1,100")
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument(
+        "--append-lines",
+        type=int,
+        default=100,
+        help="lines appended to the file before each cycle",
+    )
+    parser.add_argument(
+        "--set",
+        dest="settings",
+        type=parse_setting,
+        action="append",
+        default=[],
+        metavar="FIELD=VALUE",
+        help="FileDevice field of all the cases, like batch_read=0",
+    )
+    parser.add_argument("--work-dir", help="directory of the synthetic files")
+    parser.add_argument("-o", "--output", help="results file, stdout by default")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASE", "NEW"),
+        help="compare two results files instead of running the cases",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    protocols = [p.strip() for p in args.protocols.split(",") if p.strip()]
+    for protocol in protocols:
+        if protocol not in PROTOCOLS:
+            parser.error(f"unknown protocol {protocol}")
+    read_modes = [m.strip() for m in args.read_modes.split(",") if m.strip()]
+    for read_mode in read_modes:
+        if read_mode not in READ_MODES:
+            parser.error(f"unknown read mode {read_mode}")
+    commands = [c.strip() for c in args.commands.split(",") if c.strip()]
+    for kind in commands:
+        if kind not in COMMANDS:
+            parser.error(f"unknown commands {kind}")
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    counts = [int(n) for n in args.variables.split(",") if n.strip()]
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="pyscada_file_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    counters = {"bytes": Counter(), "commands": Counter()}
+    ports = {}
+    if "ssh" in protocols or "sftp" in protocols:
+        ports["ssh"] = start_ssh_server(counters["bytes"], counters["commands"])
+    if "ftp" in protocols:
+        ports["ftp"] = start_ftp_server(counters["bytes"])
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    try:
+        for size in sizes:
+            file_path = os.path.join(work_dir, f"data_{format_size(size)}.txt")
+            if not os.path.isfile(file_path):
+                write_file(file_path, size)
+            for protocol in protocols:
+                for read_mode in read_modes:
+                    for kind in commands:
+                        for count in counts:
+                            case = {
+                                "protocol": protocol,
+                                "read_mode": read_mode,
+                                "commands": kind,
+                                "size": format_size(size),
+                                "file_path": file_path,
+                                "file_size": os.path.getsize(file_path),
+                                "variables": count,
+                                "settings": dict(args.settings),
+                                "cycles": args.cycles,
+                                "warmup": args.warmup,
+                                "append_lines": args.append_lines,
+                            }
+                            result = measure(case, work_dir, ports, counters, context)
+                            results.append(result)
+                            print(
+                                f"{protocol} {read_mode} {kind} {format_size(size)} "
+                                f"{count} : "
+                                + (
+                                    result["error"]
+                                    if "error" in result
+                                    else f"{result['latency']['median']:.4f} s"
+                                ),
+                                file=sys.stderr,
+                            )
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    import pyscada.file
+
+    output = {
+        "meta": {
+            "version": pyscada.file.__version__,
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
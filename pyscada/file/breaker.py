@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Circuit breakers of the remote servers of the file devices of a process.
+
+A server is a (protocol, host, port) tuple, so that an ssh server down does
+not stop the ftp devices of the same host.
+
+After FAILURES connections in a row to a server failed on network errors,
+the breaker of the server opens : the devices using the server stop
+connecting to it for a delay, instead of each one waiting for its timeout at
+every cycle, and the other devices of the process keep their polling
+interval.
+
+The delay starts at BASE_DELAY and doubles at each failed probe up to
+MAX_DELAY, with a random part so that the processes do not probe the server
+together. At the end of the delay a single connection probes the server
+(half open) while the other devices keep waiting, the breaker closing again
+when it succeeds.
+
+The errors of a server which answered, like a failed authentication, close the
+breaker as a successful connection does.
+"""
+
+from __future__ import unicode_literals
+
+import random
+from threading import Lock
+from time import time
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# failed connections in a row opening the breaker
+FAILURES = 2
+# delays without connection to an unreachable server, in seconds
+BASE_DELAY = 5.0
+MAX_DELAY = 300.0
+# part of the delay drawn at random
+JITTER = 0.5
+
+
+class HostUnreachable(ConnectionError):
+    """
+    The breaker of the server is open, the connection was not tried
+    """
+
+
+class Breaker:
+    __slots__ = ("failures", "delay", "open_until", "probing")
+
+    def __init__(self):
+        self.failures = 0
+        self.delay = 0.0
+        self.open_until = 0.0
+        self.probing = False
+
+
+def server_name(server):
+    protocol, host, port = server
+    return f"{protocol} server {host}:{port}"
+
+
+class Breakers:
+    def __init__(self):
+        self.lock = Lock()
+        self.servers = {}
+
+    def allow(self, server):
+        """
+        tell if a connection to the server may be tried, the first one after
+        the delay being the probe of the server
+        """
+        with self.lock:
+            breaker = self.servers.get(server)
+            if breaker is None or breaker.failures < FAILURES:
+                return True
+            if breaker.probing or time() < breaker.open_until:
+                return False
+            breaker.probing = True
+            return True
+
+    def success(self, server):
+        with self.lock:
+            breaker = self.servers.pop(server, None)
+        if breaker is not None and breaker.failures >= FAILURES:
+            logger.info(f"{server_name(server)} is reachable again")
+
+    def failure(self, server):
+        with self.lock:
+            breaker = self.servers.setdefault(server, Breaker())
+            breaker.failures += 1
+            breaker.probing = False
+            if breaker.failures < FAILURES:
+                return
+            breaker.delay = min(MAX_DELAY, max(BASE_DELAY, breaker.delay * 2))
+            delay = breaker.delay * (1 - JITTER * random.random())
+            breaker.open_until = time() + delay
+        logger.warning(
+            f"{server_name(server)} is unreachable, next connection in {delay:.0f} s"
+        )
+
+    def retry_in(self, server):
+        """
+        return the seconds before the next connection to the server
+        """
+        with self.lock:
+            breaker = self.servers.get(server)
+            if breaker is None:
+                return 0.0
+            return max(0.0, breaker.open_until - time())
+
+    def connect(self, server, factory, unreachable):
+        """
+        return a connection created by factory() unless the breaker of the
+        server is open, the errors for which unreachable(error) is true being
+        the failures of the server
+        """
+        if not self.allow(server):
+            raise HostUnreachable(
+                f"{server_name(server)} is unreachable, next connection in "
+                f"{self.retry_in(server):.0f} s"
+            )
+        try:
+            connection = factory()
+        except BaseException as e:
+            if unreachable(e):
+                self.failure(server)
+            else:
+                self.success(server)
+            raise
+        self.success(server)
+        return connection
+
+
+breakers = Breakers()
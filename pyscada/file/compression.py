@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Reading of gzip and zstd compressed files.
+
+Local files ending with .gz or .zst are read decompressed : in process for the
+native extraction, through a gzip -dc or zstd -dc pipe for the programs.
+The compressed variants of remote files are decompressed as a stream while
+being downloaded.
+
+zstd support in process needs the optional zstandard package.
+"""
+
+from __future__ import unicode_literals
+
+import gzip
+import io
+import shutil
+import subprocess
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+
+    zstd_ok = True
+except ImportError:
+    zstd_ok = False
+
+GZIP = 1
+ZSTD = 2
+SUFFIXES = {GZIP: ".gz", ZSTD: ".zst"}
+DECOMPRESSORS = {GZIP: ["gzip", "-dc"], ZSTD: ["zstd", "-dc"]}
+
+
+def compression_of(file_path):
+    """
+    return the compression of the file from its suffix, None if not
+    compressed
+    """
+    for compression, suffix in SUFFIXES.items():
+        if file_path.endswith(suffix):
+            return compression
+    return None
+
+
+def decompressed(source, compression):
+    """
+    return a binary stream of the decompressed content of the source stream
+    """
+    if compression == GZIP:
+        return gzip.GzipFile(fileobj=source, mode="rb")
+    if compression == ZSTD:
+        if not zstd_ok:
+            raise ImportError("the zstandard package is needed to read zstd files")
+        return zstandard.ZstdDecompressor().stream_reader(source, closefd=False)
+    raise ValueError(f"unknown compression {compression}")
+
+
+def open_text(file_path):
+    """
+    open a local file for reading as text, decompressed if compressed
+    """
+    compression = compression_of(file_path)
+    if compression is None:
+        return open(file_path, "r")
+    source = open(file_path, "rb")
+    try:
+        return io.TextIOWrapper(
+            io.BufferedReader(_Owner(decompressed(source, compression), source))
+        )
+    except:
+        source.close()
+        raise
+
+
+def read_bytes(file_path):
+    """
+    return the decompressed content of a local compressed file
+    """
+    with open(file_path, "rb") as source:
+        with decompressed(source, compression_of(file_path)) as stream:
+            return stream.read()
+
+
+def decompress_stream(source, target, compression):
+    """
+    copy the decompressed content of the source stream to the target stream
+    """
+    with decompressed(source, compression) as stream:
+        shutil.copyfileobj(stream, target)
+
+
+def run_on_file(command, file_path, timeout):
+    """
+    run the command on the file, given as argument or through a
+    decompression pipe if compressed, return the CompletedProcess with text
+    output
+    """
+    compression = compression_of(file_path)
+    if compression is None:
+        return subprocess.run(
+            command + [file_path], capture_output=True, text=True, timeout=timeout
+        )
+    decompressor = subprocess.Popen(
+        DECOMPRESSORS[compression] + [file_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        return subprocess.run(
+            command,
+            stdin=decompressor.stdout,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+    finally:
+        decompressor.stdout.close()
+        if decompressor.poll() is None:
+            # the command stopped reading before the end
+            decompressor.kill()
+        decompressor.wait()
+
+
+class _Owner(io.RawIOBase):
+    """
+    A decompressed stream closing its source file with it
+    """
+
+    def __init__(self, stream, source):
+        self.stream = stream
+        self.source = source
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+            self.source.close()
+        super().close()
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 from time import time, sleep
 from pyscada.device import GenericDevice
 from .devices import GenericDevice as GenericHandlerDevice
+from .devices.aio import AsyncDevice
 
 import sys
 
@@ -27,6 +28,8 @@ class Device(GenericDevice):
     def __init__(self, device):
         self.driver_ok = driver_ok
         self.handler_class = GenericHandlerDevice
+        if hasattr(device, "filedevice") and device.filedevice.concurrent_reads:
+            self.handler_class = AsyncDevice
         super().__init__(device)
 
         for var in self.device.variable_set.filter(active=1):
@@ -38,3 +41,32 @@ class Device(GenericDevice):
             logger.warning(f"Cannot import ftputil")
         if not self.driver_handler_ok:
             logger.warning(f"Cannot import handler for {self.device}")
+
+    def write_pending(self):
+        """
+        apply the writes queued by the handler during the cycle
+        """
+        if getattr(self, "_h", None) is not None:
+            self._h.write_pending()
+
+    def file_watcher(self):
+        """
+        return the watcher of the file of the handler, None if not watched
+        """
+        if getattr(self, "_h", None) is not None:
+            return self._h.file_watcher()
+        return None
+
+    def file_changed(self):
+        """
+        tell the handler that its file changed
+        """
+        if getattr(self, "_h", None) is not None:
+            self._h.file_changed()
+
+    def cleanup(self):
+        """
+        release the connections and file watchers of the handler
+        """
+        if getattr(self, "_h", None) is not None:
+            self._h.cleanup()
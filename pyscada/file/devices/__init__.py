@@ -2,22 +2,51 @@
 
 from __future__ import unicode_literals
 from .. import PROTOCOL_ID
-from pyscada.models import DeviceProtocol
+from pyscada.models import DeviceProtocol, DeviceReadTask, DictionaryItem
 from pyscada.device import GenericHandlerDevice
+from .awk import AwkBatch
+from .extractors import compile_extractor, extract, extract_records, is_substitution
+from .writer import replace_file, stream_native, stream_pipeline, patch_in_place
+from .lineindex import LineIndex
+from .plan import ReadPlan, VariablePlan, LOCAL_COPY, REMOTE_COMMANDS, variable_range
+from .structured import PROGRAMS as STRUCTURED_PROGRAMS
+from .structured import Samples, compile_query, format_value, parse, parse_column
+from ..inotify import FileWatcher
+from ..compression import (
+    SUFFIXES,
+    compression_of,
+    decompress_stream,
+    open_text,
+    read_bytes,
+    run_on_file,
+)
+from ..pool import pool, KEEPALIVE
+from ..breaker import breakers, HostUnreachable
+from ..metrics import metrics, timed
+from ..schedule import AdaptiveInterval
 
 import subprocess
 import traceback
+import shlex
+import shutil
 import os
 from time import time
 from pathlib import Path
 import socket
 
+from django.db.models import Q
+
 import logging
 
 logger = logging.getLogger(__name__)
 
 driver_ok = True
 
+# separates the outputs of the commands of a batched read over ssh
+SSH_SEPARATOR = "\035"
+# size of the blocks read from the remote file for the fixed line variables
+HEAD_BLOCK_SIZE = 4096
+
 try:
     import ftputil
 except ImportError:
@@ -31,6 +60,85 @@ except ImportError:
     driver_ok = False
 
 
+def range_bounds(start, length, size):
+    """
+    return the first and end offsets of the bytes to read for a range of a
+    file of the size, starting one byte before the range to know if its
+    first line is complete
+    """
+    offset = start if start >= 0 else max(0, size + start)
+    end = size if length == 0 else min(size, offset + length)
+    return max(0, offset - 1), max(end, offset)
+
+
+def ssh_host_unreachable(e):
+    """
+    tell if the ssh connection error means that the host cannot be reached,
+    the host answered for the authentication and host key errors
+    """
+    return isinstance(
+        e, (OSError, EOFError, paramiko.ssh_exception.SSHException)
+    ) and not isinstance(
+        e,
+        (
+            paramiko.ssh_exception.AuthenticationException,
+            paramiko.ssh_exception.BadHostKeyException,
+        ),
+    )
+
+
+def ftp_host_unreachable(e):
+    """
+    tell if the ftp connection error means that the host cannot be reached,
+    the host answered for the 4xx and 5xx replies
+    """
+    return isinstance(e, ftputil.error.FTPOSError) and not isinstance(
+        e, (ftputil.error.TemporaryError, ftputil.error.PermanentError)
+    )
+
+
+def read_task_pending(device_id):
+    """
+    tell if a DeviceReadTask asks for a read of the device
+    """
+    return DeviceReadTask.objects.filter(
+        Q(device_id=device_id)
+        | Q(variable__device_id=device_id)
+        | Q(variable_property__variable__device_id=device_id),
+        done=False,
+        failed=False,
+        start__lte=time(),
+    ).exists()
+
+
+def write_task_failed(task):
+    """
+    mark as failed a write task reported done before its queued write failed
+    """
+    if task is None:
+        return
+    try:
+        task.done = False
+        task.failed = True
+        task.finished = time()
+        task.save(update_fields=["done", "failed", "finished"])
+    except:
+        logger.warning(traceback.format_exc())
+
+
+def trim_range(data, first, size):
+    """
+    return as text the complete lines of the data read from the first offset
+    of a file of the size
+    """
+    if first + len(data) < size:
+        data = data[: data.rfind(b"\n") + 1]
+    if first > 0:
+        start = data.find(b"\n")
+        data = data[start + 1 :] if start >= 0 else b""
+    return data.decode()
+
+
 class GenericDevice(GenericHandlerDevice):
     def __init__(self, pyscada_device, variables):
         super().__init__(pyscada_device, variables)
@@ -39,14 +147,173 @@ class GenericDevice(GenericHandlerDevice):
         self.last_value = None
         self.my_session_factory = None
         self.t = None
+        self._awk_batch = None
+        self._batch_values = None
+        # size and modification time of the last FTP or SFTP download
+        self._remote_signature = None
+        self._remote_signature_time = None
+        self._download_time = None
+        self._file_unchanged = False
+        self._sftp = None
+        # the remote file is not downloaded, only the ranges the variables need
+        self._ranged_download = False
+        # position in the file of the lines already read in append mode
+        self._tail_offset = 0
+        self._tail_inode = None
+        self._line_index = None
+        # read on change mode
+        self._watcher = None
+        self._file_changed = False
+        self._read_once = False
+        # values kept while the file is unchanged
+        self._fingerprint = None
+        self._unchanged_cycles = 0
+        # key of the pooled connection in use
+        self._pool_key = None
+        # writes waiting for the next connection
+        self._pending_writes = []
+        # column names of the table, appended rows come without the header
+        self._table_names = None
+        # time of the last sample returned for each variable
+        self._last_sample_time = {}
+        # next poll of the file with adaptive polling
+        self._schedule = None
+        # modification time of the remote file seen in the cycle
+        self._remote_mtime = None
+        filedevice = pyscada_device.filedevice
+        self._metrics = metrics.device(
+            pyscada_device.pk,
+            str(pyscada_device),
+            filedevice.host if filedevice.protocol else "localhost",
+        )
 
+        self._plan = None
+        self.build_plan()
+
+    def build_plan(self):
+        """
+        resolve the configuration of the device and its variables, and
+        compile the commands once, when the variables are loaded
+        """
+        self._plan = ReadPlan(self._device, self._variables)
+        for pk in self._plan.readable:
+            plan = self._plan.variables[pk]
+            compile_extractor(plan.program, plan.command)
+            compile_query(plan.program, plan.command)
+        filedevice = self._device.filedevice
+        if not filedevice.adaptive_polling:
+            self._schedule = None
+        elif self._schedule is None:
+            self._schedule = AdaptiveInterval(
+                filedevice.min_polling_interval, filedevice.max_polling_interval
+            )
+        else:
+            self._schedule.set_bounds(
+                filedevice.min_polling_interval, filedevice.max_polling_interval
+            )
+
+    def variable_plan(self, variable):
+        """
+        return the plan of the variable, built for a variable not loaded
+        with the device
+        """
+        plan = self._plan.variables.get(variable.pk)
+        if plan is None:
+            plan = VariablePlan(variable, self._plan.file_path)
+        return plan
+
+    def update_plan(self):
+        """
+        build the plan again if the variables were loaded after the handler
+        was created
+        """
+        if self._variables.keys() != self._plan.keys:
+            self.build_plan()
+
+    def read_data_all(self, variables_dict, *args, **kwargs):
+        """
+        read the variables and return their recorded data, one element per
+        sample for the variables returning the new samples of the file.
+
+        With adaptive polling, the variables are read only when the next poll
+        of the file is due, writes are waiting or a read task asks for it.
+        """
+        if (
+            self._schedule is not None
+            and not self._pending_writes
+            and not self._schedule.due(time())
+            and not read_task_pending(self._device.pk)
+        ):
+            self._metrics.count("skipped_polls")
+            return []
+        output = []
+        if self.before_read():
+            for item in variables_dict.values():
+                value, read_time = self.read_data_and_time(item)
+                if isinstance(value, list):
+                    samples = zip(value, read_time)
+                else:
+                    samples = [(value, read_time)]
+                for value, read_time in samples:
+                    if value is not None and item.update_value(value, read_time):
+                        output.append(item.create_recorded_data_element())
+        self.after_read()
+        return output
+
+    def after_read(self):
+        if self._schedule is not None:
+            if self.inst is None:
+                self._schedule.retry(time())
+            else:
+                self._schedule.update(self.file_mtime(), time())
+        return super().after_read()
+
+    def file_mtime(self):
+        """
+        return the modification time of the file, the one of the remote file
+        seen by the download, the fingerprint or the remote commands of the
+        cycle, None if unknown. Over ssh the file is only stated again if
+        none of them saw it.
+        """
+        try:
+            if self._plan.protocol == 0:
+                return os.stat(self._plan.file_path).st_mtime
+            elif self._remote_mtime is not None:
+                return self._remote_mtime
+            elif self.uses_local_copy() or self.inst is None:
+                return None
+            else:  # file over ssh
+                stdin, stdout, stderr = self.inst.exec_command(
+                    f"stat -L -c %Y {shlex.quote(self._plan.file_path)}",
+                    timeout=self._plan.timeout,
+                )
+                self._metrics.count("ssh_commands")
+                mtime = stdout.read().decode().strip()
+                return float(mtime) if stderr.read() == b"" and mtime else None
+        except (
+            OSError,
+            ValueError,
+            paramiko.ssh_exception.SSHException,
+            socket.timeout,
+        ):
+            return None
+
+    @timed("connect")
     def connect(self):
         """
         establish a connection to the Instrument
         """
         super().connect()
+        if self.inst is not None:
+            self.disconnect()
+        self.update_plan()
 
         connected = True
+        # values read are only valid for the current cycle
+        # or as long as the file is unchanged
+        previous_values = self._batch_values
+        self._batch_values = None
+        self._remote_mtime = None
 
         if self._device.filedevice.protocol == 0:
             # To handle the disconnect function
@@ -57,6 +324,9 @@ class GenericDevice(GenericHandlerDevice):
             self.inst = Inst()
 
             file_path = self._device.filedevice.file_path
+            watcher = self.file_watcher()
+            if watcher is not None:
+                self._file_changed = watcher.changed() or self._file_changed
             try:
                 open(file_path, "r")
             except FileNotFoundError:
@@ -76,12 +346,50 @@ class GenericDevice(GenericHandlerDevice):
             username = self._device.filedevice.username
             password = self._device.filedevice.password
             timeout = self._device.filedevice.timeout
+            compress = self._device.filedevice.ssh_compression
+
+            def open_ssh():
+                return breakers.connect(
+                    ("ssh", hostname, port), new_ssh, ssh_host_unreachable
+                )
+
+            def new_ssh():
+                client = paramiko.SSHClient()
+                client.load_system_host_keys()
+                client.set_missing_host_key_policy(paramiko.WarningPolicy())
+                try:
+                    client.connect(
+                        hostname,
+                        port,
+                        username,
+                        password,
+                        timeout=timeout,
+                        allow_agent=False,
+                        compress=compress,
+                    )
+                except:
+                    client.close()
+                    raise
+                client.get_transport().set_keepalive(KEEPALIVE)
+                self._metrics.connection_opened()
+                return client
 
-            self.inst = paramiko.SSHClient()
-            self.inst.load_system_host_keys()
-            self.inst.set_missing_host_key_policy(paramiko.WarningPolicy())
             try:
-                self.inst.connect(hostname, port, username, password, timeout=timeout, allow_agent=False)
+                if self._device.filedevice.connection_pooling:
+                    key = (1, hostname, port, username, password, compress)
+                    self.inst = pool.acquire(
+                        key,
+                        open_ssh,
+                        lambda client: client.get_transport().is_active(),
+                        shared=True,
+                    )
+                    self._pool_key = key
+                else:
+                    self.inst = open_ssh()
+            except HostUnreachable as e:
+                self._not_accessible_reason = str(e)
+                self._metrics.count("skipped_connects")
+                connected = False
             except (
                 socket.gaierror,
                 paramiko.ssh_exception.SSHException,
@@ -96,6 +404,9 @@ class GenericDevice(GenericHandlerDevice):
                 self.inst = None
                 connected = False
 
+            if connected and self.uses_sftp():
+                connected = self.download()
+
         elif self._device.filedevice.protocol == 2:
             self.my_session_factory = ftputil.session.session_factory(
                 port=self._device.filedevice.port,
@@ -103,93 +414,837 @@ class GenericDevice(GenericHandlerDevice):
                 debug_level=0,
             )
 
-            try:
-                self.inst = ftputil.FTPHost(
+            def open_ftp():
+                return breakers.connect(
+                    ("ftp", self._device.filedevice.host, self._device.filedevice.port),
+                    new_ftp,
+                    ftp_host_unreachable,
+                )
+
+            def new_ftp():
+                host = ftputil.FTPHost(
                     self._device.filedevice.host,
                     self._device.filedevice.username,
                     self._device.filedevice.password,
                     session_factory=self.my_session_factory,
                 )
+                self._metrics.connection_opened()
+                return host
+
+            def check_ftp(host):
+                host.keep_alive()
+                # the files may have changed since the last use
+                host.stat_cache.clear()
+                return True
+
+            try:
+                if self._device.filedevice.connection_pooling:
+                    key = (
+                        2,
+                        self._device.filedevice.host,
+                        self._device.filedevice.port,
+                        self._device.filedevice.username,
+                        self._device.filedevice.password,
+                        self._device.filedevice.ftp_passive_mode,
+                    )
+                    self.inst = pool.acquire(key, open_ftp, check_ftp)
+                    self._pool_key = key
+                else:
+                    self.inst = open_ftp()
+            except HostUnreachable as e:
+                self._not_accessible_reason = str(e)
+                self._metrics.count("skipped_connects")
+                connected = False
             except ftputil.error.FTPOSError:
                 pass
             except Exception as e:
                 self._not_accessible_reason = f"connect failed : {e}"
                 # logger.warning(traceback.format_exc())
 
-            connected = self.download()
+            if connected:
+                connected = self.download()
 
+        if connected and self._pending_writes:
+            self.flush_writes()
+            # an in place patch may keep the modification time
+            self._file_unchanged = False
+            self._fingerprint = None
+
+        if connected and self._device.filedevice.read_mode == 0:
+            self.reuse_unchanged_values(previous_values)
+
+        if not connected:
+            self._metrics.count("connect_failures")
         self.accessibility()
         return connected
 
+    def reuse_unchanged_values(self, previous_values):
+        """
+        keep the values of the last cycle if the file did not change, unless
+        a full read is forced every force_read_cycles cycles
+        """
+        unchanged = self._file_unchanged and self.uses_local_copy()
+        if self._device.filedevice.skip_unchanged_file:
+            fingerprint = self.file_fingerprint()
+            unchanged = unchanged or (
+                fingerprint is not None and fingerprint == self._fingerprint
+            )
+            self._fingerprint = fingerprint
+        force_read_cycles = self._device.filedevice.force_read_cycles
+        if (
+            unchanged
+            and previous_values is not None
+            and (force_read_cycles == 0 or self._unchanged_cycles < force_read_cycles)
+        ):
+            # the failed reads are tried again, the samples were already returned
+            self._batch_values = {
+                pk: Samples() if isinstance(value, Samples) else value
+                for pk, value in previous_values.items()
+                if value is not None
+            }
+            self._unchanged_cycles += 1
+            self._metrics.count("cache_hits")
+        else:
+            self._unchanged_cycles = 0
+
+    def file_fingerprint(self):
+        """
+        return the modification time, size and inode of the file read, or of
+        the remote file for ssh, None if unknown
+        """
+        try:
+            if self._device.filedevice.protocol == 0 or self.uses_local_copy():
+                stat = os.stat(self.local_file_path())
+            elif self.inst is not None:  # file over ssh
+                stdin, stdout, stderr = self.inst.exec_command(
+                    f"stat -L -c '%Y %y %s %i' {shlex.quote(self._device.filedevice.file_path)}",
+                    timeout=self._device.filedevice.timeout,
+                )
+                self._metrics.count("ssh_commands")
+                fingerprint = stdout.read().decode().strip()
+                if stderr.read() != b"" or not fingerprint:
+                    return None
+                self._remote_mtime = float(fingerprint.split()[0])
+                return fingerprint
+            else:
+                return None
+        except (
+            OSError,
+            ValueError,
+            paramiko.ssh_exception.SSHException,
+            socket.timeout,
+        ):
+            return None
+        if self._ranged_download:
+            # the local copy is not updated
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def file_watcher(self):
+        """
+        return the watcher of the local file read on change, None if the
+        file is not watched. The process waits on the same watcher.
+        """
+        filedevice = self._device.filedevice
+        if filedevice.protocol != 0 or not filedevice.read_on_change:
+            return None
+        if self._watcher is None:
+            self._watcher = FileWatcher.create(filedevice.file_path)
+        return self._watcher
+
+    def file_changed(self):
+        """
+        the process saw a change of the file on the watcher
+        """
+        self._file_changed = True
+
+    def cleanup(self):
+        """
+        release the connection and the file watcher, when the process stops
+        or creates the devices again
+        """
+        self.disconnect()
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+
     def disconnect(self):
+        if self._sftp is not None:
+            try:
+                self._sftp.close()
+            except:
+                pass
+            self._sftp = None
         if self.inst is not None:
-            self.inst.close()
+            if self._pool_key is not None:
+                # keep the connection open for the next cycle and the other
+                # devices on the same host
+                pool.release(
+                    self._pool_key,
+                    self.inst,
+                    shared=self._device.filedevice.protocol == 1,
+                )
+                self._pool_key = None
+            else:
+                self.inst.close()
             self.inst = None
             return True
         return False
 
+    @timed("extract")
     def read_data(self, variable_instance):
         """
         read values from the device
         """
         value = None
-        timeout = self._device.filedevice.timeout
-        if (
+        plan = self._plan
+        timeout = plan.timeout
+        if variable_instance.pk in plan.writable:  # this is a writeable var
+            return None
+        if variable_instance.pk not in plan.variables and (
             "$value$" in variable_instance.filevariable.command
-        ):  # this is a writeable var
+        ):
             return None
-        if self._device.filedevice.protocol == 0:  # local file
-            file_path = self._device.filedevice.file_path
-            value = self.read_from_local_file(file_path, variable_instance, timeout)
-        elif self._device.filedevice.protocol == 1:  # file over ssh
+        if self.unchanged_since_last_read():
+            self._metrics.count("cache_hits")
+            return None
+        if self._device.filedevice.read_mode == 1:  # appended lines only
+            return self.read_appended(variable_instance, timeout)
+        if plan.source != REMOTE_COMMANDS:  # local file, or downloaded over ftp or sftp
+            value = self.read_from_file(plan.local_path, variable_instance, timeout)
+        else:  # file over ssh
             if self.inst is None:
                 logger.warning(
                     f"Device {self._device} not connected. Cannot read file over ssh."
                 )
                 return None
-            file_path = self._device.filedevice.file_path
-            program = variable_instance.filevariable.program
-            command = variable_instance.filevariable.command
-            try:
-                stdin, stdout, stderr = self.inst.exec_command(
-                    str(program) + " " + str(repr(command)) + " " + str(file_path),
-                    timeout=timeout,
+            if self._batch_values is None:
+                self._batch_values = self.read_all_over_ssh(variable_instance, timeout)
+            if variable_instance.pk in self._batch_values:
+                return self._batch_values[variable_instance.pk]
+            value = self.read_over_ssh(variable_instance, timeout)
+            self._batch_values[variable_instance.pk] = value
+
+        return value
+
+    def read_all_over_ssh(self, variable_instance, timeout):
+        """
+        read the variables of the device evaluated locally, the ranges and
+        structured formats, then the others with a single remote command if
+        batch_read is set,
+        return a dict of variable pk: value
+        """
+        variables = self.readable_variables(variable_instance)
+        values = self.read_ranges(variables, timeout)
+        variables = {pk: v for pk, v in variables.items() if pk not in values}
+        values.update(self.read_structured(self.structured_variables(variables)))
+        if self._device.filedevice.batch_read:
+            values.update(
+                self.read_batch_over_ssh(self.command_variables(variables), timeout)
+            )
+        return values
+
+    def read_over_ssh(self, variable_instance, timeout):
+        """
+        read a variable with its own remote command
+        """
+        if variable_instance.filevariable.program in STRUCTURED_PROGRAMS:
+            return self.read_structured({variable_instance.pk: variable_instance})[
+                variable_instance.pk
+            ]
+        value = None
+        plan = self.variable_plan(variable_instance)
+        program = plan.program
+        command = plan.command
+        remote_command = plan.remote_command
+        stat = self._schedule is not None and self._remote_mtime is None
+        if stat:
+            # the modification time for the adaptive polling, in the same
+            # round trip
+            remote_command += (
+                f"; printf '\\035'; "
+                f"stat -L -c %Y {shlex.quote(self._plan.file_path)} 2>/dev/null"
+            )
+        try:
+            stdin, stdout, stderr = self.inst.exec_command(
+                remote_command,
+                timeout=timeout,
+            )
+        except (
+            socket.gaierror,
+            paramiko.ssh_exception.SSHException,
+            OSError,
+            socket.timeout,
+            paramiko.ssh_exception.AuthenticationException,
+            paramiko.ssh_exception.NoValidConnectionsError,
+            ConnectionResetError,
+        ) as e:
+            # logger.warning(f'Error while reading to file {self._device} : {e}')
+            pass
+        else:
+            self._metrics.count("ssh_commands")
+            output = stdout.read()
+            self._metrics.count("bytes_transferred", len(output))
+            value = output.decode()
+            if stat and SSH_SEPARATOR in value:
+                value, mtime = value.rsplit(SSH_SEPARATOR, 1)
+                try:
+                    self._remote_mtime = float(mtime)
+                except ValueError:
+                    pass
+            value = value[:-1] if value.endswith("\n") else value
+            err = stderr.read().decode()
+            err = err[:-1] if err.endswith("\n") else err
+            if err != "":
+                logger.warning(f"{program} cmd ({command}) return an error : {err}")
+                value = None
+        return value
+
+    def command_variables(self, variables):
+        """
+        return the variables of the dict evaluated by a command on the whole
+        file
+        """
+        return {
+            pk: var
+            for pk, var in variables.items()
+            if self.range_of(var) is None
+            and var.filevariable.program not in STRUCTURED_PROGRAMS
+        }
+
+    def read_data_and_time(self, variable_instance):
+        """
+        read the value of the variable with the time of the read, or the
+        lists of the values and timestamps of its new samples
+        """
+        value = self.read_data(variable_instance)
+        if isinstance(value, Samples):
+            if not value:
+                return None, self.time()
+            return [v for t, v in value], [t for t, v in value]
+        return value, self.time()
+
+    def unchanged_since_last_read(self):
+        """
+        in read on change mode, tell if the file did not change since the
+        last cycle, the events are only consumed by the first read of a cycle
+        """
+        if self._watcher is None or self._batch_values is not None:
+            return False
+        if self._file_changed or not self._read_once:
+            self._file_changed = False
+            self._read_once = True
+            return False
+        return True
+
+    def read_batch_over_ssh(self, variables, timeout, merged_only=False):
+        """
+        read the variables of the dict with a single remote command, the
+        merged awk program first then the other commands unless merged_only,
+        each output followed by a separator on stdout and stderr, and the
+        modification time of the file for the adaptive polling,
+        return a dict of variable pk: value
+        """
+        file_path = shlex.quote(self._device.filedevice.file_path)
+        batch = self.get_awk_batch(variables)
+        segments = []
+        scripts = []
+        if batch.program is not None:
+            segments.append(batch)
+            scripts.append(f"awk {shlex.quote(batch.program)} {file_path}")
+        for pk, var in variables.items():
+            if pk in batch.keys or merged_only:
+                continue
+            segments.append(pk)
+            scripts.append(
+                f"{shlex.quote(var.filevariable.program)} "
+                f"{shlex.quote(var.filevariable.command)} {file_path}"
+            )
+        if not scripts:
+            return {}
+        if self._schedule is not None and self._remote_mtime is None:
+            segments.append(None)
+            scripts.append(f"stat -L -c %Y {file_path}")
+        script = "; ".join(
+            f"{s}; printf '\\035'; printf '\\035' >&2" for s in scripts
+        )
+        try:
+            stdin, stdout, stderr = self.inst.exec_command(script, timeout=timeout)
+            self._metrics.count("ssh_commands")
+            output = stdout.read()
+            self._metrics.count("bytes_transferred", len(output))
+            outputs = output.decode().split(SSH_SEPARATOR)
+            errors = stderr.read().decode().split(SSH_SEPARATOR)
+        except (
+            socket.gaierror,
+            paramiko.ssh_exception.SSHException,
+            OSError,
+            socket.timeout,
+            paramiko.ssh_exception.AuthenticationException,
+            paramiko.ssh_exception.NoValidConnectionsError,
+            ConnectionResetError,
+        ) as e:
+            logger.warning(f"Batched read over ssh of {self._device} failed : {e}")
+            return {}
+        if len(outputs) <= len(segments) or len(errors) <= len(segments):
+            logger.warning(f"Batched read over ssh of {self._device} was interrupted")
+            return {}
+
+        values = {}
+        for segment, output, err in zip(segments, outputs, errors):
+            err = err[:-1] if err.endswith("\n") else err
+            if segment is None:
+                try:
+                    self._remote_mtime = float(output) if err == "" else None
+                except ValueError:
+                    pass
+            elif segment is batch:
+                if err != "":
+                    logger.warning(
+                        f"batched awk cmd for {self._device} failed, reading variables one by one : {err}"
+                    )
+                    continue
+                for pk, value in batch.split_output(output).items():
+                    values[pk] = value[:-1] if value.endswith("\n") else value
+            elif err != "":
+                var = variables[segment]
+                logger.warning(
+                    f"{var.filevariable.program} cmd ({var.filevariable.command}) return an error : {err}"
                 )
-            except (
-                socket.gaierror,
-                paramiko.ssh_exception.SSHException,
-                OSError,
-                socket.timeout,
-                paramiko.ssh_exception.AuthenticationException,
-                paramiko.ssh_exception.NoValidConnectionsError,
-                ConnectionResetError,
-            ) as e:
-                # logger.warning(f'Error while reading to file {self._device} : {e}')
-                pass
+                values[segment] = None
             else:
-                value = stdout.read().decode()
-                value = value[:-1] if value.endswith("\n") else value
-                err = stderr.read().decode()
-                err = err[:-1] if err.endswith("\n") else err
-                if err != "":
-                    logger.warning(f"{program} cmd ({command}) return an error : {err}")
-                    value = None
-        elif self._device.filedevice.protocol == 2:  # file downloaded over ftp
-            file_path = self._device.filedevice.local_temporary_file_copy_path
-            value = self.read_from_local_file(file_path, variable_instance, timeout)
+                values[segment] = output[:-1] if output.endswith("\n") else output
+        return values
 
+    def read_from_file(self, file_path, variable_instance, timeout):
+        """
+        read a variable from a local file, using the values read in batch
+        during this cycle if possible
+        """
+        if self._batch_values is None:
+            self._batch_values = self.read_batch_from_local_file(
+                file_path, variable_instance, timeout
+            )
+        if variable_instance.pk in self._batch_values:
+            return self._batch_values[variable_instance.pk]
+        value = self.read_from_local_file(file_path, variable_instance, timeout)
+        self._batch_values[variable_instance.pk] = value
         return value
 
+    def readable_variables(self, variable_instance=None):
+        """
+        return a dict of the variables of the device which are not writeable
+        """
+        readable = self._plan.readable
+        if variable_instance is None or variable_instance.pk in self._plan.variables:
+            return readable
+        if "$value$" in variable_instance.filevariable.command:
+            return readable
+        return {**readable, variable_instance.pk: variable_instance}
+
+    def get_awk_batch(self, variables):
+        """
+        return the awk program reading all the awk variables of the dict,
+        rebuilt only when the commands change
+        """
+        commands = tuple(
+            (pk, var.filevariable.command)
+            for pk, var in variables.items()
+            if var.filevariable.program == "awk"
+        )
+        if self._awk_batch is None or self._awk_batch[0] != commands:
+            self._awk_batch = (commands, AwkBatch(commands))
+        return self._awk_batch[1]
+
+    def read_batch_from_local_file(self, file_path, variable_instance, timeout):
+        """
+        read all the variables of the device in a single pass over the file
+        when their command can be evaluated in process, then with a single
+        awk process for the other awk variables,
+        return a dict of variable pk: value
+        """
+        variables = self.readable_variables(variable_instance)
+        values = self.read_ranges(variables, timeout)
+        variables = {pk: v for pk, v in variables.items() if pk not in values}
+        if self._ranged_download:
+            values.update(self.read_head(variables, timeout))
+            return values
+        structured = self.structured_variables(variables)
+        if structured:
+            values.update(self.read_structured(structured, file_path=file_path))
+            variables = {pk: v for pk, v in variables.items() if pk not in values}
+        if self._device.filedevice.native_extraction:
+            values.update(self.read_native_from_local_file(file_path, variables))
+        if self._device.filedevice.batch_read:
+            remaining = {pk: v for pk, v in variables.items() if pk not in values}
+            values.update(self.read_awk_batch(file_path, remaining, timeout))
+        return values
+
+    def structured_variables(self, variables):
+        """
+        return the variables of the dict reading a structured format
+        """
+        plans = self._plan.variables
+        return {
+            pk: var
+            for pk, var in variables.items()
+            if (
+                plans[pk].structured
+                if pk in plans
+                else var.filevariable.program in STRUCTURED_PROGRAMS
+            )
+        }
+
+    def read_structured(self, variables, text=None, file_path=None):
+        """
+        look up the variables reading a structured format in the text, or in
+        the file, or in the remote file for ssh commands, parsed once for each
+        format,
+        return a dict of variable pk: value
+        """
+        if not variables:
+            return {}
+        try:
+            if text is None and file_path is None:
+                text = self.read_whole_file()
+            elif text is None:
+                with open_text(file_path) as f:
+                    text = f.read()
+        except:
+            logger.warning(traceback.format_exc())
+            return {pk: None for pk in variables}
+        parsed = {}
+        values = {}
+        timestamp_column = self._device.filedevice.timestamp_column
+        for pk, var in variables.items():
+            program = var.filevariable.program
+            query = compile_query(program, var.filevariable.command)
+            if program not in parsed:
+                try:
+                    parsed[program] = parse(program, text)
+                    if program == "table":
+                        if parsed[program].names is None:
+                            parsed[program].names = self._table_names
+                        self._table_names = parsed[program].names
+                except Exception as e:
+                    logger.warning(f"Parsing {program} file of {self._device} failed : {e}")
+                    parsed[program] = None
+            if query is None or parsed[program] is None:
+                values[pk] = None
+            elif timestamp_column and getattr(query, "every_row", False):
+                values[pk] = self.new_samples(
+                    var,
+                    query.samples(
+                        parsed[program],
+                        parse_column(timestamp_column),
+                        self._device.filedevice.timestamp_format,
+                    ),
+                )
+            else:
+                values[pk] = format_value(query.lookup(parsed[program]))
+        return values
+
+    def new_samples(self, variable, samples):
+        """
+        return the samples of the variable more recent than the ones already
+        returned, or stored before the process started
+        """
+        pk = variable.pk
+        if pk not in self._last_sample_time:
+            self._last_sample_time[pk] = self.last_stored_time(variable)
+        last = self._last_sample_time[pk]
+        if last is not None:
+            samples = Samples(sample for sample in samples if sample[0] > last)
+        if samples:
+            self._last_sample_time[pk] = max(t for t, v in samples)
+        return Samples((t, format_value(v)) for t, v in samples)
+
+    def last_stored_time(self, variable):
+        """
+        return the timestamp of the last value stored for the variable, None
+        if there is none
+        """
+        try:
+            if variable.query_prev_value(time_min=0):
+                return variable.timestamp_old
+        except:
+            logger.warning(traceback.format_exc())
+        return None
+
+    def range_of(self, variable):
+        """
+        return the (start, length) byte range of the variable, None if it
+        reads the whole file
+        """
+        plan = self._plan.variables.get(variable.pk)
+        return variable_range(variable) if plan is None else plan.range
+
+    def read_ranges(self, variables, timeout):
+        """
+        evaluate the variables having a byte range on the complete lines of
+        their range, each range being read once,
+        return a dict of variable pk: value
+        """
+        groups = {}
+        for pk, var in variables.items():
+            key = self.range_of(var)
+            if key is not None:
+                groups.setdefault(key, {})[pk] = var
+        values = {}
+        for (start, length), group in groups.items():
+            try:
+                text = self.read_range(start, length)
+            except:
+                logger.warning(traceback.format_exc())
+                values.update({pk: None for pk in group})
+                continue
+            values.update(self.read_batch_from_text(text, group, timeout))
+        return values
+
+    @timed("transfer")
+    def read_range(self, start, length):
+        """
+        return as text the complete lines of a byte range of the file
+        """
+        if self.uses_remote_commands():
+            data, first, size = self.fetch_range_over_ssh(start, length)
+        elif self._ranged_download:
+            data, first, size = self.fetch_remote_range(start, length)
+        else:
+            data, first, size = self.fetch_local_range(start, length)
+        return trim_range(data, first, size)
+
+    def fetch_local_range(self, start, length):
+        """
+        return the bytes of the range of the local file or copy, with their
+        offset and the size of the file
+        """
+        file_path = self.local_file_path()
+        if compression_of(file_path) is not None:
+            data = read_bytes(file_path)
+            first, end = range_bounds(start, length, len(data))
+            return data[first:end], first, len(data)
+        with open(file_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            first, end = range_bounds(start, length, size)
+            f.seek(first)
+            return f.read(end - first), first, size
+
+    def fetch_remote_range(self, start, length):
+        """
+        return the bytes of the range of the remote ftp or sftp file, with
+        their offset and the size of the file
+        """
+        remote_path = self.remote_file_path()
+        if self.uses_sftp():
+            size = self._sftp.stat(remote_path).st_size
+        else:
+            size = self.inst.path.getsize(remote_path)
+        first, end = range_bounds(start, length, size)
+        with self.open_remote(first, end) as f:
+            data = f.read(end - first)
+        self._metrics.count("bytes_transferred", len(data))
+        return data, first, size
+
+    def fetch_range_over_ssh(self, start, length):
+        """
+        return the bytes of the range of the remote file read with tail and
+        head, with their offset and the size of the file
+        """
+        file_path = shlex.quote(self._device.filedevice.file_path)
+        if start >= 0:
+            first = str(max(0, start - 1))
+        else:
+            first = f"$(( $size + {start} > 1 ? $size + {start} - 1 : 0 ))"
+        script = (
+            f"size=$(stat -L -c %s {file_path}) && echo $size && "
+            f"tail -c +$(( {first} + 1 )) {file_path}"
+        )
+        if length:
+            script += f" | head -c {length + 1}"
+        stdin, stdout, stderr = self.inst.exec_command(
+            script, timeout=self._device.filedevice.timeout
+        )
+        self._metrics.count("ssh_commands")
+        data = stdout.read()
+        self._metrics.count("bytes_transferred", len(data))
+        err = stderr.read().decode()
+        if err != "":
+            raise OSError(f"Reading a range of {self._device} failed : {err}")
+        header, _, data = data.partition(b"\n")
+        size = int(header.decode())
+        first, end = range_bounds(start, length, size)
+        return data[: end - first], first, size
+
+    def read_head(self, variables, timeout):
+        """
+        evaluate the fixed line variables on the first lines of the remote
+        file, read by blocks until the last line they need is complete,
+        return a dict of variable pk: value
+        """
+        lines = 0
+        for var in variables.values():
+            extractor = compile_extractor(
+                var.filevariable.program, var.filevariable.command
+            )
+            lines = max([lines] + list(extractor.lines))
+        blocks = []
+        count = 0
+        try:
+            with self.open_remote(0) as f:
+                # one more line to know that the last needed is not the last
+                while count <= lines:
+                    block = f.read(HEAD_BLOCK_SIZE)
+                    if not block:
+                        break
+                    blocks.append(block)
+                    count += block.count(b"\n")
+        except:
+            logger.warning(traceback.format_exc())
+            return {pk: None for pk in variables}
+        data = b"".join(blocks)
+        if count > lines:
+            data = data[: data.rfind(b"\n") + 1]
+        return self.read_batch_from_text(data.decode(), variables, timeout)
+
+    def open_remote(self, offset, end=None):
+        """
+        open the remote ftp or sftp file at the offset for reading, closing
+        it before the end of the file aborts the transfer
+        """
+        remote_path = self.remote_file_path()
+        if self.uses_sftp():
+            f = self._sftp.open(remote_path, "rb")
+            f.seek(offset)
+            if end is not None:
+                f.prefetch(end)
+            return f
+        return self.inst.open(remote_path, "rb", rest=offset)
+
+    def ranged_download_possible(self):
+        """
+        tell if the variables only need byte ranges or the first lines of the
+        remote file, which is then not downloaded
+        """
+        if (
+            not self._device.filedevice.ranged_download
+            or self._device.filedevice.read_mode != 0
+            or self._device.filedevice.compressed_download
+            or not self._device.filedevice.native_extraction
+            or self._pending_writes
+        ):
+            return False
+        variables = self.readable_variables()
+        if not variables:
+            return False
+        for var in variables.values():
+            if self.range_of(var) is not None:
+                continue
+            extractor = compile_extractor(
+                var.filevariable.program, var.filevariable.command
+            )
+            if extractor is None or extractor.lines is None:
+                return False
+        return True
+
+    def read_native_from_local_file(self, file_path, variables, text=None):
+        """
+        evaluate in process the commands of the variables which can be,
+        on the file or on the text if given,
+        return a dict of variable pk: value
+        """
+        extractors = {}
+        for pk, var in variables.items():
+            extractor = compile_extractor(
+                var.filevariable.program, var.filevariable.command
+            )
+            if extractor is not None:
+                extractors[pk] = extractor
+        if not extractors:
+            return {}
+        try:
+            if text is not None:
+                return extract(text.splitlines(True), extractors)
+            if compression_of(file_path) is not None:
+                with open_text(file_path) as f:
+                    return extract(f, extractors)
+            # the variables addressing fixed lines use the line index
+            indexed = {pk: e for pk, e in extractors.items() if e.lines is not None}
+            values = {}
+            if indexed:
+                lines = set().union(*(e.lines for e in indexed.values()))
+                values = extract_records(
+                    self.get_line_index(file_path).records(lines), indexed
+                )
+            if len(indexed) < len(extractors):
+                with open(file_path, "r") as f:
+                    values.update(
+                        extract(
+                            f,
+                            {
+                                pk: e
+                                for pk, e in extractors.items()
+                                if pk not in indexed
+                            },
+                        )
+                    )
+            return values
+        except:
+            logger.warning(traceback.format_exc())
+        return {}
+
+    def get_line_index(self, file_path):
+        """
+        return the line index of the file, kept between the cycles
+        """
+        if self._line_index is None or self._line_index.file_path != file_path:
+            self._line_index = LineIndex(file_path)
+        return self._line_index
+
+    def read_awk_batch(self, file_path, variables, timeout, text=None):
+        """
+        read the awk variables of the dict with a single awk process,
+        on the file or on the text if given,
+        return a dict of variable pk: value
+        """
+        batch = self.get_awk_batch(variables)
+        if batch.program is None:
+            return {}
+        try:
+            if text is None:
+                self.count_processes(file_path)
+                result = run_on_file(["awk", batch.program], file_path, timeout)
+            else:
+                self.count_processes()
+                result = subprocess.run(
+                    ["awk", batch.program],
+                    input=text,
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout,
+                )
+        except:
+            logger.warning(traceback.format_exc())
+            return {}
+        if result.returncode > 0 or result.stderr != "":
+            logger.warning(
+                f"batched awk cmd for {self._device} failed, reading variables one by one : {result.stderr}"
+            )
+            return {}
+        return batch.split_output(result.stdout)
+
     def read_from_local_file(self, file_path, variable_instance, timeout):
+        if variable_instance.filevariable.program in STRUCTURED_PROGRAMS:
+            return self.read_structured(
+                {variable_instance.pk: variable_instance}, file_path=file_path
+            )[variable_instance.pk]
         value = None
         try:
             open(file_path, "r")
-            program = variable_instance.filevariable.program
-            command = variable_instance.filevariable.command
-            cmd = [program, command, file_path]
-            result = subprocess.run(
-                cmd, capture_output=True, text=True, timeout=timeout
-            )
+            plan = self.variable_plan(variable_instance)
+            program, command = plan.argv
+            self.count_processes(file_path)
+            result = run_on_file(list(plan.argv), file_path, timeout)
             value = result.stdout
 
             if result.stderr != "":
@@ -202,140 +1257,444 @@ class GenericDevice(GenericHandlerDevice):
             logger.warning(traceback.format_exc())
         return value
 
-    def write_data(self, variable_id, value, task):
+    def count_processes(self, file_path=None):
+        """
+        count the processes spawned to run a command, on the file if given
+        which adds a decompression process when compressed
+        """
+        if file_path is not None and compression_of(file_path) is not None:
+            self._metrics.count("subprocesses", 2)
+        else:
+            self._metrics.count("subprocesses")
+
+    def read_appended(self, variable_instance, timeout):
         """
-        write values to the device
+        read a variable from the lines appended to the file since the last
+        cycle, all the variables being evaluated on them at the first read
         """
+        if self._batch_values is None:
+            self._batch_values = {}
+            text = None
+            try:
+                if self._device.filedevice.protocol == 0:  # local file
+                    text = self.read_appended_local(self._device.filedevice.file_path)
+                elif self.uses_local_copy():  # file downloaded over ftp or sftp
+                    text = self.read_appended_local(self.local_file_path())
+                elif self._device.filedevice.protocol == 1:  # file over ssh
+                    text = self.read_appended_over_ssh(timeout)
+            except:
+                logger.warning(traceback.format_exc())
+            if text:
+                self._batch_values = self.read_batch_from_text(
+                    text, self.readable_variables(variable_instance), timeout
+                )
+        return self._batch_values.get(variable_instance.pk)
+
+    def consume_appended(self, data):
+        """
+        keep the complete lines of the appended data, the last incomplete line
+        will be read at the next cycle
+        """
+        end = data.rfind(b"\n") + 1
+        self._tail_offset += end
+        return data[:end].decode()
+
+    def read_appended_local(self, file_path):
+        """
+        return the lines appended to a local file since the last cycle,
+        starting again from the beginning if the file was rotated or truncated
+        """
+        stat = os.stat(file_path)
+        if compression_of(file_path) is not None:
+            # the offset is in the decompressed content
+            data = read_bytes(file_path)
+            if stat.st_ino != self._tail_inode or len(data) < self._tail_offset:
+                self._tail_inode = stat.st_ino
+                self._tail_offset = 0
+            return self.consume_appended(data[self._tail_offset :])
+        if stat.st_ino != self._tail_inode or stat.st_size < self._tail_offset:
+            self._tail_inode = stat.st_ino
+            self._tail_offset = 0
+        if stat.st_size == self._tail_offset:
+            return ""
+        with open(file_path, "rb") as f:
+            f.seek(self._tail_offset)
+            data = f.read(stat.st_size - self._tail_offset)
+        return self.consume_appended(data)
+
+    @timed("transfer")
+    def read_appended_over_ssh(self, timeout):
+        """
+        return the lines appended to the remote file since the last cycle,
+        using tail -c, starting again from the beginning if the file was
+        rotated or truncated
+        """
+        if self.inst is None:
+            logger.warning(
+                f"Device {self._device} not connected. Cannot read file over ssh."
+            )
+            return None
+        file_path = shlex.quote(self._device.filedevice.file_path)
+        offset = self._tail_offset
         try:
-            if self.connect():
-                for var in self._variables:
-                    var = self._variables[var]
-                    if variable_id == var.id:
-                        timeout = self._device.filedevice.timeout
-
-                        if var.dictionary is not None and len(
-                            var.dictionary.dictionaryitem_set.filter(value=int(value))
-                        ):
-                            value = (
-                                var.dictionary.dictionaryitem_set.filter(
-                                    value=int(value)
-                                )
-                                .first()
-                                .label
-                            )
+            stdin, stdout, stderr = self.inst.exec_command(
+                f"stat -L -c '%i %s' {file_path} && tail -c +{offset + 1} {file_path}",
+                timeout=timeout,
+            )
+            self._metrics.count("ssh_commands")
+            data = stdout.read()
+            self._metrics.count("bytes_transferred", len(data))
+            err = stderr.read().decode()
+        except (
+            socket.gaierror,
+            paramiko.ssh_exception.SSHException,
+            OSError,
+            socket.timeout,
+            paramiko.ssh_exception.AuthenticationException,
+            paramiko.ssh_exception.NoValidConnectionsError,
+            ConnectionResetError,
+        ) as e:
+            logger.warning(f"Reading appended lines of {self._device} failed : {e}")
+            return None
+        if err != "":
+            logger.warning(f"Reading appended lines of {self._device} failed : {err}")
+            return None
+        header, _, data = data.partition(b"\n")
+        inode, size = header.decode().split()
+        size = int(size)
+        if inode != self._tail_inode or size < offset:
+            self._tail_inode = inode
+            self._tail_offset = 0
+            if offset > 0:
+                return self.read_appended_over_ssh(timeout)
+        # ignore what was appended between stat and tail
+        return self.consume_appended(data[: size - offset])
 
-                        file_path = None
-                        if self._device.filedevice.protocol == 0:  # local file
-                            file_path = self._device.filedevice.file_path
-                            self.write_to_local_file(self, file_path, var, timeout)
-
-                        elif self._device.filedevice.protocol == 1:  # file over ssh
-                            if self.inst is None:
-                                logger.warning(
-                                    f"Device {self._device} not connected. Cannot write file over ssh."
-                                )
-                                return None
-                            file_path = self._device.filedevice.file_path
-                            program = var.filevariable.program
-                            command = var.filevariable.command.replace(
-                                "$value$", str(value)
-                            )
-                            try:
-                                stdin, stdout, stderr = self.inst.exec_command(
-                                    str(program)
-                                    + " "
-                                    + str(repr(command))
-                                    + " "
-                                    + str(file_path),
-                                    timeout=timeout,
-                                )
-                            except (
-                                socket.gaierror,
-                                paramiko.ssh_exception.SSHException,
-                                OSError,
-                                socket.timeout,
-                                paramiko.ssh_exception.AuthenticationException,
-                                paramiko.ssh_exception.NoValidConnectionsError,
-                                ConnectionResetError,
-                            ) as e:
-                                # logger.warning(f'Error while reading to file {self._device} : {e}')
-                                pass
-                            else:
-                                read_value = stdout.read().decode()
-                                err = stderr.read().decode()
-                                if err != "":
-                                    logger.warning(
-                                        f"{program} cmd ({command}) return an error : {err}"
-                                    )
-                                    value = None
-                                else:
-                                    try:
-                                        self.inst.exec_command(
-                                            "echo "
-                                            + str(repr(read_value))
-                                            + " > "
-                                            + str(file_path),
-                                            timeout=timeout,
-                                        )
-                                    except (
-                                        socket.gaierror,
-                                        paramiko.ssh_exception.SSHException,
-                                        OSError,
-                                        socket.timeout,
-                                        paramiko.ssh_exception.AuthenticationException,
-                                        paramiko.ssh_exception.NoValidConnectionsError,
-                                        ConnectionResetError,
-                                    ) as e:
-                                        # logger.warning(f'Error while reading to file {self._device} : {e}')
-                                        pass
-                        elif (
-                            self._device.filedevice.protocol == 2
-                        ):  # file downloaded over ftp
-                            file_path = (
-                                self._device.filedevice.local_temporary_file_copy_path
-                            )
-                            self.write_to_local_file(self, file_path, var, timeout)
+    def read_batch_from_text(self, text, variables, timeout):
+        """
+        evaluate the commands of the variables on a text, in process when
+        possible, with a single awk process for the other awk variables and
+        one process for each remaining variable,
+        return a dict of variable pk: value, None for the variables which
+        returned nothing
+        """
+        values = self.read_structured(self.structured_variables(variables), text)
+        variables = {pk: v for pk, v in variables.items() if pk not in values}
+        if self._device.filedevice.native_extraction:
+            values.update(self.read_native_from_local_file(None, variables, text=text))
+        if self._device.filedevice.batch_read:
+            remaining = {pk: v for pk, v in variables.items() if pk not in values}
+            values.update(self.read_awk_batch(None, remaining, timeout, text=text))
+        for pk, var in variables.items():
+            if pk not in values:
+                values[pk] = self.read_from_text(text, var, timeout)
+        return {pk: value if value else None for pk, value in values.items()}
+
+    def read_from_text(self, text, variable_instance, timeout):
+        if variable_instance.filevariable.program in STRUCTURED_PROGRAMS:
+            return self.read_structured(
+                {variable_instance.pk: variable_instance}, text
+            )[variable_instance.pk]
+        value = None
+        program = variable_instance.filevariable.program
+        command = variable_instance.filevariable.command
+        try:
+            self.count_processes()
+            result = subprocess.run(
+                [program, command],
+                input=text,
+                capture_output=True,
+                text=True,
+                timeout=timeout,
+            )
+            value = result.stdout
 
-                        self._device.filedevice.protocol < 2 or self.upload()
-                        self.disconnect()
-                        return value
+            if result.stderr != "":
                 logger.warning(
-                    f"Variable {variable_id} not in variable list {self._variables} of device {self._device}"
+                    f"{program} cmd ({command}) return an error : {result.stderr}"
                 )
-            else:
+            if result.returncode > 0:
+                logger.warning(f"{program} cmd ({command}) failed")
+        except:
+            logger.warning(traceback.format_exc())
+        return value
+
+    def write_data(self, variable_id, value, task):
+        """
+        write values to the device.
+
+        With batch_writes, the writes are queued and applied together to one
+        copy of the file at the next connection, the read of the cycle or the
+        end of the cycle. The task of a write which fails then is marked as
+        failed. Otherwise they are applied at once.
+        """
+        try:
+            self.update_plan()
+            var = self._plan.by_id.get(variable_id)
+            if var is not None:
+                if var.dictionary_id is not None:
+                    # looked up at each write with a single query, the
+                    # dictionary being edited from the other processes
+                    label = (
+                        DictionaryItem.objects.filter(
+                            dictionary_id=var.dictionary_id, value=int(value)
+                        )
+                        .values_list("label", flat=True)
+                        .first()
+                    )
+                    if label is not None:
+                        value = label
+
+                if self._device.filedevice.batch_writes:
+                    self._pending_writes.append((var, value, task))
+                    return value
+                connected = self.connect()
+                written = connected and self.write_at_once(var, value, task)
+                self.disconnect()
+                if connected and written:
+                    return value
                 logger.warning(f"Write failed for {self._device}")
+                return None
+            logger.warning(
+                f"Variable {variable_id} not in variable list {self._variables} of device {self._device}"
+            )
         except:
             logger.warning(traceback.format_exc())
 
         self.disconnect()
         return None
 
-    def write_to_local_file(self, file_path, variable_instance, timeout):
-        value = None
+    def write_pending(self):
+        """
+        apply the queued writes not applied by a read of the cycle
+        """
+        if self._pending_writes:
+            self.connect()
+            self.disconnect()
+
+    @timed("write")
+    def write_at_once(self, var, value, task):
+        """
+        apply a single write to the file, return False if it failed
+        """
+        failed = self.apply_writes([(var, value, task)])
+        # an in place patch may keep the modification time
+        self._file_unchanged = False
+        self._fingerprint = None
+        return not failed
+
+    @timed("write")
+    def flush_writes(self):
+        """
+        apply the pending writes to one copy of the file and write it back
+        once, return False if one of them failed
+        """
+        writes, self._pending_writes = self._pending_writes, []
+        failed = self.apply_writes(writes)
+        for var, value, task in failed:
+            write_task_failed(task)
+        return not failed
+
+    def apply_writes(self, writes):
+        """
+        apply the (variable, value, task) writes, return the ones which failed
+        """
+        timeout = self._device.filedevice.timeout
+        if (
+            self._device.filedevice.protocol == 0
+            and compression_of(self.local_file_path()) is not None
+        ) or (self.uses_local_copy() and self._device.filedevice.compressed_download):
+            logger.warning(
+                f"Cannot write {len(writes)} values to the compressed file of {self._device}"
+            )
+            return writes
+        if self._device.filedevice.protocol == 0 or self.uses_local_copy():
+            try:
+                if self.write_local_file(
+                    [(var, value) for var, value, task in writes], timeout
+                ):
+                    if not self.uses_local_copy() or self.upload():
+                        return []
+                    return writes
+            except:
+                logger.warning(traceback.format_exc())
+            # apply the writes one by one to skip the failing ones
         try:
-            cmd = [
-                variable_instance.filevariable.program,
-                str(variable_instance.filevariable.command).replace(
-                    "$value$", str(value)
-                ),
-                file_path,
-            ]
-            result = subprocess.run(
-                cmd, capture_output=True, text=True, timeout=timeout
+            content = self.read_whole_file()
+        except:
+            logger.warning(
+                f"Cannot read {self._device} to write {len(writes)} values : {traceback.format_exc()}"
             )
-            value = result.stdout
+            return writes
+        failed = []
+        new_content = content
+        for var, value, task in writes:
+            result = self.apply_write(new_content, var, value, timeout)
+            if result is None:
+                failed.append((var, value, task))
+            else:
+                new_content = result
+        if new_content == content:
+            return failed
+        try:
+            if self.write_whole_file(new_content):
+                return failed
+        except:
+            logger.warning(traceback.format_exc())
+        return writes
 
-            if result.returncode == 0:
-                if (
-                    self._device.filedevice.protocol == 0
-                    or self._device.filedevice.protocol == 2
-                ):
-                    open(file_path, "w").write(str(value))
+    def write_local_file(self, writes, timeout):
+        """
+        apply the writes to the local file without loading it : patched in
+        place when only fixed-width fields change, else streamed through the
+        commands to a temporary file renamed over it.
+        Return False if a command failed, nothing being written.
+        """
+        file_path = self.local_file_path()
+        commands = [
+            (
+                var.filevariable.program,
+                var.filevariable.command.replace("$value$", str(value)),
+            )
+            for var, value in writes
+        ]
+        extractors = [None] * len(commands)
+        if self._device.filedevice.native_extraction:
+            extractors = [compile_extractor(*command) for command in commands]
+        if all(extractor is not None for extractor in extractors):
+            if all(is_substitution(e) for e in extractors) and patch_in_place(
+                file_path, extractors
+            ):
+                return True
+            stream_native(file_path, extractors)
+            return True
+        self._metrics.count("subprocesses", len(commands))
+        return stream_pipeline(file_path, commands, timeout)
+
+    def apply_write(self, content, variable_instance, value, timeout):
+        """
+        return the content transformed by the command of the variable with
+        $value$ replaced by the value, None if the command failed
+        """
+        program = variable_instance.filevariable.program
+        command = variable_instance.filevariable.command.replace("$value$", str(value))
+        if self._device.filedevice.native_extraction:
+            extractor = compile_extractor(program, command)
+            if extractor is not None:
+                return extract(content.splitlines(True), {0: extractor})[0]
+        try:
+            self.count_processes()
+            result = subprocess.run(
+                [program, command],
+                input=content.encode(),
+                capture_output=True,
+                timeout=timeout,
+            )
         except:
             logger.warning(traceback.format_exc())
-        return value
+            return None
+        if result.returncode > 0 or result.stderr != b"":
+            logger.warning(
+                f"{program} cmd ({command}) return an error : {result.stderr.decode()}"
+            )
+            return None
+        return result.stdout.decode()
+
+    @timed("transfer")
+    def read_whole_file(self):
+        """
+        return the content of the file, from the local copy for ftp and sftp
+        """
+        if self.uses_remote_commands():  # file over ssh
+            if self.inst is None:
+                raise ConnectionError(f"Device {self._device} not connected")
+            stdin, stdout, stderr = self.inst.exec_command(
+                f"cat {shlex.quote(self._device.filedevice.file_path)}",
+                timeout=self._device.filedevice.timeout,
+            )
+            self._metrics.count("ssh_commands")
+            content = stdout.read()
+            self._metrics.count("bytes_transferred", len(content))
+            err = stderr.read().decode()
+            if err != "":
+                raise OSError(err)
+            return content.decode()
+        with open(self.local_file_path(), "r", newline="") as f:
+            return f.read()
+
+    def write_whole_file(self, content):
+        """
+        replace the content of the file, atomically with a temporary file
+        renamed over it, then upload it for ftp and sftp
+        """
+        if self.uses_remote_commands():  # file over ssh
+            if self.inst is None:
+                logger.warning(
+                    f"Device {self._device} not connected. Cannot write file over ssh."
+                )
+                return False
+            file_path = shlex.quote(self._device.filedevice.file_path)
+            temporary_path = shlex.quote(
+                self._device.filedevice.file_path + ".pyscada.tmp"
+            )
+            stdin, stdout, stderr = self.inst.exec_command(
+                f"cat > {temporary_path} && mv {temporary_path} {file_path}",
+                timeout=self._device.filedevice.timeout,
+            )
+            self._metrics.count("ssh_commands")
+            data = content.encode()
+            stdin.write(data)
+            self._metrics.count("bytes_transferred", len(data))
+            stdin.channel.shutdown_write()
+            err = stderr.read().decode()
+            if err != "" or stdout.channel.recv_exit_status() != 0:
+                logger.warning(f"Writing file of {self._device} failed : {err}")
+                return False
+            return True
+        replace_file(self.local_file_path(), content)
+        if self.uses_local_copy():  # file downloaded over ftp or sftp
+            return self.upload()
+        return True
+
+    def remote_file_path(self):
+        """
+        return the path of the remote file to download, the compressed
+        variant if set
+        """
+        file_path = self._device.filedevice.file_path
+        if self.uses_local_copy() and self._device.filedevice.compressed_download:
+            file_path += SUFFIXES[self._device.filedevice.compressed_download]
+        return file_path
+
+    def uses_sftp(self):
+        """
+        tell if the file of the ssh device is downloaded over sftp
+        """
+        return self._plan.source == LOCAL_COPY and self._plan.protocol == 1
+
+    def uses_remote_commands(self):
+        """
+        tell if the commands run on the remote host over ssh
+        """
+        return self._plan.source == REMOTE_COMMANDS
 
+    def uses_local_copy(self):
+        """
+        tell if the commands are evaluated on a local copy of a remote file
+        """
+        return self._plan.source == LOCAL_COPY
+
+    def local_file_path(self):
+        """
+        return the path of the local file, or of the local copy for ftp and
+        sftp, in the temporary directory if not set
+        """
+        return self._plan.local_path
+
+    @timed("transfer")
     def download(self):
+        if self.uses_sftp():
+            return self.sftp_download()
         try:
             if self._device.filedevice.protocol < 2:
                 self._not_accessible_reason = "Wrong protocol"
@@ -348,13 +1707,47 @@ class GenericDevice(GenericHandlerDevice):
             if not hasattr(self.inst, "path"):
                 self._not_accessible_reason = "FTP instrument has not path functions"
                 return False
-            if self.inst.path.isfile(self._device.filedevice.file_path):
-                self.inst.download(
-                    self._device.filedevice.file_path,
-                    self._device.filedevice.local_temporary_file_copy_path,
+            self._file_unchanged = False
+            self._ranged_download = False
+            remote_path = self.remote_file_path()
+            if self.inst.path.isfile(remote_path):
+                # from the listing of the directory just read by isfile
+                self._remote_mtime = self.inst.path.getmtime(remote_path)
+                if self.ranged_download_possible():
+                    self._ranged_download = True
+                    return True
+                if (
+                    self._device.filedevice.read_mode == 1
+                    and not self._device.filedevice.compressed_download
+                    and self.ftp_append()
+                ):
+                    return True
+                if (
+                    self._device.filedevice.ftp_conditional_download
+                    and self.ftp_file_unchanged()
+                ):
+                    self._file_unchanged = True
+                    self._metrics.count("cache_hits")
+                    return True
+                download_time = time()
+                if self._device.filedevice.compressed_download:
+                    with self.inst.open(remote_path, "rb") as source:
+                        with open(self.local_file_path(), "wb") as target:
+                            decompress_stream(
+                                source,
+                                target,
+                                self._device.filedevice.compressed_download,
+                            )
+                else:
+                    self.inst.download(remote_path, self.local_file_path())
+                self._metrics.count(
+                    "bytes_transferred", self.inst.path.getsize(remote_path)
                 )
+                self._download_time = download_time
+                # the local copy was replaced, read it again from the beginning
+                self._tail_inode = None
             else:
-                self._not_accessible_reason = f"{self._device.filedevice.file_path} is not a file on FTP {self._device.filedevice.host}"
+                self._not_accessible_reason = f"{remote_path} is not a file on FTP {self._device.filedevice.host}"
                 return False
         except ftputil.error.FTPOSError as e:
             self._not_accessible_reason = f"FTP connection to {self._device} return {e}"
@@ -364,7 +1757,7 @@ class GenericDevice(GenericHandlerDevice):
             self._not_accessible_reason = f"download failed : {e}"
             return False
 
-        file_path = self._device.filedevice.local_temporary_file_copy_path
+        file_path = self.local_file_path()
         try:
             open(file_path, "r")
         except FileNotFoundError:
@@ -374,24 +1767,178 @@ class GenericDevice(GenericHandlerDevice):
             return False
         return True
 
+    def sftp_download(self):
+        """
+        copy the remote file to the local copy over sftp, with pipelined
+        reads, only when its size or modification time changed, or only the
+        appended bytes in append mode
+        """
+        remote_path = self.remote_file_path()
+        local_path = self.local_file_path()
+        self._file_unchanged = False
+        self._ranged_download = False
+        try:
+            if self.inst is None:
+                self._not_accessible_reason = (
+                    f"Device {self._device} not connected. Cannot download file."
+                )
+                return False
+            if self._sftp is None:
+                self._sftp = self.inst.open_sftp()
+                self._sftp.get_channel().settimeout(self._device.filedevice.timeout)
+            stat = self._sftp.stat(remote_path)
+            self._remote_mtime = stat.st_mtime
+            if self.ranged_download_possible():
+                self._ranged_download = True
+                return True
+            compression = self._device.filedevice.compressed_download
+            if (
+                self._device.filedevice.read_mode == 1
+                and not compression
+                and self.sftp_append(remote_path, stat.st_size)
+            ):
+                return True
+            if self.remote_file_unchanged((stat.st_mtime, stat.st_size), 1):
+                self._file_unchanged = True
+                self._metrics.count("cache_hits")
+                return True
+            download_time = time()
+            if compression:
+                with self._sftp.open(remote_path, "rb") as source:
+                    source.prefetch(stat.st_size)
+                    with open(local_path, "wb") as target:
+                        decompress_stream(source, target, compression)
+            else:
+                self._sftp.get(remote_path, local_path, prefetch=True)
+            self._metrics.count("bytes_transferred", stat.st_size)
+            self._download_time = download_time
+            # the local copy was replaced, read it again from the beginning
+            self._tail_inode = None
+        except (
+            paramiko.ssh_exception.SSHException,
+            OSError,
+            socket.timeout,
+            EOFError,
+        ) as e:
+            self._not_accessible_reason = f"SFTP download of {self._device} failed : {e}"
+            return False
+        return True
+
+    def sftp_append(self, remote_path, remote_size):
+        """
+        append to the local copy the bytes appended to the remote file.
+        Return False if the remote file is smaller than the local copy, it has
+        then to be downloaded again.
+        """
+        local_path = self.local_file_path()
+        if not os.path.isfile(local_path):
+            return False
+        local_size = os.path.getsize(local_path)
+        if remote_size < local_size:
+            return False
+        if remote_size > local_size:
+            with self._sftp.open(remote_path, "rb") as source:
+                source.seek(local_size)
+                source.prefetch(remote_size)
+                with open(local_path, "ab") as target:
+                    target.write(source.read(remote_size - local_size))
+            self._metrics.count("bytes_transferred", remote_size - local_size)
+        self._file_unchanged = remote_size == local_size
+        return True
+
+    def ftp_append(self):
+        """
+        append to the local copy the bytes appended to the remote file, using
+        the FTP REST command. Return False if the remote file is smaller than
+        the local copy, it has then to be downloaded again.
+        """
+        remote_path = self._device.filedevice.file_path
+        local_path = self.local_file_path()
+        if not os.path.isfile(local_path):
+            return False
+        local_size = os.path.getsize(local_path)
+        remote_size = self.inst.path.getsize(remote_path)
+        if remote_size < local_size:
+            return False
+        if remote_size > local_size:
+            with self.inst.open(remote_path, "rb", rest=local_size) as source:
+                with open(local_path, "ab") as target:
+                    shutil.copyfileobj(source, target)
+            self._metrics.count("bytes_transferred", remote_size - local_size)
+        self._file_unchanged = remote_size == local_size
+        return True
+
+    def ftp_file_unchanged(self):
+        """
+        compare the size and modification time of the remote file with the
+        ones seen at the last download.
+        """
+        stat = self.inst.stat(self.remote_file_path())
+        precision = getattr(stat, "_st_mtime_precision", None)
+        if not isinstance(precision, (int, float)):
+            precision = 60
+        return self.remote_file_unchanged((stat.st_mtime, stat.st_size), precision)
+
+    def remote_file_unchanged(self, signature, precision):
+        """
+        tell if the (modification time, size) signature of the remote file is
+        the one seen at the last download.
+
+        The modification time is only known to the precision in seconds, so
+        the file is downloaded again until a download happened after the end
+        of this precision window.
+        """
+        local_path = self.local_file_path()
+        now = time()
+        if signature != self._remote_signature:
+            self._remote_signature = signature
+            self._remote_signature_time = now
+            return False
+        if not os.path.isfile(local_path):
+            return False
+        if (
+            not self._device.filedevice.compressed_download
+            and os.path.getsize(local_path) != signature[1]
+        ):
+            return False
+        return (
+            self._download_time is not None
+            and self._download_time >= self._remote_signature_time + precision
+        )
+
+    @timed("upload")
     def upload(self):
         try:
-            if self._device.filedevice.protocol < 2:
+            if not self.uses_local_copy():
                 return False
             if self.inst is None:
                 logger.warning(
                     f"Device {self._device} not connected. Cannot upload file."
                 )
                 return False
-            if os.path.isfile(self._device.filedevice.local_temporary_file_copy_path):
-                self.inst.upload(
-                    self._device.filedevice.local_temporary_file_copy_path,
-                    self._device.filedevice.file_path,
+            if os.path.isfile(self.local_file_path()):
+                if self.uses_sftp():
+                    if self._sftp is None:
+                        self._sftp = self.inst.open_sftp()
+                    # replace the remote file atomically
+                    temporary_path = self._device.filedevice.file_path + ".pyscada.tmp"
+                    self._sftp.put(self.local_file_path(), temporary_path)
+                    self._sftp.posix_rename(
+                        temporary_path, self._device.filedevice.file_path
+                    )
+                else:
+                    self.inst.upload(
+                        self.local_file_path(), self._device.filedevice.file_path
+                    )
+                self._metrics.count(
+                    "bytes_transferred", os.path.getsize(self.local_file_path())
                 )
+                # the local copy changed, force the next download
+                self._remote_signature = None
                 return True
             else:
                 logger.warning(
-                    f"{self._device.filedevice.local_temporary_file_copy_path} is not a file on localhost {self._device.filedevice.host}"
+                    f"{self.local_file_path()} is not a file on localhost {self._device.filedevice.host}"
                 )
         except Exception as e:
             logger.warning(traceback.format_exc())
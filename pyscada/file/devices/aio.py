@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Handler running the blocking ssh and ftp operations of a cycle concurrently
+from an asyncio loop, each one with its own deadline of timeout seconds.
+
+The operations keep using the paramiko and ftputil connections of the
+GenericDevice handler, run in threads : paramiko multiplexes the channels of
+the remote commands on one transport, so the variables of an ssh device are
+read at the same time and a cycle lasts as long as its slowest operation
+instead of the sum of all of them. An operation past its deadline is
+reported as failed, and the connection it uses is closed instead of being
+given back to the pool, which ends its thread.
+
+The deadline of a download grows with the size of the file seen at the last
+download, at MIN_DOWNLOAD_RATE bytes per second, the first one only having
+the socket timeout.
+"""
+
+from __future__ import unicode_literals
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import traceback
+
+from . import GenericDevice
+from ..metrics import timed
+from ..pool import pool
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# operations of a device running at the same time
+MAX_CONCURRENT_OPERATIONS = 8
+# slowest transfer rate expected for the download deadlines, in bytes/s
+MIN_DOWNLOAD_RATE = 100 * 1024
+
+
+class AsyncDevice(GenericDevice):
+    def __init__(self, pyscada_device, variables):
+        super().__init__(pyscada_device, variables)
+        self._executor = None
+
+    def run_concurrently(self, operations, timeout):
+        """
+        run the blocking functions of the list concurrently, return the list
+        of their results, None for the ones which failed or did not end
+        within timeout seconds. The connection is closed if one of them did
+        not end, its thread still using it.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=MAX_CONCURRENT_OPERATIONS,
+                thread_name_prefix=f"pyscada.file-{self._device.pk}",
+            )
+
+        timed_out = []
+
+        async def run(operation):
+            loop = asyncio.get_running_loop()
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(self._executor, operation), timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f"Operation of {self._device} did not end within {timeout} seconds"
+                )
+                timed_out.append(operation)
+            except:
+                logger.warning(traceback.format_exc())
+            return None
+
+        async def run_all():
+            return await asyncio.gather(*(run(operation) for operation in operations))
+
+        results = asyncio.run(run_all())
+        if timed_out:
+            self.abort_connection()
+        return results
+
+    def read_all_over_ssh(self, variable_instance, timeout):
+        """
+        read each range, the structured formats, the merged awk program and
+        each other command at the same time
+        """
+        variables = self.readable_variables(variable_instance)
+        commands = self.command_variables(variables)
+        groups = {}
+        for pk, var in variables.items():
+            if self.range_of(var) is not None:
+                groups.setdefault(self.range_of(var), {})[pk] = var
+        structured = self.structured_variables(
+            {pk: v for pk, v in variables.items() if self.range_of(v) is None}
+        )
+        batch = self.get_awk_batch(commands)
+        batched = set()
+        if self._device.filedevice.batch_read:
+            batched = set(batch.keys)
+
+        operations = []
+        keys = []
+        for group in groups.values():
+            operations.append(lambda group=group: self.read_ranges(group, timeout))
+            keys.append(group.keys())
+        if structured:
+            operations.append(lambda: self.read_structured(structured))
+            keys.append(structured.keys())
+        if batched:
+            operations.append(
+                lambda: self.read_batch_over_ssh(commands, timeout, merged_only=True)
+            )
+            keys.append(batched)
+        for pk, var in commands.items():
+            if pk not in batched:
+                operations.append(
+                    lambda var=var: {var.pk: self.read_over_ssh(var, timeout)}
+                )
+                keys.append({pk})
+
+        values = {}
+        for pks, result in zip(keys, self.run_concurrently(operations, timeout)):
+            # failed or too slow, not read again in this cycle
+            values.update({pk: None for pk in pks} if result is None else result)
+        return values
+
+    def cleanup(self):
+        super().cleanup()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def download_deadline(self):
+        """
+        return the seconds a download may last, None if the size of the file
+        is unknown
+        """
+        if self._remote_signature is not None:
+            size = self._remote_signature[1]
+        else:
+            try:
+                size = os.path.getsize(self.local_file_path())
+            except OSError:
+                return None
+        return self._device.filedevice.timeout + size / MIN_DOWNLOAD_RATE
+
+    @timed("transfer")
+    def download(self):
+        """
+        download the file within its deadline, the connection being closed
+        to abort a slower transfer
+        """
+        # timed here, not again in the thread
+        download = super().download.__wrapped__
+        deadline = self.download_deadline()
+        (connected,) = self.run_concurrently([lambda: download(self)], deadline)
+        if connected is None:
+            self._not_accessible_reason = f"Download of {self._device} failed"
+            if deadline is not None:
+                self._not_accessible_reason += (
+                    f" or did not end within {deadline:.0f} seconds"
+                )
+            self.abort_connection()
+            return False
+        return connected
+
+    def abort_connection(self):
+        """
+        close the connection of a timed out operation instead of giving it
+        back to the pool
+        """
+        if self.inst is None:
+            return
+        if self._pool_key is not None:
+            pool.discard(self._pool_key, self.inst)
+            self._pool_key = None
+        else:
+            try:
+                self.inst.close()
+            except:
+                pass
+        self._sftp = None
+        self.inst = None
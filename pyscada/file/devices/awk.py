@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+Combine the awk commands of several FileVariables into a single awk program.
+
+Each command is tokenized and its rules are rewritten as guarded blocks of one
+main rule, so that the file is scanned once per cycle whatever the number of
+variables. Every ``print`` of a variable is tagged with the variable index
+through ``ORS`` so the output can be split back per variable.
+
+Commands using features which cannot be safely merged (BEGIN/END, printf,
+getline, output redirection, range patterns...) are rejected and have to be
+read one by one.
+"""
+
+from __future__ import unicode_literals
+
+import re
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+VALUE_SEPARATOR = "\037"
+RECORD_SEPARATOR = "\036"
+
+AWK_KEYWORDS = {
+    "if",
+    "else",
+    "while",
+    "for",
+    "do",
+    "break",
+    "continue",
+    "next",
+    "exit",
+    "delete",
+    "in",
+    "print",
+    "return",
+}
+AWK_LOOP_KEYWORDS = {"while", "for", "do"}
+AWK_UNSUPPORTED = {
+    "BEGIN",
+    "END",
+    "BEGINFILE",
+    "ENDFILE",
+    "function",
+    "func",
+    "getline",
+    "printf",
+    "nextfile",
+    "system",
+    "close",
+    "fflush",
+}
+AWK_BUILTIN_VARIABLES = {
+    "NR",
+    "NF",
+    "FNR",
+    "FS",
+    "OFS",
+    "RS",
+    "ORS",
+    "FILENAME",
+    "SUBSEP",
+    "RSTART",
+    "RLENGTH",
+    "CONVFMT",
+    "OFMT",
+    "ENVIRON",
+    "ARGC",
+    "ARGV",
+    "RT",
+    "IGNORECASE",
+    "PROCINFO",
+    "FIELDWIDTHS",
+    "FPAT",
+}
+AWK_SEPARATOR_VARIABLES = {
+    "FS",
+    "OFS",
+    "RS",
+    "ORS",
+    "SUBSEP",
+    "CONVFMT",
+    "OFMT",
+    "IGNORECASE",
+    "FIELDWIDTHS",
+    "FPAT",
+    "NR",
+    "NF",
+    "FNR",
+}
+AWK_BUILTIN_FUNCTIONS = {
+    "length",
+    "substr",
+    "index",
+    "split",
+    "sub",
+    "gsub",
+    "match",
+    "sprintf",
+    "tolower",
+    "toupper",
+    "int",
+    "sqrt",
+    "exp",
+    "log",
+    "sin",
+    "cos",
+    "atan2",
+    "rand",
+    "srand",
+    "strftime",
+    "systime",
+    "gensub",
+}
+AWK_ASSIGNMENT_OPERATORS = {"=", "+=", "-=", "*=", "/=", "%=", "^=", "++", "--"}
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<ws>[ \t]+|\\\n)
+    |(?P<comment>\#[^\n]*)
+    |(?P<nl>\n)
+    |(?P<str>"(?:[^"\\\n]|\\.)*")
+    |(?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    |(?P<name>[A-Za-z_][A-Za-z_0-9]*)
+    |(?P<op>\+\+|--|&&|\|\||[!=<>]=|[-+*/%^]=|>>|[{}()\[\];,$!~<>=+\-*/%^?:|])
+    """,
+    re.VERBOSE,
+)
+_REGEX_RE = re.compile(r"/(?:[^/\\\n\[]|\\.|\[(?:[^\]\\\n]|\\.)*\])*/")
+
+
+class AwkSyntaxError(ValueError):
+    pass
+
+
+class Token:
+    __slots__ = ("kind", "text")
+
+    def __init__(self, kind, text):
+        self.kind = kind
+        self.text = text
+
+    def __repr__(self):
+        return f"Token({self.kind}, {self.text!r})"
+
+
+def _regex_allowed(previous):
+    if previous is None:
+        return True
+    if previous.kind in ("num", "str", "re"):
+        return False
+    if previous.kind == "name":
+        return previous.text in AWK_KEYWORDS
+    return previous.text not in (")", "]", "$", "++", "--")
+
+
+def tokenize(program):
+    """
+    Split an awk program into tokens, keeping the white spaces so that the
+    program can be rebuilt unchanged.
+    """
+    tokens = []
+    previous = None
+    position = 0
+    while position < len(program):
+        if program[position] == "/" and _regex_allowed(previous):
+            match = _REGEX_RE.match(program, position)
+            if match is None:
+                raise AwkSyntaxError(f"unterminated regex at {position}")
+            token = Token("re", match.group())
+        else:
+            match = _TOKEN_RE.match(program, position)
+            if match is None:
+                raise AwkSyntaxError(
+                    f"unexpected character {program[position]!r} at {position}"
+                )
+            token = Token(match.lastgroup, match.group())
+        position = match.end()
+        tokens.append(token)
+        if token.kind not in ("ws", "comment"):
+            previous = token
+    return tokens
+
+
+def _significant(tokens):
+    return [t for t in tokens if t.kind not in ("ws", "comment", "nl")]
+
+
+def split_rules(tokens):
+    """
+    Return the list of (pattern tokens, action tokens or None) of a program.
+    """
+    rules = []
+    pattern = []
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        if token.text == "{":
+            depth = 0
+            action = []
+            while index < len(tokens):
+                token = tokens[index]
+                if token.text == "{":
+                    depth += 1
+                elif token.text == "}":
+                    depth -= 1
+                action.append(token)
+                index += 1
+                if depth == 0:
+                    break
+            if depth != 0:
+                raise AwkSyntaxError("unbalanced braces")
+            rules.append((pattern, action[1:-1]))
+            pattern = []
+            continue
+        if token.text == "}":
+            raise AwkSyntaxError("unbalanced braces")
+        if token.kind == "nl" or token.text == ";":
+            if _significant(pattern):
+                rules.append((pattern, None))
+            pattern = []
+        else:
+            pattern.append(token)
+        index += 1
+    if _significant(pattern):
+        rules.append((pattern, None))
+    return rules
+
+
+def _check_supported(tokens):
+    """
+    Raise AwkSyntaxError if the command cannot be merged with others.
+    """
+    significant = [t for t in tokens if t.kind not in ("ws", "comment")]
+    has_loop = False
+    has_jump = False
+    in_print = False
+    for position, token in enumerate(significant):
+        following = None
+        if position + 1 < len(significant):
+            following = significant[position + 1]
+        preceding = significant[position - 1] if position > 0 else None
+        if token.kind == "name":
+            if token.text in AWK_UNSUPPORTED:
+                raise AwkSyntaxError(f"{token.text} is not supported")
+            if token.text in AWK_LOOP_KEYWORDS:
+                has_loop = True
+            if token.text in ("next", "exit"):
+                has_jump = True
+            if token.text == "exit" and following is not None:
+                if following.kind != "nl" and following.text not in (";", "}"):
+                    raise AwkSyntaxError("exit with a status is not supported")
+            if token.text in AWK_SEPARATOR_VARIABLES and (
+                following is not None
+                and following.text in AWK_ASSIGNMENT_OPERATORS
+                or (preceding is not None and preceding.text in ("++", "--"))
+            ):
+                raise AwkSyntaxError(f"assignment to {token.text} is not supported")
+            if token.text == "print":
+                in_print = True
+        elif token.kind == "nl" or token.text in (";", "{", "}"):
+            in_print = False
+        elif in_print and token.text in (">", ">>", "|"):
+            raise AwkSyntaxError("print redirection is not supported")
+    if has_loop and has_jump:
+        raise AwkSyntaxError("next or exit inside a loop is not supported")
+
+
+def _modifies_record(tokens):
+    names = {t.text for t in tokens if t.kind == "name"}
+    ops = {t.text for t in tokens if t.kind == "op"}
+    return bool(names & {"sub", "gsub"}) or (
+        "$" in ops and bool(ops & AWK_ASSIGNMENT_OPERATORS)
+    )
+
+
+def _rewrite_action(tokens, index):
+    """
+    Rename the user variables and replace next and exit by a jump out of the
+    block of the variable.
+    """
+    out = []
+    for position, token in enumerate(tokens):
+        following = None
+        for t in tokens[position + 1 :]:
+            if t.kind not in ("ws", "comment"):
+                following = t
+                break
+        if token.kind != "name":
+            out.append(token.text)
+        elif token.text == "next":
+            out.append("break")
+        elif token.text == "exit":
+            out.append(f"{{ __d[{index}] = 1; __n++; break }}")
+        elif (
+            token.text in AWK_KEYWORDS
+            or token.text in AWK_BUILTIN_VARIABLES
+            or token.text in AWK_BUILTIN_FUNCTIONS
+        ):
+            out.append(token.text)
+        elif following is not None and following.text == "(":
+            raise AwkSyntaxError(f"call to user function {token.text}")
+        else:
+            out.append(f"__v{index}_{token.text}")
+    return "".join(out)
+
+
+def _is_range_pattern(pattern):
+    depth = 0
+    for token in _significant(pattern):
+        if token.text in ("(", "["):
+            depth += 1
+        elif token.text in (")", "]"):
+            depth -= 1
+        elif token.text == "," and depth == 0:
+            return True
+    return False
+
+
+def compile_block(command, index):
+    """
+    Translate the awk command of one variable into a block of the main rule.
+
+    Return the block and whether it modifies the current record.
+    """
+    tokens = tokenize(command)
+    modifies = _modifies_record(tokens)
+    _check_supported(tokens)
+    rules = split_rules(tokens)
+    lines = [
+        "do {",
+        f"if (__d[{index}]) break",
+        f'ORS = "{VALUE_SEPARATOR}{index}{RECORD_SEPARATOR}"',
+    ]
+    for pattern, action in rules:
+        if _is_range_pattern(pattern):
+            raise AwkSyntaxError("range patterns are not supported")
+        pattern_text = _rewrite_action(pattern, index).strip()
+        if action is None:
+            action_text = "print"
+        else:
+            action_text = _rewrite_action(action, index)
+        if pattern_text:
+            lines.append(f"if ({pattern_text}) {{\n{action_text}\n}}")
+        else:
+            lines.append(f"{{\n{action_text}\n}}")
+    lines.append("} while (0)")
+    if modifies:
+        lines.append("$0 = __rec")
+    return "\n".join(lines), modifies
+
+
+class AwkBatch:
+    """
+    A single awk program reading the values of several awk commands.
+
+    ``commands`` is an iterable of (key, command). ``keys`` lists the keys
+    merged in ``program`` and ``rejected`` the ones that must be read alone.
+    """
+
+    def __init__(self, commands):
+        self.keys = []
+        self.rejected = []
+        blocks = []
+        restore = False
+        for key, command in commands:
+            try:
+                block, modifies = compile_block(command, len(self.keys))
+            except AwkSyntaxError as e:
+                logger.debug(f"awk command ({command}) cannot be batched : {e}")
+                self.rejected.append(key)
+                continue
+            self.keys.append(key)
+            blocks.append(block)
+            restore = restore or modifies
+        if not blocks:
+            self.program = None
+            return
+        self.program = "{\n%s%s\nif (__n >= %d) exit\n}\n" % (
+            "__rec = $0\n" if restore else "",
+            "\n".join(blocks),
+            len(blocks),
+        )
+
+    def split_output(self, output):
+        """
+        Return a dict of key: output of the command, as if it ran alone.
+        """
+        values = {key: "" for key in self.keys}
+        for record in output.split(RECORD_SEPARATOR)[:-1]:
+            value, _, index = record.rpartition(VALUE_SEPARATOR)
+            try:
+                key = self.keys[int(index)]
+            except (ValueError, IndexError):
+                logger.warning(f"Unexpected output of batched awk command : {record}")
+                continue
+            values[key] += value + "\n"
+        return values
@@ -0,0 +1,670 @@
+# -*- coding: utf-8 -*-
+"""
+In-process evaluation of the simple awk and sed commands of FileVariables.
+
+Commands are compiled once into extractor objects which are then fed the lines
+of the file, so that reading a variable does not fork a process. Only a common
+subset of the languages is handled:
+
+ - awk : rules made of ``NR``, ``NF``, ``/regex/``, ``$N == value`` and
+   ``$N ~ /regex/`` conditions joined by ``&&``, with ``print`` of fields,
+   ``NR``, ``NF`` or strings, ``next`` and ``exit`` actions,
+ - sed : ``p``, ``d``, ``q`` and ``s/regex/replacement/[gp]`` commands with a
+   line number, ``$`` or ``/regex/`` address and an optional ``!``, ``#n``
+   on the first line to disable the automatic printing.
+
+``compile_extractor`` returns None for anything else, the command then has to
+be run by the external program.
+"""
+
+from __future__ import unicode_literals
+
+from functools import lru_cache
+import re
+
+from .awk import tokenize, split_rules, AwkSyntaxError
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_FIELD_RE = re.compile(r"[^ \t\n]+")
+_NUMBER_RE = re.compile(
+    r"^[ \t\n]*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?[ \t\n]*$"
+)
+_POSIX_CLASSES = {
+    "alpha": "a-zA-Z",
+    "digit": "0-9",
+    "alnum": "a-zA-Z0-9",
+    "upper": "A-Z",
+    "lower": "a-z",
+    "space": " \\t\\n\\r\\f\\v",
+    "blank": " \\t",
+    "punct": "!-/:-@\\[-`{-~",
+    "xdigit": "0-9A-Fa-f",
+    "cntrl": "\\x00-\\x1f\\x7f",
+    "print": " -~",
+    "graph": "!-~",
+}
+_ERE_ESCAPES = set("tnrsSwW")
+
+
+class ExtractorUnsupported(ValueError):
+    pass
+
+
+class Record:
+    """
+    A line of the file, the fields are split on first access.
+    """
+
+    __slots__ = ("nr", "line", "last", "eol", "_fields")
+
+    def __init__(self, nr, line, last, eol="\n"):
+        self.nr = nr
+        self.line = line
+        self.last = last
+        # sed does not add a new line after a last line without one
+        self.eol = eol
+        self._fields = None
+
+    @property
+    def fields(self):
+        if self._fields is None:
+            self._fields = _FIELD_RE.findall(self.line)
+        return self._fields
+
+    def field(self, index):
+        if index == 0:
+            return self.line
+        fields = self.fields
+        return fields[index - 1] if 0 < index <= len(fields) else ""
+
+
+class State:
+    """
+    The output of an extractor during one pass over a file.
+    """
+
+    __slots__ = ("output", "done")
+
+    def __init__(self):
+        self.output = []
+        self.done = False
+
+
+def _translate_bracket(regex, position):
+    """
+    Translate the POSIX bracket expression starting at position, return the
+    python equivalent and the position after it.
+    """
+    out = ["["]
+    position += 1
+    if position < len(regex) and regex[position] == "^":
+        out.append("^")
+        position += 1
+    if position < len(regex) and regex[position] == "]":
+        out.append("\\]")
+        position += 1
+    while position < len(regex):
+        char = regex[position]
+        if char == "]":
+            return "".join(out) + "]", position + 1
+        if regex.startswith("[:", position):
+            end = regex.find(":]", position + 2)
+            name = regex[position + 2 : end] if end > 0 else None
+            if name not in _POSIX_CLASSES:
+                raise ExtractorUnsupported(f"bracket expression in {regex}")
+            out.append(_POSIX_CLASSES[name])
+            position = end + 2
+            continue
+        out.append("\\" + char if char in "\\[" else char)
+        position += 1
+    raise ExtractorUnsupported(f"unterminated bracket expression in {regex}")
+
+
+def translate_ere(regex):
+    """
+    Translate an awk extended regular expression to python.
+    """
+    out = []
+    position = 0
+    while position < len(regex):
+        char = regex[position]
+        if char == "[":
+            text, position = _translate_bracket(regex, position)
+            out.append(text)
+            continue
+        if char == "\\":
+            if position + 1 >= len(regex):
+                raise ExtractorUnsupported(f"trailing backslash in {regex}")
+            escaped = regex[position + 1]
+            if escaped.isalnum() and escaped not in _ERE_ESCAPES:
+                raise ExtractorUnsupported(f"escape \\{escaped} in {regex}")
+            out.append("\\" + escaped)
+            position += 2
+            continue
+        out.append(char)
+        position += 1
+    return re.compile("".join(out))
+
+
+def translate_bre(regex):
+    """
+    Translate a sed basic regular expression (with the GNU extensions) to
+    python.
+    """
+    out = []
+    position = 0
+    while position < len(regex):
+        char = regex[position]
+        if char == "[":
+            text, position = _translate_bracket(regex, position)
+            out.append(text)
+            continue
+        if char == "\\":
+            if position + 1 >= len(regex):
+                raise ExtractorUnsupported(f"trailing backslash in {regex}")
+            escaped = regex[position + 1]
+            if escaped in "(){}|+?":
+                out.append(escaped)
+            elif escaped in "123456789":
+                out.append("\\" + escaped)
+            elif escaped == "n":
+                out.append("\\n")
+            elif escaped == "t":
+                out.append("\\t")
+            elif escaped.isalnum():
+                raise ExtractorUnsupported(f"escape \\{escaped} in {regex}")
+            else:
+                out.append(re.escape(escaped))
+            position += 2
+            continue
+        out.append("\\" + char if char in "(){}|+?" else char)
+        position += 1
+    return re.compile("".join(out))
+
+
+def _awk_number(text):
+    number = float(text)
+    return int(number) if number.is_integer() else number
+
+
+class AwkExtractor:
+    """
+    A compiled awk command of the supported subset.
+
+    ``lines`` is the set of the line numbers the command can print, None if
+    it depends on the whole file.
+    """
+
+    def __init__(self, rules, lines=None):
+        self.rules = rules
+        self.lines = lines
+
+    def feed(self, state, record):
+        """
+        process a record, return True when the command exited
+        """
+        for conditions, statements in self.rules:
+            if not all(condition(record) for condition in conditions):
+                continue
+            for statement in statements:
+                if statement is None:  # next
+                    return False
+                if statement is True:  # exit
+                    state.done = True
+                    return True
+                state.output.append(
+                    " ".join(str(value(record)) for value in statement) + "\n"
+                )
+        return False
+
+
+def _awk_value(tokens):
+    """
+    Compile an awk expression of the subset into a function of a record.
+    """
+    texts = [t.text for t in tokens]
+    if texts == ["$", "NF"]:
+        return lambda r: r.fields[-1] if r.fields else r.line
+    if len(texts) == 2 and texts[0] == "$" and tokens[1].kind == "num":
+        index = int(texts[1])
+        return lambda r: r.field(index)
+    if texts == ["NR"]:
+        return lambda r: r.nr
+    if texts == ["NF"]:
+        return lambda r: len(r.fields)
+    if len(tokens) == 1 and tokens[0].kind == "str":
+        text = tokens[0].text[1:-1]
+        if "\\" in text:
+            raise ExtractorUnsupported(f"escape in string {text}")
+        return lambda r: text
+    raise ExtractorUnsupported(f"expression {''.join(texts)}")
+
+
+_COMPARISONS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+def _awk_compare(value, operator, constant):
+    """
+    Compare a field with a constant the way awk does : numerically when both
+    look like numbers, as strings otherwise.
+    """
+    compare = _COMPARISONS[operator]
+    if constant.kind == "str":
+        text = constant.text[1:-1]
+        return lambda r: compare(str(value(r)), text)
+    number = _awk_number(constant.text)
+    text = str(number)
+
+    def condition(r):
+        v = value(r)
+        if isinstance(v, int) or _NUMBER_RE.match(v):
+            return compare(float(v), number)
+        return compare(v, text)
+
+    return condition
+
+
+def _awk_condition(tokens):
+    texts = [t.text for t in tokens]
+    negate = False
+    if texts and texts[0] == "!":
+        negate = True
+        tokens = tokens[1:]
+        texts = texts[1:]
+    if len(tokens) == 1 and tokens[0].kind == "re":
+        regex = translate_ere(tokens[0].text[1:-1])
+        condition = lambda r: regex.search(r.line) is not None
+    else:
+        for position, token in enumerate(tokens):
+            if token.text in ("~", "!~") and position + 2 == len(tokens):
+                if tokens[-1].kind != "re":
+                    raise ExtractorUnsupported("dynamic regex")
+                value = _awk_value(tokens[:position])
+                regex = translate_ere(tokens[-1].text[1:-1])
+                match = token.text == "~"
+                condition = (
+                    lambda r, value=value, regex=regex, match=match: (
+                        regex.search(str(value(r))) is not None
+                    )
+                    == match
+                )
+                break
+            if token.text in _COMPARISONS and position + 2 == len(tokens):
+                if tokens[-1].kind not in ("num", "str"):
+                    raise ExtractorUnsupported(f"comparison {''.join(texts)}")
+                condition = _awk_compare(
+                    _awk_value(tokens[:position]), token.text, tokens[-1]
+                )
+                break
+        else:
+            raise ExtractorUnsupported(f"condition {''.join(texts)}")
+    if negate:
+        return lambda r, condition=condition: not condition(r)
+    return condition
+
+
+def _split_significant(tokens, separators):
+    parts = [[]]
+    for token in tokens:
+        if token.kind in ("ws", "comment"):
+            continue
+        if token.text in separators or (token.kind == "nl" and "\n" in separators):
+            parts.append([])
+        elif token.kind != "nl":
+            parts[-1].append(token)
+    return [part for part in parts if part]
+
+
+def compile_awk(command):
+    try:
+        tokens = tokenize(command)
+        rules = split_rules(tokens)
+    except AwkSyntaxError as e:
+        raise ExtractorUnsupported(str(e))
+    compiled = []
+    lines = set()
+    for pattern, action in rules:
+        parts = _split_significant(pattern, ("&&",))
+        conditions = [_awk_condition(part) for part in parts]
+        line = None
+        for part in parts:
+            if [t.text for t in part[:2]] == ["NR", "=="] and len(part) == 3:
+                if part[2].kind == "num" and part[2].text.isdigit():
+                    line = int(part[2].text)
+        if lines is not None and line is not None:
+            lines.add(line)
+        else:
+            lines = None
+        if action is None:
+            compiled.append((conditions, [[lambda r: r.line]]))
+            continue
+        statements = []
+        for statement in _split_significant(action, (";", "\n")):
+            keyword = statement[0].text
+            if keyword == "print" and statement[0].kind == "name":
+                arguments = _split_significant(statement[1:], (",",))
+                if not arguments:
+                    arguments = [[]]
+                statements.append(
+                    [
+                        _awk_value(argument) if argument else (lambda r: r.line)
+                        for argument in arguments
+                    ]
+                )
+            elif keyword == "next" and len(statement) == 1:
+                statements.append(None)
+            elif keyword == "exit" and len(statement) == 1:
+                statements.append(True)
+            else:
+                raise ExtractorUnsupported(f"statement {keyword}")
+        compiled.append((conditions, statements))
+    return AwkExtractor(compiled, lines)
+
+
+class SedExtractor:
+    """
+    A compiled sed script of the supported subset.
+
+    ``lines`` is the set of the line numbers the script can print, None if
+    it depends on the whole file.
+    """
+
+    def __init__(self, commands, autoprint, lines=None):
+        self.commands = commands
+        self.autoprint = autoprint
+        self.lines = lines
+
+    def feed(self, state, record):
+        """
+        process a record, return True when the script quitted
+        """
+        space = record.line
+        printed = []
+        deleted = False
+        for address, negate, name, argument in self.commands:
+            if address is not None and address(record) == negate:
+                continue
+            if name == "d":
+                deleted = True
+                break
+            if name == "p":
+                printed.append(space)
+            elif name == "q":
+                state.done = True
+                break
+            elif name == "s":
+                regex, replacement, count, printing = argument
+                space, replaced = _sed_substitute(regex, replacement, space, count)
+                if replaced and printing:
+                    printed.append(space)
+        if self.autoprint and not deleted:
+            printed.append(space)
+        if record.eol:
+            state.output.extend(text + record.eol for text in printed)
+        elif printed:
+            # like GNU sed, the missing new line of the last line is only
+            # added between two outputs or when quitting
+            state.output.append("\n".join(printed) + ("\n" if state.done else ""))
+        return state.done
+
+
+def _sed_substitute(regex, replacement, text, count):
+    """
+    Replace the first count matches, all of them if 0, like sed : unlike
+    re.sub, an empty match right after a match is not replaced.
+    Return the new text and the number of replacements.
+    """
+    if count == 1:
+        return regex.subn(replacement, text, count=1)
+    out = []
+    position = 0
+    replaced = 0
+    for match in regex.finditer(text):
+        if replaced and match.start() == match.end() == position:
+            continue
+        out.append(text[position : match.start()])
+        out.append(match.expand(replacement))
+        position = match.end()
+        replaced += 1
+        if replaced == count:
+            break
+    out.append(text[position:])
+    return "".join(out), replaced
+
+
+def _sed_replacement(text):
+    """
+    Translate a sed replacement into a python one.
+    """
+    out = []
+    position = 0
+    while position < len(text):
+        char = text[position]
+        if char == "&":
+            out.append("\\g<0>")
+        elif char == "\\" and position + 1 < len(text):
+            escaped = text[position + 1]
+            position += 1
+            if escaped in "123456789":
+                out.append("\\g<" + escaped + ">")
+            elif escaped == "n":
+                out.append("\n")
+            elif escaped == "t":
+                out.append("\t")
+            elif escaped.isalnum():
+                raise ExtractorUnsupported(f"escape \\{escaped} in replacement")
+            else:
+                out.append(escaped.replace("\\", "\\\\"))
+        elif char == "\\":
+            raise ExtractorUnsupported("trailing backslash in replacement")
+        else:
+            out.append(char)
+        position += 1
+    return "".join(out)
+
+
+def _sed_delimited(script, position, delimiter):
+    """
+    Return the text up to the next unescaped delimiter and the position after.
+    """
+    out = []
+    while position < len(script):
+        char = script[position]
+        if char == "\\" and position + 1 < len(script):
+            if script[position + 1] == delimiter:
+                out.append(delimiter)
+            else:
+                out.append(script[position : position + 2])
+            position += 2
+            continue
+        if char == delimiter:
+            return "".join(out), position + 1
+        if char == "\n":
+            break
+        out.append(char)
+        position += 1
+    raise ExtractorUnsupported("unterminated sed expression")
+
+
+def _sed_lines(addresses, autoprint):
+    """
+    Return the line numbers a script can print when all its commands are
+    addressed by a line number before a d command deleting the other lines,
+    as in ``5q;d`` or ``5!d``.
+    """
+    lines = set()
+    for line, negate, name in addresses:
+        if name == "d" and line is None:
+            return lines
+        if name == "d" and negate and isinstance(line, int):
+            return lines | {line}
+        if not isinstance(line, int) or negate:
+            return None
+        lines.add(line)
+    return None if autoprint else lines
+
+
+def compile_sed(script):
+    autoprint = True
+    if script.startswith("#n\n") or script == "#n":
+        autoprint = False
+        script = script[3:]
+    commands = []
+    addresses = []
+    position = 0
+    while position < len(script):
+        char = script[position]
+        if char in " \t\n;":
+            position += 1
+            continue
+        address = None
+        line = None
+        if char.isdigit():
+            match = re.compile(r"\d+").match(script, position)
+            line = int(match.group())
+            address = lambda r, line=line: r.nr == line
+            position = match.end()
+        elif char == "$":
+            address = lambda r: r.last
+            line = "$"
+            position += 1
+        elif char == "/":
+            text, position = _sed_delimited(script, position + 1, "/")
+            regex = translate_bre(text)
+            address = lambda r, regex=regex: regex.search(r.line) is not None
+            line = "/"
+        while position < len(script) and script[position] in " \t":
+            position += 1
+        negate = False
+        if position < len(script) and script[position] == "!":
+            negate = True
+            position += 1
+        if position >= len(script):
+            raise ExtractorUnsupported("missing sed command")
+        name = script[position]
+        position += 1
+        argument = None
+        if name == "s":
+            if position >= len(script) or script[position] in "\\\n":
+                raise ExtractorUnsupported("bad s command")
+            delimiter = script[position]
+            regex, position = _sed_delimited(script, position + 1, delimiter)
+            replacement, position = _sed_delimited(script, position, delimiter)
+            flags = re.compile(r"[gp]*").match(script, position).group()
+            position += len(flags)
+            argument = (
+                translate_bre(regex),
+                _sed_replacement(replacement),
+                0 if "g" in flags else 1,
+                "p" in flags,
+            )
+        elif name not in "pdq":
+            raise ExtractorUnsupported(f"sed command {name}")
+        while position < len(script) and script[position] in " \t":
+            position += 1
+        if position < len(script) and script[position] not in ";\n":
+            raise ExtractorUnsupported(f"unexpected {script[position]!r}")
+        commands.append((address, negate, name, argument))
+        addresses.append((line, negate, name))
+    return SedExtractor(commands, autoprint, _sed_lines(addresses, autoprint))
+
+
+@lru_cache(maxsize=1024)
+def compile_extractor(program, command):
+    """
+    Return the extractor of a FileVariable command, or None if the command
+    has to be run by the external program.
+    """
+    try:
+        if program == "awk":
+            return compile_awk(command)
+        if program == "sed":
+            return compile_sed(command)
+    except (ExtractorUnsupported, re.error) as e:
+        logger.debug(f"{program} cmd ({command}) run by the external program : {e}")
+    return None
+
+
+def iter_records(lines):
+    """
+    Yield the records of an iterable of lines, knowing which one is the last.
+    """
+    previous = None
+    eol = "\n"
+    nr = 0
+    for line in lines:
+        if previous is not None:
+            nr += 1
+            yield Record(nr, previous, False)
+        if line.endswith("\n"):
+            previous = line[:-1]
+        else:
+            previous = line
+            eol = ""
+    if previous is not None:
+        yield Record(nr + 1, previous, True, eol)
+
+
+def extract(lines, extractors):
+    """
+    Feed the lines to all the extractors in a single pass.
+
+    ``extractors`` is a dict of key: extractor, return a dict of key: output.
+    """
+    return extract_records(iter_records(lines), extractors)
+
+
+def extract_records(records, extractors):
+    """
+    Feed the records to all the extractors in a single pass.
+    """
+    states = {key: State() for key in extractors}
+    running = list(extractors.items())
+    for record in records:
+        finished = False
+        for key, extractor in running:
+            finished = extractor.feed(states[key], record) or finished
+        if finished:
+            running = [(key, e) for key, e in running if not states[key].done]
+            if not running:
+                break
+    return {key: "".join(state.output) for key, state in states.items()}
+
+
+def transform(lines, extractor):
+    """
+    Yield the output of the extractor line by line, as the lines are read.
+    """
+    state = State()
+    for record in iter_records(lines):
+        extractor.feed(state, record)
+        for text in state.output:
+            yield from text.splitlines(True)
+        state.output.clear()
+        if state.done:
+            return
+
+
+def is_substitution(extractor):
+    """
+    Tell if the extractor is a sed script only made of s commands, which
+    outputs exactly one line for each line.
+    """
+    return (
+        isinstance(extractor, SedExtractor)
+        and extractor.autoprint
+        and all(
+            name == "s" and not argument[3]
+            for address, negate, name, argument in extractor.commands
+        )
+    )
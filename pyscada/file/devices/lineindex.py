@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Line-offset index of a local file read through mmap.
+
+The offsets of the lines are found once per version of the file, identified
+by its modification time, size and inode, and only as far as the highest line
+number requested. The variables addressing fixed line numbers then read their
+lines by slicing the map instead of scanning the file.
+"""
+
+from __future__ import unicode_literals
+
+import mmap
+import os
+
+from .extractors import Record
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LineIndex:
+    """
+    The start offsets of the lines of a file, kept as long as the file is
+    unchanged.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.key = None
+        self.offsets = [0]
+        self.complete = False
+
+    def refresh(self, stat):
+        """
+        forget the offsets if the file changed since they were found
+        """
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if key != self.key:
+            self.key = key
+            self.offsets = [0]
+            self.complete = stat.st_size == 0
+
+    def _index_to(self, data, line):
+        """
+        find the offsets of the lines up to the line number, or to the end
+        """
+        size = len(data)
+        while len(self.offsets) <= line and not self.complete:
+            end = data.find(b"\n", self.offsets[-1])
+            if end < 0 or end + 1 == size:
+                self.complete = True
+                self.offsets.append(size)
+                break
+            self.offsets.append(end + 1)
+
+    def records(self, lines):
+        """
+        return the records of the line numbers in increasing order,
+        the ones after the end of the file being ignored
+        """
+        with open(self.file_path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.refresh(stat)
+            if stat.st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                records = []
+                for line in sorted(lines):
+                    if line < 1:
+                        continue
+                    self._index_to(data, line)
+                    if line >= len(self.offsets):
+                        break
+                    start = self.offsets[line - 1]
+                    end = self.offsets[line]
+                    last = self.complete and line == len(self.offsets) - 1
+                    text = data[start:end]
+                    eol = "\n"
+                    if text.endswith(b"\n"):
+                        text = text[:-1]
+                    elif last:
+                        eol = ""
+                    records.append(Record(line, text.decode(), last, eol))
+                return records
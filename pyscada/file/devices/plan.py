@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Read plan of a file device : the configuration the handler needs at each
+read, resolved once from the FileDevice and FileVariable models.
+
+The saves of the models restart the DAQ process of the device, which creates
+the handler and its plan again. The handler builds the plan again when the
+variables of the device are loaded after it was created.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import shlex
+import tempfile
+
+from .structured import PROGRAMS as STRUCTURED_PROGRAMS
+
+# how the commands reach the file
+LOCAL_FILE = 0
+LOCAL_COPY = 1  # downloaded over ftp or sftp
+REMOTE_COMMANDS = 2  # run on the remote host over ssh
+
+
+def variable_range(variable):
+    """
+    return the (start, length) byte range of the variable, None if it
+    reads the whole file
+    """
+    start = variable.filevariable.range_start
+    length = variable.filevariable.range_length
+    if start == 0 and length == 0:
+        return None
+    return start, length
+
+
+class VariablePlan:
+    """
+    How a variable is read
+    """
+
+    __slots__ = (
+        "variable",
+        "program",
+        "command",
+        "argv",
+        "remote_command",
+        "writable",
+        "range",
+        "structured",
+    )
+
+    def __init__(self, variable, file_path):
+        program = variable.filevariable.program
+        command = variable.filevariable.command
+        self.variable = variable
+        self.program = program
+        self.command = command
+        self.argv = (program, command)
+        self.remote_command = (
+            f"{shlex.quote(program)} {shlex.quote(command)} {shlex.quote(file_path)}"
+        )
+        self.writable = "$value$" in command
+        self.range = variable_range(variable)
+        self.structured = program in STRUCTURED_PROGRAMS
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError(f"{name} of a variable plan is read only")
+        super().__setattr__(name, value)
+
+
+class ReadPlan:
+    """
+    How the variables of a device are read
+    """
+
+    __slots__ = (
+        "protocol",
+        "source",
+        "file_path",
+        "local_path",
+        "timeout",
+        "keys",
+        "variables",
+        "readable",
+        "writable",
+        "by_id",
+    )
+
+    def __init__(self, device, variables):
+        filedevice = device.filedevice
+        self.protocol = filedevice.protocol
+        if filedevice.protocol == 0:
+            self.source = LOCAL_FILE
+        elif filedevice.protocol == 2 or filedevice.ssh_transfer_mode == 1:
+            self.source = LOCAL_COPY
+        else:
+            self.source = REMOTE_COMMANDS
+        self.file_path = filedevice.file_path
+        if self.source == LOCAL_COPY:
+            local_path = filedevice.local_temporary_file_copy_path
+            if local_path == "":
+                local_path = os.path.join(
+                    tempfile.gettempdir(), f"pyscada_file_{device.pk}"
+                )
+        else:
+            local_path = filedevice.file_path
+        self.local_path = local_path
+        self.timeout = filedevice.timeout
+        # the pks of the variables the plan was built with
+        self.keys = frozenset(variables)
+        self.variables = {
+            pk: VariablePlan(var, filedevice.file_path)
+            for pk, var in variables.items()
+            if hasattr(var, "filevariable")
+        }
+        self.readable = {
+            pk: plan.variable
+            for pk, plan in self.variables.items()
+            if not plan.writable
+        }
+        self.writable = {
+            pk: plan.variable for pk, plan in self.variables.items() if plan.writable
+        }
+        self.by_id = {var.id: var for var in variables.values()}
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError(f"{name} of a read plan is read only")
+        super().__setattr__(name, value)
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""
+Structured formats read by the csv, json, ini, keyvalue and table
+FileVariable programs.
+
+The file is parsed once per cycle for each format used by the variables of a
+device, then the command of each variable is looked up in the parsed
+structure :
+
+ - csv : ``column`` or ``column:row``, the column by number from 1 or by name
+   in the header line, the row from 1 for the first data line and negative
+   from the end, the last one by default,
+ - json : a path like ``$.key.list[0]`` or ``key['other key'][-1]``,
+ - ini : ``section/key``, or ``key`` for the DEFAULT section which also holds
+   the keys before the first section,
+ - keyvalue : the key of ``key=value`` lines, the last one wins,
+ - table : ``column`` or ``column:row`` like csv, or ``column:aggregate`` with
+   last, first, mean, min, max, sum or count over the rows, which are only
+   the appended ones in appended lines mode. The numeric table is loaded in a
+   numpy array and the columns are reduced with vectorized operations.
+
+With a timestamp column set on the device, the csv and table variables
+without a row return all the rows as (timestamp, value) samples.
+
+The table program needs the optional numpy package.
+"""
+
+from __future__ import unicode_literals
+
+import configparser
+import csv
+from datetime import datetime
+from functools import lru_cache
+import io
+import json
+import re
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+
+    numpy_ok = True
+except ImportError:
+    numpy_ok = False
+
+PROGRAMS = ("csv", "json", "ini", "keyvalue", "table")
+CSV_DELIMITERS = ",;\t|"
+TABLE_AGGREGATES = ("last", "first", "mean", "min", "max", "sum", "count")
+
+_JSON_PATH_RE = re.compile(
+    r"""\.?(?P<name>[^.\[\]'"]+)
+    |\[(?P<index>-?\d+)\]
+    |\['(?P<single>[^']*)'\]
+    |\["(?P<double>[^"]*)"\]""",
+    re.VERBOSE,
+)
+
+
+class QueryError(ValueError):
+    pass
+
+
+class Samples(list):
+    """
+    The (timestamp, value) samples of a variable read at once
+    """
+
+
+def parse_column(text):
+    """
+    return the index of a column given by number from 1, or its name
+    """
+    text = text.strip()
+    return int(text) - 1 if text.isdigit() else text
+
+
+def column_index(column, names):
+    """
+    return the index of the column in the names of the header, None if
+    not found
+    """
+    if not isinstance(column, str):
+        return column
+    if not names or column not in names:
+        return None
+    return names.index(column)
+
+
+def parse_timestamp(text, timestamp_format=""):
+    """
+    return the timestamp in seconds of the text, formatted by
+    timestamp_format for strptime, or a number of seconds, or ISO 8601
+    """
+    text = text.strip()
+    if timestamp_format:
+        return datetime.strptime(text, timestamp_format).timestamp()
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def parse_csv(text):
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=CSV_DELIMITERS)
+    except csv.Error:
+        dialect = csv.excel
+    return [row for row in csv.reader(text.splitlines(), dialect) if row]
+
+
+def parse_ini(text):
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    # the keys before the first section are in the DEFAULT section
+    parser.read_string(f"[{configparser.DEFAULTSECT}]\n" + text)
+    return parser
+
+
+def parse_keyvalue(text):
+    values = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        key, separator, value = line.partition("=")
+        if not separator:
+            continue
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+            value = value[1:-1]
+        values[key.strip()] = value
+    return values
+
+
+class Table:
+    """
+    The numeric rows of a table file in a 2D array, with the column names of
+    the header line if any
+    """
+
+    def __init__(self, names, data, lines=(), delimiter=None):
+        self.names = names
+        self.data = data
+        self.lines = lines
+        self.delimiter = delimiter
+        self.text_columns = {}
+
+    def text_column(self, index):
+        """
+        return the cells of a column as text, for the timestamps
+        """
+        if index not in self.text_columns:
+            cells = []
+            for line in self.lines:
+                fields = line.split(self.delimiter)
+                cells.append(fields[index].strip() if index < len(fields) else "")
+            self.text_columns[index] = cells
+        return self.text_columns[index]
+
+
+def _is_number(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+def parse_table(text):
+    if not numpy_ok:
+        raise ImportError("the numpy package is needed to read tables")
+    lines = [line for line in text.splitlines() if line.strip() and line[0] != "#"]
+    if not lines:
+        return Table(None, numpy.empty((0, 0)))
+    delimiter = None
+    for char in CSV_DELIMITERS:
+        if char in lines[0]:
+            delimiter = char
+            break
+    first = [field.strip() for field in lines[0].split(delimiter)]
+    names = None
+    # a header line has no number, a data line may have text timestamps
+    if not any(_is_number(field) for field in first):
+        names = first
+        lines = lines[1:]
+    if not lines:
+        return Table(names, numpy.empty((0, len(first))))
+    try:
+        data = numpy.loadtxt(lines, delimiter=delimiter, ndmin=2)
+    except ValueError:
+        # missing or invalid cells are read as nan
+        data = numpy.genfromtxt(
+            io.StringIO("\n".join(lines)),
+            delimiter=delimiter,
+            invalid_raise=False,
+            ndmin=2,
+        )
+    return Table(names, data, lines, delimiter)
+
+
+PARSERS = {
+    "csv": parse_csv,
+    "json": json.loads,
+    "ini": parse_ini,
+    "keyvalue": parse_keyvalue,
+    "table": parse_table,
+}
+
+
+def parse(program, text):
+    """
+    return the structure of the text in the format of the program
+    """
+    return PARSERS[program](text)
+
+
+class CsvQuery:
+    def __init__(self, command):
+        column, _, row = command.partition(":")
+        self.column = parse_column(column)
+        self.every_row = not row.strip()
+        try:
+            self.row = int(row) if row.strip() else -1
+        except ValueError:
+            raise QueryError(f"invalid csv row {row}")
+        if self.row == 0 or self.column == -1:
+            raise QueryError("csv rows and columns start at 1")
+
+    def lookup(self, rows):
+        column = self.column
+        if isinstance(column, str):
+            if not rows or column not in rows[0]:
+                return None
+            column = rows[0].index(column)
+            rows = rows[1:]
+        try:
+            row = rows[self.row - 1 if self.row > 0 else self.row]
+            return row[column]
+        except IndexError:
+            return None
+
+    def samples(self, rows, timestamp_column, timestamp_format):
+        names = rows[0] if rows else None
+        column = column_index(self.column, names)
+        timestamp = column_index(timestamp_column, names)
+        if column is None or timestamp is None:
+            return Samples()
+        if isinstance(self.column, str) or isinstance(timestamp_column, str):
+            rows = rows[1:]
+        samples = Samples()
+        for row in rows:
+            try:
+                samples.append(
+                    (parse_timestamp(row[timestamp], timestamp_format), row[column])
+                )
+            except (IndexError, ValueError):
+                continue
+        return samples
+
+
+class JsonQuery:
+    def __init__(self, command):
+        path = command.strip()
+        if path.startswith("$"):
+            path = path[1:]
+        self.keys = []
+        position = 0
+        while position < len(path):
+            match = _JSON_PATH_RE.match(path, position)
+            if match is None:
+                raise QueryError(f"invalid json path {command}")
+            if match.group("index") is not None:
+                self.keys.append(int(match.group("index")))
+            else:
+                key = match.group("name")
+                if key is None:
+                    key = match.group("single")
+                if key is None:
+                    key = match.group("double")
+                self.keys.append(key)
+            position = match.end()
+
+    def lookup(self, data):
+        for key in self.keys:
+            try:
+                if isinstance(key, int) != isinstance(data, list):
+                    return None
+                data = data[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return data
+
+
+class IniQuery:
+    def __init__(self, command):
+        section, _, key = command.strip().rpartition("/")
+        if not key:
+            raise QueryError(f"invalid ini key {command}")
+        self.section = section or configparser.DEFAULTSECT
+        self.key = key
+
+    def lookup(self, parser):
+        try:
+            return parser.get(self.section, self.key)
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            return None
+
+
+class KeyValueQuery:
+    def __init__(self, command):
+        self.key = command.strip()
+
+    def lookup(self, values):
+        return values.get(self.key)
+
+
+class TableQuery:
+    def __init__(self, command):
+        column, _, row = command.partition(":")
+        self.column = parse_column(column)
+        self.every_row = not row.strip()
+        row = row.strip() or "last"
+        if row in TABLE_AGGREGATES:
+            self.row = row
+        else:
+            try:
+                self.row = int(row)
+            except ValueError:
+                raise QueryError(f"invalid table row or aggregate {row}")
+        if self.row == 0 or self.column == -1:
+            raise QueryError("table rows and columns start at 1")
+
+    def lookup(self, table):
+        column = column_index(self.column, table.names)
+        if column is None or column >= table.data.shape[1]:
+            return None
+        values = table.data[:, column]
+        if isinstance(self.row, int):
+            try:
+                value = values[self.row - 1 if self.row > 0 else self.row]
+            except IndexError:
+                return None
+            return None if numpy.isnan(value) else float(value)
+        if self.row == "count":
+            return int(numpy.count_nonzero(~numpy.isnan(values)))
+        values = values[~numpy.isnan(values)]
+        if values.size == 0:
+            return None
+        if self.row == "last":
+            return float(values[-1])
+        if self.row == "first":
+            return float(values[0])
+        return float(getattr(numpy, self.row)(values))
+
+    def samples(self, table, timestamp_column, timestamp_format):
+        column = column_index(self.column, table.names)
+        timestamp = column_index(timestamp_column, table.names)
+        if column is None or timestamp is None or column >= table.data.shape[1]:
+            return Samples()
+        samples = Samples()
+        for text, value in zip(table.text_column(timestamp), table.data[:, column]):
+            if numpy.isnan(value):
+                continue
+            try:
+                samples.append((parse_timestamp(text, timestamp_format), float(value)))
+            except ValueError:
+                continue
+        return samples
+
+
+QUERIES = {
+    "csv": CsvQuery,
+    "json": JsonQuery,
+    "ini": IniQuery,
+    "keyvalue": KeyValueQuery,
+    "table": TableQuery,
+}
+
+
+@lru_cache(maxsize=1024)
+def compile_query(program, command):
+    """
+    Return the query of a FileVariable command in a structured format, None
+    if the program is not a structured format or the command is invalid.
+    """
+    if program not in QUERIES:
+        return None
+    try:
+        return QUERIES[program](command)
+    except QueryError as e:
+        logger.warning(f"{program} cmd ({command}) is invalid : {e}")
+    return None
+
+
+def format_value(value):
+    """
+    return the value found as the text read from the file
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return json.dumps(value)
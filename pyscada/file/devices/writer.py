@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Writing of the local files : the transformed content is streamed to a
+temporary file in the same directory which is then renamed over the file, so
+that readers never see a truncated file and the file is never held in memory.
+
+When the commands only substitute text without changing the length of the
+lines, as for fixed-width records, the changed bytes are patched in place
+instead of rewriting the file.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import subprocess
+import tempfile
+
+from .extractors import Record, State, transform
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _TemporaryFile:
+    """
+    A temporary file next to file_path, renamed over it by commit()
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        directory = os.path.dirname(os.path.abspath(file_path))
+        self.fd, self.path = tempfile.mkstemp(dir=directory, prefix=".pyscada-")
+
+    def commit(self):
+        try:
+            os.chmod(self.path, os.stat(self.file_path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(self.path, self.file_path)
+
+    def discard(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def replace_file(file_path, content):
+    """
+    replace the content of the file atomically
+    """
+    temporary = _TemporaryFile(file_path)
+    try:
+        with os.fdopen(temporary.fd, "w", newline="") as f:
+            f.write(content)
+        temporary.commit()
+    except:
+        temporary.discard()
+        raise
+
+
+def stream_native(file_path, extractors):
+    """
+    replace the file atomically by its transformation by the extractors,
+    streamed line by line
+    """
+    temporary = _TemporaryFile(file_path)
+    try:
+        with open(file_path, "r", newline="") as source:
+            lines = source
+            for extractor in extractors:
+                lines = transform(lines, extractor)
+            with os.fdopen(temporary.fd, "w", newline="") as target:
+                target.writelines(lines)
+        temporary.commit()
+    except:
+        temporary.discard()
+        raise
+
+
+def stream_pipeline(file_path, commands, timeout):
+    """
+    replace the file atomically by its transformation by the pipeline of the
+    (program, command) list, return False if one of them failed
+    """
+    temporary = _TemporaryFile(file_path)
+    processes = []
+    errors = []
+    try:
+        with open(file_path, "rb") as source, os.fdopen(temporary.fd, "wb") as target:
+            stdin = source
+            for index, (program, command) in enumerate(commands):
+                last = index == len(commands) - 1
+                errors.append(tempfile.TemporaryFile())
+                process = subprocess.Popen(
+                    [program, command],
+                    stdin=stdin,
+                    stdout=target if last else subprocess.PIPE,
+                    stderr=errors[-1],
+                )
+                if processes:
+                    # let the previous process receive SIGPIPE if this one exits
+                    processes[-1].stdout.close()
+                stdin = process.stdout
+                processes.append(process)
+            ok = True
+            for process, error, (program, command) in zip(
+                processes, errors, commands
+            ):
+                process.wait(timeout=timeout)
+                error.seek(0)
+                err = error.read().decode()
+                if process.returncode > 0 or err != "":
+                    logger.warning(f"{program} cmd ({command}) return an error : {err}")
+                    ok = False
+        if ok:
+            temporary.commit()
+            return True
+    except subprocess.TimeoutExpired as e:
+        logger.warning(f"{e}")
+    except:
+        temporary.discard()
+        raise
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        for error in errors:
+            error.close()
+    temporary.discard()
+    return False
+
+
+def patch_in_place(file_path, extractors):
+    """
+    apply the substitution extractors to the file, writing the changed lines
+    in place with pwrite. Return False, without changing anything, if a line
+    would change of length.
+    """
+    patches = []
+    with open(file_path, "rb") as f:
+        offset = 0
+        nr = 0
+        previous = None
+        for raw in f:
+            if previous is not None:
+                nr += 1
+                patch = _patch_line(nr, offset, previous, False, extractors)
+                if patch is False:
+                    return False
+                if patch is not None:
+                    patches.append(patch)
+                offset += len(previous)
+            previous = raw
+        if previous is not None:
+            patch = _patch_line(nr + 1, offset, previous, True, extractors)
+            if patch is False:
+                return False
+            if patch is not None:
+                patches.append(patch)
+    if patches:
+        fd = os.open(file_path, os.O_WRONLY)
+        try:
+            for offset, data in patches:
+                os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+    return True
+
+
+def _patch_line(nr, offset, raw, last, extractors):
+    """
+    return the (offset, bytes) patch of a line, None if unchanged, False if
+    its length changes
+    """
+    line = raw.decode()
+    eol = "\n" if line.endswith("\n") else ""
+    text = line[:-1] if eol else line
+    for extractor in extractors:
+        state = State()
+        extractor.feed(state, Record(nr, text, last, eol))
+        output = "".join(state.output)
+        text = output[:-1] if output.endswith("\n") else output
+    data = (text + eol).encode()
+    if data == raw:
+        return None
+    if len(data) != len(raw):
+        return False
+    return offset, data
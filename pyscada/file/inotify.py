@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Minimal Linux inotify wrapper to watch a local file.
+
+The parent directory is watched and the events filtered on the file name, so
+that files replaced by a rename (IN_MOVED_TO) or created again are still
+followed.
+"""
+
+from __future__ import unicode_literals
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from time import time
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+# time without event before a change is reported, in seconds
+DEBOUNCE = 0.1
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _libc.inotify_init1
+    _libc.inotify_add_watch
+    inotify_ok = True
+except (OSError, AttributeError, TypeError):
+    inotify_ok = False
+
+
+class FileWatcher:
+    """
+    Report the changes of a file.
+    """
+
+    def __init__(self, file_path, debounce=DEBOUNCE):
+        self.file_path = os.path.abspath(file_path)
+        self.directory, self.name = os.path.split(self.file_path)
+        self.name = os.fsencode(self.name)
+        self.debounce = debounce
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if (
+            _libc.inotify_add_watch(
+                self.fd, os.fsencode(self.directory), ctypes.c_uint32(WATCH_MASK)
+            )
+            < 0
+        ):
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"cannot watch {self.directory}")
+
+    @classmethod
+    def create(cls, file_path, debounce=DEBOUNCE):
+        """
+        return a watcher of the file, or None if inotify is not available
+        """
+        if not inotify_ok:
+            return None
+        try:
+            return cls(file_path, debounce)
+        except OSError as e:
+            logger.warning(f"Cannot watch {file_path} : {e}")
+        return None
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _read_events(self):
+        """
+        read the pending events, return True if one concerns the file
+        """
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return changed
+            position = 0
+            while position + EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, position)
+                position += EVENT_HEADER.size
+                name = data[position : position + length].rstrip(b"\0")
+                position += length
+                if name == self.name and mask & WATCH_MASK:
+                    changed = True
+
+    def changed(self):
+        """
+        return True if the file changed since the last call, without waiting
+        """
+        return self._read_events()
+
+    def wait(self, timeout):
+        """
+        wait up to timeout seconds for a change of the file, then for the
+        writes to stop for the debounce time.
+        Return True if the file changed.
+        """
+        return bool(wait_for_changes([self], timeout, self.debounce))
+
+
+def wait_for_changes(watchers, timeout, debounce=DEBOUNCE):
+    """
+    wait up to timeout seconds for a change of one of the files, then for the
+    writes to stop for the debounce time.
+    Return the list of the watchers of the files which changed.
+    """
+    deadline = time() + timeout
+    changed = []
+    while True:
+        remaining = deadline - time()
+        if changed:
+            remaining = min(remaining, debounce)
+        if remaining <= 0:
+            return changed
+        readable, _, _ = select.select(watchers, [], [], remaining)
+        if not readable:
+            return changed
+        for watcher in readable:
+            if watcher._read_events() and watcher not in changed:
+                changed.append(watcher)
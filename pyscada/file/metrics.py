@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Timing and counters of the file devices of a process.
+
+The handler times its phases :
+
+ - connect : opening or taking from the pool the ssh or ftp connection,
+ - transfer : downloading the file or the remote ranges and lines,
+ - extract : evaluating the variables, the remote commands included,
+ - write : applying the writes to the file,
+ - upload : sending the written copy back,
+
+each one without the phases nested in it in the same thread, in histograms
+of seconds, and counts the bytes transferred, the processes spawned, the
+ssh commands run, the reads saved by the unchanged file detections, the
+connections opened again, the failed connections, the connections not tried
+to the unreachable hosts and the cycles skipped by the adaptive polling.
+
+The metrics are exported at the end of each cycle of the DAQ processes,
+according to the PYSCADA_FILE dict of the Django settings :
+
+ - "metrics_folder" : a folder where each process writes its metrics in the
+   Prometheus text format, in pyscada_file_<process id>.prom, for the
+   textfile collector of the node exporter,
+ - "metrics_log_interval" : the seconds between the log lines of the
+   metrics of each device, as JSON, 0 to disable.
+"""
+
+from __future__ import unicode_literals
+
+from functools import wraps
+import json
+import os
+import tempfile
+from threading import Lock, local
+from time import perf_counter, time
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+PHASES = ("connect", "transfer", "extract", "write", "upload")
+COUNTERS = (
+    "bytes_transferred",
+    "subprocesses",
+    "ssh_commands",
+    "cache_hits",
+    "reconnects",
+    "connect_failures",
+    "skipped_connects",
+    "skipped_polls",
+)
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+PREFIX = "pyscada_file"
+HELP = {
+    "phase_seconds": "Time spent by the file handler in each phase",
+    "bytes_transferred": "Bytes downloaded, uploaded or read over ssh",
+    "subprocesses": "Local processes spawned",
+    "ssh_commands": "Commands run on the remote host",
+    "cache_hits": "Reads saved by the unchanged file detections",
+    "reconnects": "Connections opened again after the first one",
+    "connect_failures": "Failed connections to the file",
+    "skipped_connects": "Connections not tried, the host being unreachable",
+    "skipped_polls": "Cycles without a read, the adaptive polling waiting",
+}
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class DeviceMetrics:
+    """
+    The histograms and counters of a device
+    """
+
+    def __init__(self, device, host):
+        self.device = device
+        self.host = host
+        self.lock = Lock()
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.connected_once = False
+
+    def observe(self, phase, seconds):
+        with self.lock:
+            self.phases[phase].observe(seconds)
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] += value
+
+    def connection_opened(self):
+        if self.connected_once:
+            self.count("reconnects")
+        self.connected_once = True
+
+    def time(self, phase):
+        return _Timer(self, phase)
+
+    def summary(self):
+        """
+        return the metrics as a dict for the log lines
+        """
+        with self.lock:
+            summary = {"device": self.device, "host": self.host}
+            for phase, histogram in self.phases.items():
+                summary[phase] = {
+                    "count": histogram.count,
+                    "seconds": round(histogram.sum, 6),
+                }
+            summary.update(self.counters)
+        return summary
+
+
+_stack = local()
+
+
+class _Timer:
+    """
+    Time a phase, without the time of the phases nested in it
+    """
+
+    __slots__ = ("metrics", "phase", "start", "nested")
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        if not hasattr(_stack, "timers"):
+            _stack.timers = []
+        _stack.timers.append(self)
+        self.nested = 0.0
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = perf_counter() - self.start
+        _stack.timers.pop()
+        if _stack.timers:
+            _stack.timers[-1].nested += elapsed
+        self.metrics.observe(self.phase, elapsed - self.nested)
+        return False
+
+
+def timed(phase):
+    """
+    decorate a method of a handler to time it as the phase
+    """
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self._metrics.time(phase):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _labels(**labels):
+    return ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels.items()
+    )
+
+
+class Registry:
+    def __init__(self):
+        self.lock = Lock()
+        self.devices = {}
+        self.last_log = time()
+
+    def device(self, pk, name, host):
+        """
+        return the metrics of the device, kept when its handler is created
+        again
+        """
+        with self.lock:
+            metrics = self.devices.get(pk)
+            if metrics is None:
+                metrics = self.devices[pk] = DeviceMetrics(name, host)
+            else:
+                metrics.device = name
+                metrics.host = host
+            return metrics
+
+    def render(self):
+        """
+        return the metrics in the Prometheus text format
+        """
+        with self.lock:
+            devices = list(self.devices.values())
+        lines = [
+            f"# HELP {PREFIX}_phase_seconds {HELP['phase_seconds']}",
+            f"# TYPE {PREFIX}_phase_seconds histogram",
+        ]
+        for metrics in devices:
+            with metrics.lock:
+                for phase, histogram in metrics.phases.items():
+                    labels = _labels(
+                        device=metrics.device, host=metrics.host, phase=phase
+                    )
+                    for bound, count in zip(BUCKETS, histogram.cumulative()):
+                        lines.append(
+                            f'{PREFIX}_phase_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                        )
+                    lines.append(
+                        f'{PREFIX}_phase_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}'
+                    )
+                    lines.append(
+                        f"{PREFIX}_phase_seconds_sum{{{labels}}} {histogram.sum}"
+                    )
+                    lines.append(
+                        f"{PREFIX}_phase_seconds_count{{{labels}}} {histogram.count}"
+                    )
+        for counter in COUNTERS:
+            lines.append(f"# HELP {PREFIX}_{counter}_total {HELP[counter]}")
+            lines.append(f"# TYPE {PREFIX}_{counter}_total counter")
+            for metrics in devices:
+                labels = _labels(device=metrics.device, host=metrics.host)
+                lines.append(
+                    f"{PREFIX}_{counter}_total{{{labels}}} {metrics.counters[counter]}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def export(self, process_id, options):
+        """
+        write the Prometheus text file and the log lines set in the options
+        """
+        folder = options.get("metrics_folder")
+        if folder:
+            try:
+                self.write(os.path.join(folder, f"pyscada_file_{process_id}.prom"))
+            except OSError as e:
+                logger.warning(f"Cannot write the file metrics in {folder} : {e}")
+        interval = options.get("metrics_log_interval", 0)
+        if interval and time() - self.last_log >= interval:
+            self.last_log = time()
+            with self.lock:
+                devices = list(self.devices.values())
+            for metrics in devices:
+                logger.info(f"file metrics {json.dumps(metrics.summary())}")
+
+    def write(self, file_path):
+        """
+        replace the file with the metrics, atomically for the collector
+        """
+        fd, temporary_path = tempfile.mkstemp(
+            dir=os.path.dirname(file_path), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.render())
+            os.chmod(temporary_path, 0o644)
+            os.replace(temporary_path, file_path)
+        except:
+            os.unlink(temporary_path)
+            raise
+
+
+metrics = Registry()
@@ -0,0 +1,20 @@
+# Generated by Django 3.2 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0004_alter_filedevice_host"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="batch_read",
+            field=models.BooleanField(
+                default=False,
+                help_text="Read all the awk variables of the device with a single awk process scanning the file once per cycle. Commands which cannot be merged are read one by one.",
+            ),
+        ),
+    ]
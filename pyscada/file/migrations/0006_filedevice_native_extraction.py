@@ -0,0 +1,20 @@
+# Generated by Django 3.2 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0005_filedevice_batch_read"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="native_extraction",
+            field=models.BooleanField(
+                default=False,
+                help_text="Evaluate the simple awk and sed commands in PyScada instead of running the program.",
+            ),
+        ),
+    ]
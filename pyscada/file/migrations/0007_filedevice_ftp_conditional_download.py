@@ -0,0 +1,20 @@
+# Generated by Django 3.2 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0006_filedevice_native_extraction"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="ftp_conditional_download",
+            field=models.BooleanField(
+                default=False,
+                help_text="Download the file only when its size or modification time changed on the FTP server.",
+            ),
+        ),
+    ]
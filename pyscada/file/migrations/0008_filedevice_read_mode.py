@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0007_filedevice_ftp_conditional_download"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="read_mode",
+            field=models.PositiveSmallIntegerField(
+                choices=[(0, "whole file"), (1, "appended lines only")],
+                default=0,
+                help_text="For append-only files like logs, evaluate the commands only on the lines appended since the last read. The file is read again from the beginning when it is rotated or truncated.",
+            ),
+        ),
+    ]
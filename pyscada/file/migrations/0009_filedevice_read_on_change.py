@@ -0,0 +1,20 @@
+# Generated by Django 3.2 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0008_filedevice_read_mode"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="read_on_change",
+            field=models.BooleanField(
+                default=False,
+                help_text="Watch the local file with inotify and read it only when it changed, as soon as it changed.",
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0009_filedevice_read_on_change"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="skip_unchanged_file",
+            field=models.BooleanField(
+                default=False,
+                help_text="Keep the values of the last read while the modification time, size and inode of the file are unchanged.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="filedevice",
+            name="force_read_cycles",
+            field=models.PositiveSmallIntegerField(
+                default=0,
+                help_text="Read the file anyway after this number of cycles without change. 0 to never force it.",
+            ),
+        ),
+    ]
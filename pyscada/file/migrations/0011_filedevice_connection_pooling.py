@@ -0,0 +1,20 @@
+# Generated by Django 3.2 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0010_filedevice_skip_unchanged_file"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="connection_pooling",
+            field=models.BooleanField(
+                default=False,
+                help_text="Keep the connection open between the reads and writes, shared by the devices using the same host and credentials.",
+            ),
+        ),
+    ]
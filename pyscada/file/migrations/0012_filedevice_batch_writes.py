@@ -0,0 +1,20 @@
+# Generated by Django 3.2 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0011_filedevice_connection_pooling"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="batch_writes",
+            field=models.BooleanField(
+                default=False,
+                help_text="Queue the writes of a cycle and apply them together to one copy of the file, written back once.",
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0012_filedevice_batch_writes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="ssh_transfer_mode",
+            field=models.PositiveSmallIntegerField(
+                choices=[(0, "remote commands"), (1, "sftp download")],
+                default=0,
+                help_text="Run the commands on the remote host, or download the file over SFTP once per cycle to the local temporary file copy path and evaluate the commands locally.",
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0013_filedevice_ssh_transfer_mode"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="ssh_compression",
+            field=models.BooleanField(
+                default=False,
+                help_text="Compress the ssh transport, for slow links.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="filedevice",
+            name="compressed_download",
+            field=models.PositiveSmallIntegerField(
+                choices=[(0, "no"), (1, "gzip (.gz)"), (2, "zstd (.zst)")],
+                default=0,
+                help_text="Download the compressed variant of the remote file, the file path followed by .gz or .zst, and decompress it to the local copy. The variables cannot be written then. zstd needs the zstandard package.",
+            ),
+        ),
+    ]
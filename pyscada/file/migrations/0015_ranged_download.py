@@ -0,0 +1,36 @@
+# Generated by Django 3.2 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0014_filedevice_compression"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="ranged_download",
+            field=models.BooleanField(
+                default=False,
+                help_text="Download only the parts of the remote file the variables need, when all of them have a byte range or address fixed line numbers.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="filevariable",
+            name="range_start",
+            field=models.IntegerField(
+                default=0,
+                help_text="Evaluate the command only on the part of the file starting at this byte, negative to count from the end. The incomplete lines at the bounds of the part are ignored.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="filevariable",
+            name="range_length",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Length in bytes of the part of the file, 0 for up to the end.",
+            ),
+        ),
+    ]
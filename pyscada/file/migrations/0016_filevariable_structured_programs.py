@@ -0,0 +1,38 @@
+# Generated by Django 3.2 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0015_ranged_download"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="filevariable",
+            name="program",
+            field=models.CharField(
+                choices=[
+                    ("awk", "awk"),
+                    ("sed", "sed"),
+                    ("csv", "csv"),
+                    ("json", "json"),
+                    ("ini", "ini"),
+                    ("keyvalue", "key=value"),
+                ],
+                default="awk",
+                max_length=25,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="filevariable",
+            name="command",
+            field=models.CharField(
+                blank=True,
+                default="NR==1{ print; exit }",
+                help_text="Look at https://www.gnu.org/software/gawk/manual/gawk.html<br> To write, use $value$ where the variable value should be placed.<br> csv : column number or name, optionally followed by :row, 1 for the first data row, -1 for the last by default.<br> json : path like $.key.list[0].<br> ini : section/key.<br> key=value : the key.",
+                max_length=500,
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2 on 2026-10-18 22:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0017_filevariable_table_program"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="timestamp_column",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Number or name of the timestamp column of csv and numeric table files. If set, the csv and numeric table variables without a row return all the new rows as values with their timestamp.",
+                max_length=50,
+            ),
+        ),
+        migrations.AddField(
+            model_name="filedevice",
+            name="timestamp_format",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="strptime format of the timestamps, for example %Y-%m-%d %H:%M:%S. If empty, seconds since the epoch or ISO 8601.",
+                max_length=50,
+            ),
+        ),
+    ]
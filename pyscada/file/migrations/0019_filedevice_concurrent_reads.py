@@ -0,0 +1,20 @@
+# Generated by Django 3.2 on 2026-10-18 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0018_filedevice_timestamp_column"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="concurrent_reads",
+            field=models.BooleanField(
+                default=False,
+                help_text="Run the remote commands of the variables and the downloads from an asyncio loop, at the same time and each one within the timeout.",
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0019_filedevice_concurrent_reads"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="filedevice",
+            name="adaptive_polling",
+            field=models.BooleanField(
+                default=False,
+                help_text="Poll the file more often when it changes often and less often when it does not, from the modification times seen, between the minimum and maximum polling intervals.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="filedevice",
+            name="min_polling_interval",
+            field=models.FloatField(
+                default=1.0, help_text="in seconds, for the adaptive polling"
+            ),
+        ),
+        migrations.AddField(
+            model_name="filedevice",
+            name="max_polling_interval",
+            field=models.FloatField(
+                default=300.0, help_text="in seconds, for the adaptive polling"
+            ),
+        ),
+    ]
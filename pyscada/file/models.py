@@ -25,18 +25,131 @@ class FileDevice(models.Model):
         default="", blank=True, help_text="For example : /dir/file.txt", max_length=100
     )
     timeout = models.PositiveSmallIntegerField(default=5, help_text="in seconds")
+    skip_unchanged_file = models.BooleanField(
+        default=False,
+        help_text="Keep the values of the last read while the modification time, "
+        "size and inode of the file are unchanged.",
+    )
+    force_read_cycles = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="Read the file anyway after this number of cycles without "
+        "change. 0 to never force it.",
+    )
+    adaptive_polling = models.BooleanField(
+        default=False,
+        help_text="Poll the file more often when it changes often and less often "
+        "when it does not, from the modification times seen, between the minimum "
+        "and maximum polling intervals.",
+    )
+    min_polling_interval = models.FloatField(
+        default=1.0, help_text="in seconds, for the adaptive polling"
+    )
+    max_polling_interval = models.FloatField(
+        default=300.0, help_text="in seconds, for the adaptive polling"
+    )
+    batch_writes = models.BooleanField(
+        default=False,
+        help_text="Queue the writes of a cycle and apply them together to one copy "
+        "of the file, written back once. The writes are reported done when "
+        "queued, and their tasks marked as failed if the write fails.",
+    )
+    read_on_change = models.BooleanField(
+        default=False,
+        help_text="Watch the local file with inotify and read it only when it "
+        "changed, as soon as it changed.",
+    )
+    read_mode_choices = ((0, "whole file"), (1, "appended lines only"))
+    read_mode = models.PositiveSmallIntegerField(
+        default=0,
+        choices=read_mode_choices,
+        help_text="For append-only files like logs, evaluate the commands only "
+        "on the lines appended since the last read. The file is read again from "
+        "the beginning when it is rotated or truncated.",
+    )
+    timestamp_column = models.CharField(
+        default="",
+        blank=True,
+        max_length=50,
+        help_text="Number or name of the timestamp column of csv and numeric table "
+        "files. If set, the csv and numeric table variables without a row return "
+        "all the new rows as values with their timestamp.",
+    )
+    timestamp_format = models.CharField(
+        default="",
+        blank=True,
+        max_length=50,
+        help_text="strptime format of the timestamps, for example %Y-%m-%d %H:%M:%S. "
+        "If empty, seconds since the epoch or ISO 8601.",
+    )
+    batch_read = models.BooleanField(
+        default=False,
+        help_text="Read all the awk variables of the device with a single awk process "
+        "scanning the file once per cycle. Commands which cannot be merged are read "
+        "one by one.",
+    )
+    native_extraction = models.BooleanField(
+        default=False,
+        help_text="Evaluate the simple awk and sed commands in PyScada instead of "
+        "running the program.",
+    )
 
     # SSH and FTP
     host = models.CharField(default="test.com", max_length=200)
     port = models.PositiveSmallIntegerField(default=21)
     username = models.CharField(default="", blank=True, max_length=50)
     password = models.CharField(default="", blank=True, max_length=50)
+    connection_pooling = models.BooleanField(
+        default=False,
+        help_text="Keep the connection open between the reads and writes, shared "
+        "by the devices using the same host and credentials.",
+    )
+
+    concurrent_reads = models.BooleanField(
+        default=False,
+        help_text="Run the remote commands of the variables and the downloads from "
+        "an asyncio loop, at the same time and each one within the timeout.",
+    )
+
+    # SSH
+    ssh_transfer_mode_choices = ((0, "remote commands"), (1, "sftp download"))
+    ssh_transfer_mode = models.PositiveSmallIntegerField(
+        default=0,
+        choices=ssh_transfer_mode_choices,
+        help_text="Run the commands on the remote host, or download the file over "
+        "SFTP once per cycle to the local temporary file copy path and evaluate "
+        "the commands locally.",
+    )
+
+    ssh_compression = models.BooleanField(
+        default=False,
+        help_text="Compress the ssh transport, for slow links.",
+    )
+
+    # SSH and FTP downloads
+    compressed_download_choices = ((0, "no"), (1, "gzip (.gz)"), (2, "zstd (.zst)"))
+    compressed_download = models.PositiveSmallIntegerField(
+        default=0,
+        choices=compressed_download_choices,
+        help_text="Download the compressed variant of the remote file, the file path "
+        "followed by .gz or .zst, and decompress it to the local copy. The "
+        "variables cannot be written then. zstd needs the zstandard package.",
+    )
+    ranged_download = models.BooleanField(
+        default=False,
+        help_text="Download only the parts of the remote file the variables need, "
+        "when all of them have a byte range or address fixed line numbers.",
+    )
 
     # FTP
     ftp_passive_mode = models.BooleanField(default=True)
     local_temporary_file_copy_path = models.CharField(
         default="", blank=True, help_text="For example : /tmp/file.txt", max_length=100
     )
+    ftp_conditional_download = models.BooleanField(
+        default=False,
+        help_text="Download the file only when its size or modification time "
+        "changed on the FTP server.",
+    )
 
     protocol_id = PROTOCOL_ID
 
@@ -45,11 +158,13 @@ class FileDevice(models.Model):
             super().add_fields(form, index)
             form.fields["protocol"].widget.attrs = {
                 # all hidden by default
-                "--hideshow-fields": "host, port, username, password, ftp_passive_mode, local_temporary_file_copy_path",
-                # host, port, username, password visible when "1" (ssh) is selected
-                "--show-on-1": "host, port, username, password",
-                # host, port, username, password, ftp_passive_mode, local_temporary_file_copy_path visible when "2" (ftp) is selected
-                "--show-on-2": "host, port, username, password, ftp_passive_mode, local_temporary_file_copy_path",
+                "--hideshow-fields": "read_on_change, host, port, username, password, connection_pooling, concurrent_reads, ssh_transfer_mode, ssh_compression, compressed_download, ranged_download, ftp_passive_mode, local_temporary_file_copy_path, ftp_conditional_download",
+                # read_on_change visible when "0" (local) is selected
+                "--show-on-0": "read_on_change",
+                # host, port, username, password, connection_pooling, concurrent_reads, ssh_transfer_mode, ssh_compression, compressed_download, ranged_download, local_temporary_file_copy_path visible when "1" (ssh) is selected
+                "--show-on-1": "host, port, username, password, connection_pooling, concurrent_reads, ssh_transfer_mode, ssh_compression, compressed_download, ranged_download, local_temporary_file_copy_path",
+                # host, port, username, password, connection_pooling, concurrent_reads, compressed_download, ranged_download, ftp_passive_mode, local_temporary_file_copy_path, ftp_conditional_download visible when "2" (ftp) is selected
+                "--show-on-2": "host, port, username, password, connection_pooling, concurrent_reads, compressed_download, ranged_download, ftp_passive_mode, local_temporary_file_copy_path, ftp_conditional_download",
             }
 
     def parent_device(self):
@@ -69,6 +184,11 @@ class FileVariable(models.Model):
     program_choices = (
         ("awk", "awk"),
         ("sed", "sed"),
+        ("csv", "csv"),
+        ("json", "json"),
+        ("ini", "ini"),
+        ("keyvalue", "key=value"),
+        ("table", "numeric table"),
     )
     program = models.CharField(default="awk", choices=program_choices, max_length=25)
     command = models.CharField(
@@ -76,7 +196,25 @@ class FileVariable(models.Model):
         blank=True,
         max_length=500,
         help_text="Look at https://www.gnu.org/software/gawk/manual/gawk.html"
-        "<br> To write, use $value$ where the variable value should be placed.",
+        "<br> To write, use $value$ where the variable value should be placed."
+        "<br> csv : column number or name, optionally followed by :row, 1 for the "
+        "first data row, -1 for the last by default."
+        "<br> json : path like $.key.list[0]."
+        "<br> ini : section/key."
+        "<br> key=value : the key."
+        "<br> numeric table : column number or name, optionally followed by :row "
+        "or by :last, :first, :mean, :min, :max, :sum or :count over the rows, or "
+        "the appended rows in appended lines mode. Needs numpy.",
+    )
+    range_start = models.IntegerField(
+        default=0,
+        help_text="Evaluate the command only on the part of the file starting at "
+        "this byte, negative to count from the end. The incomplete lines at the "
+        "bounds of the part are ignored.",
+    )
+    range_length = models.PositiveIntegerField(
+        default=0,
+        help_text="Length in bytes of the part of the file, 0 for up to the end.",
     )
 
     protocol_id = PROTOCOL_ID
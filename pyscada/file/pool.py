@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of the ssh and ftp connections of the file devices of a process.
+
+The connections are kept open between the cycles and shared by the devices
+using the same host and credentials, so that the TCP and SSH/FTP handshakes
+happen once instead of at each read and write.
+
+ - ssh clients are shared : paramiko multiplexes the channels of the devices
+   on one transport,
+ - ftp hosts are used by one device at a time and put back when released.
+
+Connections are checked before being handed out and closed after IDLE_TIMEOUT
+seconds without use.
+"""
+
+from __future__ import unicode_literals
+
+from threading import Lock
+from time import time
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# seconds without use after which a connection is closed
+IDLE_TIMEOUT = 300
+# interval of the ssh keepalive packets, in seconds
+KEEPALIVE = 30
+
+
+class PooledConnection:
+    __slots__ = ("connection", "users", "last_used")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.users = 0
+        self.last_used = time()
+
+
+class ConnectionPool:
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.lock = Lock()
+        self.shared = {}
+        self.idle = {}
+
+    def acquire(self, key, factory, check, shared=False):
+        """
+        return a connection for the key, checked with check(connection) which
+        must raise or return False if the connection is broken, or a new one
+        created by factory()
+        """
+        self.evict()
+        while True:
+            with self.lock:
+                if shared:
+                    entry = self.shared.get(key)
+                elif self.idle.get(key):
+                    entry = self.idle[key].pop()
+                else:
+                    entry = None
+                if entry is not None:
+                    entry.users += 1
+            if entry is None:
+                break
+            try:
+                alive = check(entry.connection)
+            except Exception as e:
+                logger.debug(f"Pooled connection to {key[1]} is broken : {e}")
+                alive = False
+            if alive:
+                return entry.connection
+            self.discard(key, entry.connection)
+
+        entry = PooledConnection(factory())
+        entry.users = 1
+        if shared:
+            with self.lock:
+                current = self.shared.get(key)
+                if current is not None:
+                    # another device connected meanwhile
+                    current.users += 1
+                    _close(entry.connection)
+                    return current.connection
+                self.shared[key] = entry
+        return entry.connection
+
+    def release(self, key, connection, shared=False):
+        """
+        give back a connection, it stays open for the next acquire
+        """
+        with self.lock:
+            if not shared:
+                self.idle.setdefault(key, []).append(PooledConnection(connection))
+                return
+            entry = self.shared.get(key)
+            if entry is not None and entry.connection is connection:
+                entry.users = max(0, entry.users - 1)
+                entry.last_used = time()
+                return
+        # the connection was discarded while in use
+        _close(connection)
+
+    def discard(self, key, connection):
+        """
+        close a broken connection and remove it from the pool
+        """
+        with self.lock:
+            entry = self.shared.get(key)
+            if entry is not None and entry.connection is connection:
+                del self.shared[key]
+            self.idle[key] = [
+                e for e in self.idle.get(key, []) if e.connection is not connection
+            ]
+        _close(connection)
+
+    def evict(self):
+        """
+        close the connections unused for more than idle_timeout seconds
+        """
+        limit = time() - self.idle_timeout
+        expired = []
+        with self.lock:
+            for key, entry in list(self.shared.items()):
+                if entry.users == 0 and entry.last_used < limit:
+                    expired.append(entry.connection)
+                    del self.shared[key]
+            for key, entries in self.idle.items():
+                expired.extend(e.connection for e in entries if e.last_used < limit)
+                entries[:] = [e for e in entries if e.last_used >= limit]
+        for connection in expired:
+            _close(connection)
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception as e:
+        logger.debug(f"Closing pooled connection failed : {e}")
+
+
+pool = ConnectionPool()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive polling interval of the file devices.
+
+The modification times of the file seen by the polls are kept, and the
+interval is half of the median time between its last changes, so that a
+change is read within half of its period. It grows by BACKOFF at each poll
+finding the file unchanged, and comes back from the history at the next
+change, always between the minimum and maximum intervals of the device.
+When the modification time is unknown the device is polled at the minimum
+interval.
+"""
+
+from __future__ import unicode_literals
+
+from collections import deque
+import statistics
+
+# modification times kept for the period of the changes
+HISTORY = 8
+# growth of the interval at each poll finding the file unchanged
+BACKOFF = 1.5
+# part of the interval a poll may come early, the process loop running at
+# its own pace
+DUE_MARGIN = 0.1
+
+
+class AdaptiveInterval:
+    def __init__(self, minimum, maximum):
+        self.minimum = 0.0
+        self.maximum = 0.0
+        self.set_bounds(minimum, maximum)
+        self.interval = self.minimum
+        self.changes = deque(maxlen=HISTORY)
+        self.next_poll = 0.0
+
+    def set_bounds(self, minimum, maximum):
+        self.minimum = max(0.0, minimum)
+        self.maximum = max(self.minimum, maximum)
+
+    def due(self, now):
+        """
+        tell if the device has to be polled
+        """
+        return now >= self.next_poll - self.interval * DUE_MARGIN
+
+    def update(self, mtime, now):
+        """
+        set the next poll from the modification time seen by a poll, None if
+        unknown, return the interval
+        """
+        if mtime is None:
+            interval = self.minimum
+        elif not self.changes or mtime != self.changes[-1]:
+            self.changes.append(mtime)
+            interval = self.interval
+            if len(self.changes) > 1:
+                changes = list(self.changes)
+                interval = (
+                    statistics.median(
+                        abs(b - a) for a, b in zip(changes, changes[1:])
+                    )
+                    / 2
+                )
+        else:
+            interval = self.interval * BACKOFF
+        self.interval = min(self.maximum, max(self.minimum, interval))
+        self.next_poll = now + self.interval
+        return self.interval
+
+    def retry(self, now):
+        """
+        set the next poll after a failed one, at the same interval
+        """
+        self.next_poll = now + self.interval
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+The merge of the awk commands of several variables into a single program.
+"""
+
+from __future__ import unicode_literals
+
+import shutil
+import subprocess
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+
+from pyscada.file.devices.awk import (
+    RECORD_SEPARATOR,
+    VALUE_SEPARATOR,
+    AwkBatch,
+    AwkSyntaxError,
+    compile_block,
+    split_rules,
+    tokenize,
+)
+
+TEXT = (
+    "temp 21.5 C\n"
+    "hum 40 %\n"
+    "temp 22 C\n"
+    "status ok\n"
+    "count 007\n"
+)
+
+COMMANDS = [
+    ("second", "NR==2{print $2}"),
+    ("temp", "/temp/{print $2}"),
+    ("first", "/temp/{print $2; exit}"),
+    ("hum", '$1=="hum"{print $2; next} {print "x"}'),
+    ("sum", "{s += $2; print s}"),
+    ("sub", '{sub(/t/, "T"); print $1}'),
+    ("line", "NR==3"),
+    ("fields", "{print NF}"),
+]
+
+
+def run_awk(program, text=TEXT):
+    return subprocess.run(
+        ["awk", program], input=text, capture_output=True, text=True, check=True
+    ).stdout
+
+
+class AwkBatchTest(SimpleTestCase):
+    def test_tagging(self):
+        batch = AwkBatch(COMMANDS[:2])
+        self.assertEqual(batch.keys, ["second", "temp"])
+        for index in range(2):
+            self.assertIn(
+                f'ORS = "{VALUE_SEPARATOR}{index}{RECORD_SEPARATOR}"', batch.program
+            )
+
+    def test_split_output(self):
+        batch = AwkBatch([("a", "{print}"), ("b", "{print}")])
+        output = (
+            f"1{VALUE_SEPARATOR}0{RECORD_SEPARATOR}"
+            f"2{VALUE_SEPARATOR}1{RECORD_SEPARATOR}"
+            f"3{VALUE_SEPARATOR}0{RECORD_SEPARATOR}"
+        )
+        self.assertEqual(batch.split_output(output), {"a": "1\n3\n", "b": "2\n"})
+        self.assertEqual(batch.split_output(""), {"a": "", "b": ""})
+
+    def test_split_unexpected_output(self):
+        batch = AwkBatch([("a", "{print}")])
+        output = (
+            f"1{VALUE_SEPARATOR}0{RECORD_SEPARATOR}"
+            f"2{VALUE_SEPARATOR}5{RECORD_SEPARATOR}"
+            f"garbage{RECORD_SEPARATOR}"
+        )
+        with self.assertLogs("pyscada.file.devices.awk", "WARNING"):
+            self.assertEqual(batch.split_output(output), {"a": "1\n"})
+
+    def test_rejected(self):
+        batch = AwkBatch(
+            [
+                ("end", "{v=$2} END{print v}"),
+                ("begin", 'BEGIN{FS=","} {print $2}'),
+                ("printf", '{printf "%s", $2}'),
+                ("getline", "{getline; print}"),
+                ("redirect", '{print $2 > "/tmp/out"}'),
+                ("range", "/temp/,/hum/"),
+                ("fs", '{FS=","; print $2}'),
+                ("exit", "{exit 1}"),
+                ("loop", "{for (i = 1; i <= NF; i++) if ($i == 1) next}"),
+                ("second", "NR==2{print $2}"),
+            ]
+        )
+        self.assertEqual(batch.keys, ["second"])
+        self.assertEqual(
+            batch.rejected,
+            [
+                "end",
+                "begin",
+                "printf",
+                "getline",
+                "redirect",
+                "range",
+                "fs",
+                "exit",
+                "loop",
+            ],
+        )
+
+    def test_all_rejected(self):
+        batch = AwkBatch([("end", "END{print NR}")])
+        self.assertIsNone(batch.program)
+        self.assertEqual(batch.keys, [])
+        self.assertEqual(batch.rejected, ["end"])
+
+    @skipUnless(shutil.which("awk"), "needs awk")
+    def test_same_output(self):
+        batch = AwkBatch(COMMANDS)
+        self.assertEqual(batch.rejected, [])
+        values = batch.split_output(run_awk(batch.program))
+        for key, command in COMMANDS:
+            with self.subTest(command=command):
+                self.assertEqual(values[key], run_awk(command))
+
+    @skipUnless(shutil.which("awk"), "needs awk")
+    def test_all_exited(self):
+        commands = [("a", "NR==1{print; exit}"), ("b", "NR==2{print; exit}")]
+        batch = AwkBatch(commands)
+        # the program stops after the last line any command needs
+        self.assertEqual(
+            batch.split_output(run_awk(batch.program, TEXT + "tail\n" * 3)),
+            {"a": "temp 21.5 C\n", "b": "hum 40 %\n"},
+        )
+
+
+class AwkParserTest(SimpleTestCase):
+    def test_tokenize(self):
+        program = '$1 ~ /a\\/b/ { print $2 / 2 } # note\n'
+        tokens = tokenize(program)
+        self.assertEqual("".join(t.text for t in tokens), program)
+        self.assertEqual([t.text for t in tokens if t.kind == "re"], ["/a\\/b/"])
+        self.assertEqual(tokens[-2].kind, "comment")
+
+    def test_tokenize_errors(self):
+        with self.assertRaises(AwkSyntaxError):
+            tokenize("/temp{print}")
+
+    def test_split_rules(self):
+        rules = split_rules(tokenize("NR==1; /a/{print $2}\n{print}"))
+        self.assertEqual(len(rules), 3)
+        self.assertIsNone(rules[0][1])
+        self.assertEqual("".join(t.text for t in rules[1][0]), " /a/")
+        self.assertEqual("".join(t.text for t in rules[2][1]), "print")
+        with self.assertRaises(AwkSyntaxError):
+            split_rules(tokenize("{print"))
+
+    def test_compile_block(self):
+        block, modifies = compile_block("{v = NR; print v}", 3)
+        self.assertIn("__v3_v", block)
+        self.assertIn("if (__d[3]) break", block)
+        self.assertFalse(modifies)
+        self.assertTrue(compile_block("{$1 = 2; print}", 0)[1])
+        self.assertTrue(compile_block("{gsub(/a/, 1); print}", 0)[1])
+        with self.assertRaises(AwkSyntaxError):
+            compile_block("{print f($1)}", 0)
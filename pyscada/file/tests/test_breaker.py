@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+The circuit breakers of the remote servers.
+"""
+
+from __future__ import unicode_literals
+
+from django.test import SimpleTestCase
+
+from pyscada.file.breaker import (
+    BASE_DELAY,
+    FAILURES,
+    JITTER,
+    MAX_DELAY,
+    Breakers,
+    HostUnreachable,
+    server_name,
+)
+
+SERVER = ("ssh", "host", 22)
+
+
+def unreachable(error):
+    return isinstance(error, OSError)
+
+
+class BreakersTest(SimpleTestCase):
+    def setUp(self):
+        self.breakers = Breakers()
+
+    def open(self, server=SERVER):
+        with self.assertLogs("pyscada.file.breaker", "WARNING"):
+            for _ in range(FAILURES):
+                self.breakers.failure(server)
+
+    def expire(self, server=SERVER):
+        self.breakers.servers[server].open_until = 0.0
+
+    def test_server_name(self):
+        self.assertEqual(server_name(SERVER), "ssh server host:22")
+
+    def test_closed(self):
+        for _ in range(FAILURES - 1):
+            self.breakers.failure(SERVER)
+        self.assertTrue(self.breakers.allow(SERVER))
+        self.assertEqual(self.breakers.retry_in(SERVER), 0.0)
+
+    def test_open(self):
+        self.open()
+        self.assertFalse(self.breakers.allow(SERVER))
+        retry_in = self.breakers.retry_in(SERVER)
+        self.assertGreater(retry_in, BASE_DELAY * (1 - JITTER) - 1)
+        self.assertLessEqual(retry_in, BASE_DELAY)
+        # the other protocols and ports of the host are not affected
+        self.assertTrue(self.breakers.allow(("ftp", "host", 21)))
+        self.assertTrue(self.breakers.allow(("ssh", "host", 2222)))
+
+    def test_single_probe(self):
+        self.open()
+        self.expire()
+        self.assertTrue(self.breakers.allow(SERVER))
+        self.assertFalse(self.breakers.allow(SERVER))
+        with self.assertLogs("pyscada.file.breaker", "INFO"):
+            self.breakers.success(SERVER)
+        self.assertTrue(self.breakers.allow(SERVER))
+        self.assertNotIn(SERVER, self.breakers.servers)
+
+    def test_backoff(self):
+        self.open()
+        delays = [self.breakers.servers[SERVER].delay]
+        for _ in range(8):
+            self.expire()
+            self.assertTrue(self.breakers.allow(SERVER))
+            with self.assertLogs("pyscada.file.breaker", "WARNING"):
+                self.breakers.failure(SERVER)
+            delays.append(self.breakers.servers[SERVER].delay)
+        self.assertEqual(delays[:3], [BASE_DELAY, BASE_DELAY * 2, BASE_DELAY * 4])
+        self.assertEqual(delays[-1], MAX_DELAY)
+
+    def test_connect(self):
+        self.assertEqual(self.breakers.connect(SERVER, lambda: "c", unreachable), "c")
+
+        def refused():
+            raise ConnectionRefusedError("refused")
+
+        for _ in range(FAILURES - 1):
+            with self.assertRaises(ConnectionRefusedError):
+                self.breakers.connect(SERVER, refused, unreachable)
+        with self.assertLogs("pyscada.file.breaker", "WARNING"):
+            with self.assertRaises(ConnectionRefusedError):
+                self.breakers.connect(SERVER, refused, unreachable)
+        with self.assertRaises(HostUnreachable):
+            self.breakers.connect(SERVER, lambda: "c", unreachable)
+
+    def test_server_answered(self):
+        def authentication_failed():
+            raise ValueError("authentication failed")
+
+        self.breakers.failure(SERVER)
+        with self.assertRaises(ValueError):
+            self.breakers.connect(SERVER, authentication_failed, unreachable)
+        # an error of a server which answered closes the breaker
+        self.assertNotIn(SERVER, self.breakers.servers)
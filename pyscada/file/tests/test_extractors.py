@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+The in-process evaluation of the awk and sed commands against the programs.
+"""
+
+from __future__ import unicode_literals
+
+import shutil
+import subprocess
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+
+from pyscada.file.devices.extractors import (
+    compile_extractor,
+    extract,
+    is_substitution,
+    transform,
+)
+
+TEXT = (
+    "# sensors\n"
+    "temp 21.5 C\n"
+    "hum 40 %\n"
+    "temp 22 C\n"
+    "status ok\n"
+    "\n"
+    "pressure 1013.25 hPa\n"
+    "count 007\n"
+    "id abc123 x\n"
+)
+
+AWK_COMMANDS = [
+    "NR==2{print $2}",
+    "NR==1",
+    "NR==3{print}",
+    "/temp/{print $2}",
+    '$1=="hum"{print $2; exit}',
+    "$2>21{print $1}",
+    "$2==7{print $1}",
+    '$2<="abc"{print NR}',
+    "$1 ~ /^te/{print NR, $2}",
+    "$1 ~ /^(hum|id)$/{print $2}",
+    "!/temp/",
+    "NF==3{print $NF}",
+    "{print NF}",
+    '$1!="temp"{print $1; next} {print "t"}',
+    "/^[[:alpha:]]+ [[:digit:]]+ /",
+    "/[0-9]+\\.[0-9]+/{print $1}",
+]
+
+SED_COMMANDS = [
+    "3q",
+    "5!d",
+    "5q;d",
+    "$!d",
+    "/temp/d",
+    "/status/q",
+    "#n\n2p",
+    "#n\n/hum/p",
+    "s/temp/T/",
+    "s/[0-9]/#/g",
+    "s/x*/-/g",
+    "s/b*/[&]/g",
+    "s/\\(.*\\) \\(.*\\) .*/\\2 \\1/",
+    "2!s/ /_/g",
+    "s/^/> /",
+    "s/$/;/",
+    "s|o|0|gp",
+    "#n\ns/ok/OK/p",
+    "s/t/\\n/",
+]
+
+
+@skipUnless(shutil.which("awk") and shutil.which("sed"), "needs awk and sed")
+class NativeExtractionTest(SimpleTestCase):
+    def assertSameOutput(self, program, command):
+        extractor = compile_extractor(program, command)
+        self.assertIsNotNone(extractor, command)
+        # with and without the new line at the end of the file
+        for text in (TEXT, TEXT[:-1]):
+            expected = subprocess.run(
+                [program, command],
+                input=text,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            self.assertEqual(
+                extract(text.splitlines(True), {0: extractor})[0], expected
+            )
+
+    def test_awk(self):
+        for command in AWK_COMMANDS:
+            with self.subTest(command=command):
+                self.assertSameOutput("awk", command)
+
+    def test_sed(self):
+        for command in SED_COMMANDS:
+            with self.subTest(command=command):
+                self.assertSameOutput("sed", command)
+
+
+class CompileExtractorTest(SimpleTestCase):
+    def test_unsupported(self):
+        for program, command in (
+            ("awk", "{v=$2} END{print v}"),
+            ("awk", 'BEGIN{FS=","} {print $2}'),
+            ("awk", "$1==x{print $2}"),
+            ("awk", "/temp/ || /hum/"),
+            ("sed", "s/a/b/3"),
+            ("sed", "1,3d"),
+            ("sed", "y/ab/cd/"),
+            ("csv", "temp"),
+        ):
+            with self.subTest(program=program, command=command):
+                self.assertIsNone(compile_extractor(program, command))
+
+    def test_lines(self):
+        self.assertEqual(compile_extractor("sed", "7!d").lines, {7})
+        self.assertEqual(compile_extractor("sed", "5q;d").lines, {5})
+        self.assertEqual(compile_extractor("awk", "NR==7{print $2}").lines, {7})
+        self.assertIsNone(compile_extractor("awk", "/temp/{print $2}").lines)
+        self.assertIsNone(compile_extractor("sed", "s/a/b/").lines)
+
+    def test_substitution(self):
+        self.assertTrue(is_substitution(compile_extractor("sed", "s/a/b/;s/c/d/g")))
+        self.assertFalse(is_substitution(compile_extractor("sed", "s/a/b/p")))
+        self.assertFalse(is_substitution(compile_extractor("sed", "2d")))
+        self.assertFalse(is_substitution(compile_extractor("awk", "{print}")))
+
+    def test_transform(self):
+        extractor = compile_extractor("sed", "s/temp/T/;3q")
+        self.assertEqual(
+            list(transform(TEXT.splitlines(True), extractor)),
+            ["# sensors\n", "T 21.5 C\n", "hum 40 %\n"],
+        )
+
+    def test_several_extractors(self):
+        output = extract(
+            TEXT.splitlines(True),
+            {
+                "first": compile_extractor("awk", "/temp/{print $2; exit}"),
+                "count": compile_extractor("awk", '$1=="count"{print $2}'),
+            },
+        )
+        self.assertEqual(output, {"first": "21.5\n", "count": "007\n"})
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+The line-offset index of the local files.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from pyscada.file.devices.lineindex import LineIndex
+
+
+class LineIndexTest(SimpleTestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.file_path)
+
+    def write(self, text):
+        with open(self.file_path, "w") as f:
+            f.write(text)
+
+    def records(self, index, lines):
+        return [(r.nr, r.line, r.last, r.eol) for r in index.records(lines)]
+
+    def test_records(self):
+        self.write("a 1\nb 2\nc 3\n")
+        index = LineIndex(self.file_path)
+        self.assertEqual(
+            self.records(index, {3, 1}),
+            [(1, "a 1", False, "\n"), (3, "c 3", True, "\n")],
+        )
+
+    def test_partial_index(self):
+        self.write("a\nb\nc\nd\n")
+        index = LineIndex(self.file_path)
+        self.assertEqual(self.records(index, {2}), [(2, "b", False, "\n")])
+        # only the lines up to the highest line number are indexed
+        self.assertEqual(index.offsets, [0, 2, 4])
+        self.assertFalse(index.complete)
+
+    def test_out_of_range(self):
+        self.write("a\nb\n")
+        index = LineIndex(self.file_path)
+        self.assertEqual(
+            self.records(index, {0, 2, 5}),
+            [(2, "b", True, "\n")],
+        )
+        self.assertTrue(index.complete)
+
+    def test_no_new_line_at_end(self):
+        self.write("a\nb")
+        index = LineIndex(self.file_path)
+        self.assertEqual(
+            self.records(index, {1, 2}),
+            [(1, "a", False, "\n"), (2, "b", True, "")],
+        )
+
+    def test_empty_file(self):
+        self.write("")
+        index = LineIndex(self.file_path)
+        self.assertEqual(index.records({1}), [])
+        self.assertTrue(index.complete)
+
+    def test_changed_file(self):
+        self.write("a\nb\n")
+        index = LineIndex(self.file_path)
+        self.assertEqual(self.records(index, {2}), [(2, "b", True, "\n")])
+        self.write("a\nlonger line\nc\n")
+        os.utime(self.file_path, ns=(0, 10**9))
+        self.assertEqual(
+            self.records(index, {2}), [(2, "longer line", False, "\n")]
+        )
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+The pool of the ssh and ftp connections.
+"""
+
+from __future__ import unicode_literals
+
+from django.test import SimpleTestCase
+
+from pyscada.file.pool import ConnectionPool
+
+KEY = ("ftp", "host", 21, "user")
+
+
+class Connection:
+    count = 0
+
+    def __init__(self, alive=True):
+        Connection.count += 1
+        self.alive = alive
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def check(connection):
+    return connection.alive
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def setUp(self):
+        self.pool = ConnectionPool()
+        Connection.count = 0
+
+    def test_reuse(self):
+        connection = self.pool.acquire(KEY, Connection, check)
+        self.pool.release(KEY, connection)
+        self.assertIs(self.pool.acquire(KEY, Connection, check), connection)
+        self.assertEqual(Connection.count, 1)
+
+    def test_exclusive(self):
+        first = self.pool.acquire(KEY, Connection, check)
+        second = self.pool.acquire(KEY, Connection, check)
+        # an ftp connection in use is not handed out twice
+        self.assertIsNot(first, second)
+        self.pool.release(KEY, first)
+        self.pool.release(KEY, second)
+        self.assertEqual(len(self.pool.idle[KEY]), 2)
+
+    def test_shared(self):
+        first = self.pool.acquire(KEY, Connection, check, shared=True)
+        second = self.pool.acquire(KEY, Connection, check, shared=True)
+        self.assertIs(first, second)
+        self.assertEqual(self.pool.shared[KEY].users, 2)
+        self.pool.release(KEY, first, shared=True)
+        self.pool.release(KEY, second, shared=True)
+        self.assertEqual(self.pool.shared[KEY].users, 0)
+        self.assertFalse(first.closed)
+
+    def test_broken(self):
+        connection = self.pool.acquire(KEY, Connection, check)
+        connection.alive = False
+        self.pool.release(KEY, connection)
+        new = self.pool.acquire(KEY, Connection, check)
+        self.assertIsNot(new, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(self.pool.idle[KEY], [])
+
+    def test_check_raises(self):
+        def failing_check(connection):
+            raise OSError("connection reset")
+
+        connection = self.pool.acquire(KEY, Connection, check, shared=True)
+        self.pool.release(KEY, connection, shared=True)
+        new = self.pool.acquire(KEY, Connection, failing_check, shared=True)
+        self.assertIsNot(new, connection)
+        self.assertTrue(connection.closed)
+        self.assertIs(self.pool.shared[KEY].connection, new)
+
+    def test_discard_in_use(self):
+        connection = self.pool.acquire(KEY, Connection, check, shared=True)
+        self.pool.discard(KEY, connection)
+        self.assertNotIn(KEY, self.pool.shared)
+        self.assertTrue(connection.closed)
+        # the release of a discarded connection does not put it back
+        self.pool.release(KEY, connection, shared=True)
+        self.assertNotIn(KEY, self.pool.shared)
+
+    def test_release_discarded_shared(self):
+        connection = self.pool.acquire(KEY, Connection, check, shared=True)
+        other = Connection()
+        self.pool.release(KEY, other, shared=True)
+        self.assertTrue(other.closed)
+        self.assertFalse(connection.closed)
+
+    def test_evict(self):
+        pool = ConnectionPool(idle_timeout=-1)
+        shared = pool.acquire(KEY, Connection, check, shared=True)
+        exclusive = pool.acquire(KEY, Connection, check)
+        pool.release(KEY, exclusive)
+        pool.evict()
+        # the shared connection is still in use
+        self.assertFalse(shared.closed)
+        self.assertTrue(exclusive.closed)
+        self.assertEqual(pool.idle[KEY], [])
+        pool.release(KEY, shared, shared=True)
+        pool.evict()
+        self.assertTrue(shared.closed)
+        self.assertNotIn(KEY, pool.shared)
+
+    def test_not_evicted(self):
+        connection = self.pool.acquire(KEY, Connection, check)
+        self.pool.release(KEY, connection)
+        self.pool.evict()
+        self.assertFalse(connection.closed)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+The adaptive polling interval of the file devices.
+"""
+
+from __future__ import unicode_literals
+
+from django.test import SimpleTestCase
+
+from pyscada.file.schedule import BACKOFF, DUE_MARGIN, AdaptiveInterval
+
+
+class AdaptiveIntervalTest(SimpleTestCase):
+    def test_bounds(self):
+        schedule = AdaptiveInterval(-1, -5)
+        self.assertEqual((schedule.minimum, schedule.maximum), (0.0, 0.0))
+        schedule.set_bounds(2, 1)
+        self.assertEqual((schedule.minimum, schedule.maximum), (2, 2))
+        self.assertEqual(AdaptiveInterval(1, 100).interval, 1)
+
+    def test_unchanged_file(self):
+        schedule = AdaptiveInterval(1, 100)
+        intervals = [schedule.update(5.0, 0) for _ in range(14)]
+        self.assertEqual(intervals[:3], [1, BACKOFF, BACKOFF**2])
+        self.assertEqual(intervals[-1], 100)
+
+    def test_periodic_changes(self):
+        schedule = AdaptiveInterval(1, 100)
+        for poll in range(6):
+            interval = schedule.update(10.0 * poll, 0)
+        # half of the period of the changes
+        self.assertEqual(interval, 5)
+
+    def test_change_after_backoff(self):
+        schedule = AdaptiveInterval(1, 100)
+        schedule.update(0.0, 0)
+        schedule.update(4.0, 0)
+        for _ in range(10):
+            schedule.update(4.0, 0)
+        self.assertEqual(schedule.interval, 100)
+        self.assertEqual(schedule.update(8.0, 0), 2)
+
+    def test_history(self):
+        schedule = AdaptiveInterval(0, 1000)
+        for mtime in (0, 100, 200, 300, 400, 402, 404, 406, 408):
+            schedule.update(float(mtime), 0)
+        # the oldest changes are forgotten
+        self.assertEqual(schedule.interval, 1)
+
+    def test_unknown_mtime(self):
+        schedule = AdaptiveInterval(1, 100)
+        schedule.update(0.0, 0)
+        schedule.update(0.0, 0)
+        self.assertEqual(schedule.update(None, 0), 1)
+
+    def test_due(self):
+        schedule = AdaptiveInterval(10, 100)
+        self.assertTrue(schedule.due(0))
+        schedule.update(None, 50)
+        self.assertFalse(schedule.due(55))
+        self.assertTrue(schedule.due(60 - 10 * DUE_MARGIN))
+        self.assertTrue(schedule.due(60))
+
+    def test_retry(self):
+        schedule = AdaptiveInterval(1, 100)
+        for _ in range(3):
+            schedule.update(0.0, 0)
+        interval = schedule.interval
+        schedule.retry(20)
+        self.assertEqual(schedule.interval, interval)
+        self.assertEqual(schedule.next_poll, 20 + interval)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+The csv, json, ini, keyvalue and table programs.
+"""
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+
+from pyscada.file.devices.structured import (
+    Samples,
+    compile_query,
+    format_value,
+    numpy_ok,
+    parse,
+    parse_timestamp,
+)
+
+CSV = "time;temp;hum\n10;21.5;40\n20;22;41\n30;22.5;\n"
+JSON = '{"a": {"list": [1, 2, {"other key": true}]}, "b": null}'
+INI = "top = 1\n[sensor]\nvalue = 21.5\nunit=C\n"
+KEYVALUE = "# comment\ntemp = 21.5\nname='room 1'\nnot a value\ntemp=22\n"
+TABLE = "# log\ntime,temp,hum\n10,21.5,40\n20,22,nan\n30,22.5,42\n"
+
+
+def lookup(program, command, text):
+    return compile_query(program, command).lookup(parse(program, text))
+
+
+class StructuredTest(SimpleTestCase):
+    def test_csv(self):
+        self.assertEqual(lookup("csv", "temp", CSV), "22.5")
+        self.assertEqual(lookup("csv", "2:1", CSV), "temp")
+        self.assertEqual(lookup("csv", "temp:1", CSV), "21.5")
+        self.assertEqual(lookup("csv", "hum:-2", CSV), "41")
+        self.assertEqual(lookup("csv", "hum", CSV), "")
+        self.assertIsNone(lookup("csv", "temp:9", CSV))
+        self.assertIsNone(lookup("csv", "missing", CSV))
+        self.assertEqual(lookup("csv", "2", "1,2\n3,4\n"), "4")
+
+    def test_json(self):
+        self.assertEqual(lookup("json", "$.a.list[1]", JSON), 2)
+        self.assertIs(lookup("json", "a.list[-1]['other key']", JSON), True)
+        self.assertEqual(lookup("json", 'a["list"]', JSON), [1, 2, {"other key": True}])
+        self.assertIsNone(lookup("json", "$.b", JSON))
+        self.assertIsNone(lookup("json", "$.a[0]", JSON))
+        self.assertIsNone(lookup("json", "$.a.list.x", JSON))
+        self.assertIsNone(lookup("json", "$.a.list[5]", JSON))
+
+    def test_ini(self):
+        self.assertEqual(lookup("ini", "sensor/value", INI), "21.5")
+        self.assertEqual(lookup("ini", "top", INI), "1")
+        self.assertEqual(lookup("ini", "sensor/top", INI), "1")
+        self.assertIsNone(lookup("ini", "other/value", INI))
+        self.assertIsNone(lookup("ini", "sensor/missing", INI))
+
+    def test_keyvalue(self):
+        self.assertEqual(lookup("keyvalue", "temp", KEYVALUE), "22")
+        self.assertEqual(lookup("keyvalue", "name", KEYVALUE), "room 1")
+        self.assertIsNone(lookup("keyvalue", "not a value", KEYVALUE))
+
+    def test_invalid_commands(self):
+        for program, command in (
+            ("csv", "temp:x"),
+            ("csv", "0"),
+            ("csv", "temp:0"),
+            ("json", "$.a[x"),
+            ("ini", "sensor/"),
+            ("table", "temp:median"),
+            ("table", "0:last"),
+        ):
+            with self.subTest(program=program, command=command):
+                with self.assertLogs("pyscada.file.devices.structured", "WARNING"):
+                    self.assertIsNone(compile_query(program, command))
+        self.assertIsNone(compile_query("awk", "{print}"))
+
+    def test_format_value(self):
+        self.assertIsNone(format_value(None))
+        self.assertEqual(format_value("1.5"), "1.5")
+        self.assertEqual(format_value(True), "1")
+        self.assertEqual(format_value(False), "0")
+        self.assertEqual(format_value(2), "2")
+        self.assertEqual(format_value(2.5), "2.5")
+        self.assertEqual(format_value({"a": [1]}), '{"a": [1]}')
+
+    def test_parse_timestamp(self):
+        self.assertEqual(parse_timestamp(" 12.5 "), 12.5)
+        self.assertEqual(
+            parse_timestamp("2024-01-02T03:04:05"),
+            datetime(2024, 1, 2, 3, 4, 5).timestamp(),
+        )
+        self.assertEqual(
+            parse_timestamp("02/01/2024 03:04", "%d/%m/%Y %H:%M"),
+            datetime(2024, 1, 2, 3, 4).timestamp(),
+        )
+        with self.assertRaises(ValueError):
+            parse_timestamp("yesterday")
+
+    def test_csv_samples(self):
+        query = compile_query("csv", "temp")
+        self.assertTrue(query.every_row)
+        self.assertFalse(compile_query("csv", "temp:1").every_row)
+        samples = query.samples(parse("csv", CSV), "time", "")
+        self.assertIsInstance(samples, Samples)
+        self.assertEqual(samples, [(10.0, "21.5"), (20.0, "22"), (30.0, "22.5")])
+        self.assertEqual(
+            compile_query("csv", "2").samples(parse("csv", "1,a\n2,b\nx,c\n"), 0, ""),
+            [(1.0, "a"), (2.0, "b")],
+        )
+        self.assertEqual(query.samples(parse("csv", CSV), "missing", ""), [])
+
+
+@skipUnless(numpy_ok, "needs numpy")
+class TableTest(SimpleTestCase):
+    def test_rows(self):
+        self.assertEqual(lookup("table", "temp", TABLE), 22.5)
+        self.assertEqual(lookup("table", "temp:1", TABLE), 21.5)
+        self.assertEqual(lookup("table", "3:-3", TABLE), 40.0)
+        self.assertIsNone(lookup("table", "hum:2", TABLE))
+        self.assertIsNone(lookup("table", "temp:9", TABLE))
+        self.assertIsNone(lookup("table", "missing", TABLE))
+        self.assertIsNone(lookup("table", "5", TABLE))
+
+    def test_aggregates(self):
+        for command, value in (
+            ("temp:last", 22.5),
+            ("temp:first", 21.5),
+            ("temp:mean", 22.0),
+            ("temp:min", 21.5),
+            ("temp:max", 22.5),
+            ("temp:sum", 66.0),
+            ("temp:count", 3),
+            ("hum:count", 2),
+            ("hum:mean", 41.0),
+        ):
+            with self.subTest(command=command):
+                self.assertEqual(lookup("table", command, TABLE), value)
+
+    def test_without_header(self):
+        self.assertEqual(lookup("table", "2:sum", "1 2\n3 4\n"), 6.0)
+        self.assertIsNone(parse("table", "1 2\n3 4\n").names)
+
+    def test_invalid_cells(self):
+        # the short rows are skipped with a warning of numpy
+        with self.assertWarns(Warning):
+            self.assertEqual(lookup("table", "2:count", "a,b\n1,2\n3,x\n5\n"), 1)
+
+    def test_empty(self):
+        self.assertIsNone(lookup("table", "1", ""))
+        self.assertIsNone(lookup("table", "temp:mean", "time,temp\n"))
+        self.assertEqual(lookup("table", "temp:count", "time,temp\n"), 0)
+
+    def test_samples(self):
+        query = compile_query("table", "hum")
+        samples = query.samples(parse("table", TABLE), "time", "")
+        self.assertIsInstance(samples, Samples)
+        # the missing values are skipped
+        self.assertEqual(samples, [(10.0, 40.0), (30.0, 42.0)])
+        text = "time,temp\n2024-01-02T03:04:05,1\n2024-01-02T03:04:06,2\n"
+        self.assertEqual(
+            compile_query("table", "temp").samples(parse("table", text), "time", ""),
+            [
+                (datetime(2024, 1, 2, 3, 4, 5).timestamp(), 1.0),
+                (datetime(2024, 1, 2, 3, 4, 6).timestamp(), 2.0),
+            ],
+        )
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+The streamed and in-place writes of the local files.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+
+from pyscada.file.devices.extractors import compile_extractor
+from pyscada.file.devices.writer import (
+    patch_in_place,
+    replace_file,
+    stream_native,
+    stream_pipeline,
+)
+
+TEXT = "temp 21.5\nhum  40.0\nstatus ok\n"
+
+
+class WriterTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.file_path = os.path.join(self.directory, "values.txt")
+        with open(self.file_path, "w") as f:
+            f.write(TEXT)
+        os.chmod(self.file_path, 0o640)
+
+    def read(self):
+        with open(self.file_path) as f:
+            return f.read()
+
+    def assertNoTemporaryFile(self):
+        self.assertEqual(os.listdir(self.directory), ["values.txt"])
+
+    def test_replace_file(self):
+        replace_file(self.file_path, "new\r\n")
+        with open(self.file_path, "rb") as f:
+            self.assertEqual(f.read(), b"new\r\n")
+        self.assertEqual(os.stat(self.file_path).st_mode & 0o777, 0o640)
+        self.assertNoTemporaryFile()
+
+    def test_stream_native(self):
+        stream_native(
+            self.file_path,
+            [
+                compile_extractor("sed", "s/temp/T/"),
+                compile_extractor("sed", "/status/d"),
+            ],
+        )
+        self.assertEqual(self.read(), "T 21.5\nhum  40.0\n")
+        self.assertEqual(os.stat(self.file_path).st_mode & 0o777, 0o640)
+        self.assertNoTemporaryFile()
+
+    def test_stream_native_missing_file(self):
+        os.remove(self.file_path)
+        with self.assertRaises(FileNotFoundError):
+            stream_native(self.file_path, [compile_extractor("sed", "s/a/b/")])
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @skipUnless(shutil.which("sed"), "needs sed")
+    def test_stream_pipeline(self):
+        self.assertTrue(
+            stream_pipeline(
+                self.file_path, [("sed", "s/temp/T/"), ("sed", "2d")], timeout=5
+            )
+        )
+        self.assertEqual(self.read(), "T 21.5\nstatus ok\n")
+        self.assertNoTemporaryFile()
+
+    @skipUnless(shutil.which("sed"), "needs sed")
+    def test_stream_pipeline_error(self):
+        with self.assertLogs("pyscada.file.devices.writer", "WARNING"):
+            self.assertFalse(
+                stream_pipeline(
+                    self.file_path, [("sed", "s/temp/T/"), ("sed", "s/a")], timeout=5
+                )
+            )
+        # the file is unchanged when a command failed
+        self.assertEqual(self.read(), TEXT)
+        self.assertNoTemporaryFile()
+
+    def test_patch_in_place(self):
+        inode = os.stat(self.file_path).st_ino
+        self.assertTrue(
+            patch_in_place(self.file_path, [compile_extractor("sed", "s/40.0/41.5/")])
+        )
+        self.assertEqual(self.read(), "temp 21.5\nhum  41.5\nstatus ok\n")
+        self.assertEqual(os.stat(self.file_path).st_ino, inode)
+
+    def test_patch_last_line_without_new_line(self):
+        with open(self.file_path, "w") as f:
+            f.write("a 1\nb 2")
+        self.assertTrue(
+            patch_in_place(self.file_path, [compile_extractor("sed", "s/2/3/")])
+        )
+        self.assertEqual(self.read(), "a 1\nb 3")
+
+    def test_patch_length_changes(self):
+        self.assertFalse(
+            patch_in_place(self.file_path, [compile_extractor("sed", "s/ok/fail/")])
+        )
+        self.assertEqual(self.read(), TEXT)
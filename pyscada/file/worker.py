@@ -3,8 +3,22 @@
 
 from __future__ import unicode_literals
 
-from pyscada.utils.scheduler import SingleDeviceDAQProcessWorker
+from pyscada.utils.scheduler import MultiDeviceDAQProcessWorker
+from pyscada.utils.scheduler import MultiDeviceDAQProcess
+from pyscada.models import Device
 from . import PROTOCOL_ID
+from .devices import read_task_pending
+from .inotify import wait_for_changes
+from .metrics import metrics
+from .models import FileDevice
+from .schedule import AdaptiveInterval
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+import os
+from time import time
+import traceback
 
 import logging
 
@@ -12,9 +26,244 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-class Process(SingleDeviceDAQProcessWorker):
+class Process(MultiDeviceDAQProcessWorker):
+    """
+    Spawn the DAQ processes of the file devices, each one polling up to
+    devices_per_process devices (1 by default). Set it in the
+    process_class_kwargs, for example : {"dt_set":30, "devices_per_process":50}
+    """
+
     device_filter = dict(filedevice__isnull=False, protocol_id=PROTOCOL_ID)
     bp_label = "pyscada.file-%s"
+    process_class = "pyscada.file.worker.FileDAQProcess"
+
+    def __init__(self, dt=5, devices_per_process=1, **kwargs):
+        self.devices_per_process = max(1, int(devices_per_process))
+        self.groups = {}
+        super(MultiDeviceDAQProcessWorker, self).__init__(dt=dt, **kwargs)
+
+    def init_process(self):
+        pks = (
+            Device.objects.filter(active=True, **self.device_filter)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        self.groups = {
+            pk: index // self.devices_per_process for index, pk in enumerate(pks)
+        }
+        return super().init_process()
+
+    def gen_group_id(self, item):
+        if self.devices_per_process == 1:
+            return item.pk
+        return f"group-{self.groups.get(item.pk, item.pk)}"
+
+
+class ConcurrentRequests:
+    """
+    The data of the devices of a cycle, requested together in the threads of
+    the process when the core loop asks for the data of the first device,
+    after the write tasks, so that every read is used in the same cycle
+    """
+
+    def __init__(self, process, devices, only=None):
+        self.process = process
+        self.devices = devices
+        # pks of the devices to read, the others waiting for their interval
+        self.only = only
+        self.data = None
+
+    def get(self, pk):
+        if self.only is not None and pk not in self.only:
+            return []
+        if self.data is None:
+            devices = {
+                pk: device
+                for pk, device in self.devices.items()
+                if self.only is None or pk in self.only
+            }
+            self.data = dict(
+                zip(
+                    devices.keys(),
+                    self.process.executor.map(
+                        self.process.request_data, devices.keys(), devices.values()
+                    ),
+                )
+            )
+        if pk not in self.data:
+            # asked again in the same cycle
+            return self.process.request_data(pk, self.devices[pk])
+        return self.data.pop(pk)
+
+
+class ConcurrentDevice:
+    """
+    A device whose data is requested with the other devices of the process
+    """
+
+    def __init__(self, device, requests, pk):
+        self._device = device
+        self._requests = requests
+        self._pk = pk
+
+    def request_data(self):
+        return self._requests.get(self._pk)
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+
+class FileDAQProcess(MultiDeviceDAQProcess):
+    """
+    Poll the devices of the group concurrently, the blocking ssh and ftp
+    transfers of a slow host not delaying the others.
+
+    For local files read on change, wait for a change of one of the files
+    before each cycle, up to dt_set seconds, so that a change is read within
+    milliseconds : the devices of the changed files are read at once, the
+    others at their polling interval.
+
+    Apply the batched writes of the devices not read during the cycle, at
+    the end of the cycle.
+
+    Export the metrics of the devices after each cycle, as set in the
+    PYSCADA_FILE dict of the settings, see pyscada.file.metrics.
+
+    With adaptive polling, the process runs at the smallest minimum polling
+    interval of its devices, the handlers skipping the cycles until their
+    next poll, and the other devices of the group keep their own polling
+    interval.
+    """
+
+    max_threads = 8
+
+    def init_process(self):
+        # the devices are created again, with their file watchers
+        self.close_devices()
+        self.watchers = {}
+        if getattr(self, "executor", None) is not None:
+            self.executor.shutdown(wait=False)
+        result = super().init_process()
+        self.executor = None
+        if len(self.devices) > 1:
+            self.executor = ThreadPoolExecutor(
+                max_workers=min(self.max_threads, len(self.devices)),
+                thread_name_prefix="pyscada.file",
+            )
+        # the watchers of the handlers, closed with them
+        for pk, device in self.devices.items():
+            watcher = device.file_watcher()
+            if watcher is not None:
+                self.watchers[pk] = watcher
+        self.intervals = {}
+        file_devices = list(
+            FileDevice.objects.filter(
+                file_device_id__in=self.devices.keys()
+            ).values_list(
+                "file_device_id",
+                "file_device__polling_interval",
+                "adaptive_polling",
+                "min_polling_interval",
+            )
+        )
+        minimum = min(
+            (interval for pk, polling, adaptive, interval in file_devices if adaptive),
+            default=None,
+        )
+        if minimum is not None and minimum < self.dt_query_data:
+            self.dt_set = min(self.dt_set, minimum)
+            self.dt_query_data = minimum
+            for pk, polling, adaptive, interval in file_devices:
+                if not adaptive:
+                    self.intervals[pk] = AdaptiveInterval(polling, polling)
+        return result
+
+    def loop(self):
+        try:
+            return self.read_devices()
+        finally:
+            self.write_pending()
+            metrics.export(self.process_id, getattr(settings, "PYSCADA_FILE", {}))
+
+    def read_devices(self):
+        changed = None
+        if self.watchers:
+            watchers = wait_for_changes(list(self.watchers.values()), self.dt_set)
+            pks = {pk for pk, watcher in self.watchers.items() if watcher in watchers}
+            for pk in pks:
+                # the events were consumed here
+                self.devices[pk].file_changed()
+            if pks and time() - self.last_query <= self.dt_query_data:
+                # read the changed files now, the core loop reads when
+                # dt_query_data elapsed since its last read
+                changed = pks
+                last_query, self.last_query = self.last_query, 0
+        try:
+            return self.read_changed(changed)
+        finally:
+            if changed is not None:
+                # the other devices keep their polling interval
+                self.last_query = last_query
+
+    def read_changed(self, changed):
+        """
+        run the core loop, reading only the changed devices if not None
+        """
+        if self.executor is None:
+            return super().loop()
+        devices = self.devices
+        requests = ConcurrentRequests(self, devices, changed)
+        self.devices = {
+            pk: ConcurrentDevice(device, requests, pk) for pk, device in devices.items()
+        }
+        try:
+            return super().loop()
+        finally:
+            self.devices = devices
+
+    def request_data(self, pk, device):
+        interval = self.intervals.get(pk)
+        if interval is not None:
+            # polled at its own interval in a process sped up by the others,
+            # or when a read task asks for it
+            if not interval.due(time()) and not read_task_pending(pk):
+                return []
+            interval.update(None, time())
+        close_old_connections()
+        try:
+            return device.request_data()
+        except Exception:
+            logger.exception(f"Request data of {device} failed")
+            return []
+
+    def write_pending(self):
+        """
+        apply the batched writes of the cycle when the devices were not read
+        """
+        for device in self.devices.values():
+            try:
+                device.write_pending()
+            except:
+                logger.warning(traceback.format_exc())
+
+    def close_devices(self):
+        """
+        release the connections and file watchers of the handlers
+        """
+        for device in getattr(self, "devices", {}).values():
+            try:
+                device.cleanup()
+            except:
+                logger.warning(traceback.format_exc())
 
-    def __init__(self, dt=5, **kwargs):
-        super(SingleDeviceDAQProcessWorker, self).__init__(dt=dt, **kwargs)
+    def cleanup(self):
+        folder = getattr(settings, "PYSCADA_FILE", {}).get("metrics_folder")
+        if folder:
+            try:
+                os.remove(os.path.join(folder, f"pyscada_file_{self.process_id}.prom"))
+            except OSError:
+                pass
+        self.close_devices()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        return super().cleanup()
@@ -35,7 +35,13 @@ setup(
         "ftputil",
         "paramiko",
     ],
-    packages=find_namespace_packages(exclude=["project", "project.*"]),
+    extras_require={
+        "zstd": ["zstandard"],
+        "table": ["numpy"],
+    },
+    packages=find_namespace_packages(
+        exclude=["project", "project.*", "benchmarks", "benchmarks.*"]
+    ),
     include_package_data=True,
     zip_safe=False,
     test_suite="runtests.main",